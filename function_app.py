@@ -1,13 +1,44 @@
 import azure.functions as func
+import os
+import time
 import logging
 import json
+from datetime import datetime, timezone, timedelta
 from src.auth_manager import AuthManager
 from src import api_client
 from src import state_manager
 from src import notifier
+from src import issue_query
+from src import sweep
+from src import scheduler
+from src import coordination
+from src import token_refresher
+from src import render_cache
+from src import profiling
+from src import pipeline
+from src import aggregates
+from src import change_feed
+from src import metrics
+from src import hedging
+from src import deadline
+from src.models import Issue, issues_from_dicts, issues_to_dicts
 
 app = func.FunctionApp()
 
+# 差分取得の全件突き合わせ状態
+DELTA_STATE_BLOB_NAME = "delta-fetch-state.json"
+
+# Durable Functions のファンアウト取得（azure-functions-durable がある場合のみ登録）
+try:
+    from src import durable_fanout
+    app.register_functions(durable_fanout.bp)
+except ImportError as e:
+    durable_fanout = None
+    logging.warning(f"Durable fan-out is not available: {e}")
+
+# 同一インスタンス内の同時実行をまとめる
+_run_flight = coordination.SingleFlight()
+
 # TZ=Asia/Tokyo が設定されているため、cron式はJST基準
 # 毎日 JST 9:00 にトリガー
 @app.schedule(schedule="0 0 9 * * *", arg_name="myTimer", run_on_startup=False,
@@ -19,11 +50,28 @@ def timer_trigger(myTimer: func.TimerRequest) -> None:
 
     logging.info('Python timer trigger function started.')
 
+    # アダプティブポーリングが有効な場合は adaptive_trigger が取得を担当
+    if scheduler.is_enabled():
+        logging.info('Adaptive polling is enabled. Skipping fixed daily run.')
+        return
+
+    # ファンアウト取得が有効な場合は fanout_timer が取得を担当
+    if durable_fanout is not None and durable_fanout.is_enabled():
+        logging.info('Durable fan-out is enabled. Skipping fixed daily run.')
+        return
+
     try:
-        run_job()
+        # キュー連携のパイプラインでは取得ステージを起動するだけ
+        if pipeline.is_enabled():
+            pipeline.enqueue_fetch("timer")
+            return
+        with deadline.start():
+            run_job_once()
     except Exception as e:
         logging.error(f"Job failed: {e}", exc_info=True)
         raise  # エラーを再スローして Azure Functions に失敗を通知
+    finally:
+        metrics.flush()
 
 # TZ=Asia/Tokyo が設定されているため、cron式はJST基準
 # 毎日 JST 21:00 にトークンをリフレッシュ
@@ -37,17 +85,93 @@ def token_refresh_trigger(myTimer: func.TimerRequest) -> None:
     logging.info('Token refresh trigger started.')
 
     try:
-        refresh_token_only()
+        with deadline.start():
+            refresh_token_only()
     except Exception as e:
         logging.error(f"Token refresh failed: {e}", exc_info=True)
         raise  # エラーを再スローして Azure Functions に失敗を通知
 
+# 15分ごとに起動し、取得するかどうかはスケジューラが判断（ADAPTIVE_POLLING=true の場合のみ）
+@app.schedule(schedule="0 */15 * * * *", arg_name="myTimer", run_on_startup=False,
+              use_monitor=True)
+def adaptive_trigger(myTimer: func.TimerRequest) -> None:
+    """変更頻度・トークン有効期限に応じて全件取得・プローブを行う"""
+    if not scheduler.is_enabled():
+        return
+
+    # 取得もプローブもしなかった回はメトリクスを保存しない（最後の実行の値を残す）
+    ran = True
+    try:
+        with deadline.start():
+            ran = run_adaptive_tick()
+    except Exception as e:
+        logging.error(f"Adaptive tick failed: {e}", exc_info=True)
+        raise
+    finally:
+        if ran:
+            metrics.flush()
+
+# キュー連携のパイプライン（QUEUE_PIPELINE=true の場合に timer_trigger から起動）
+# 失敗したメッセージは host.json の maxDequeueCount まで再配信され、超えると <キュー名>-poison へ
+@app.queue_trigger(arg_name="msg", queue_name=pipeline.FETCH_QUEUE, connection="AzureWebJobsStorage")
+def fetch_stage(msg: func.QueueMessage) -> None:
+    """取得ステージ: スナップショットを保存して差分キューへ"""
+    message = json.loads(msg.get_body().decode("utf-8"))
+    logging.info(f"Fetch stage started: {message.get('run_id')} (dequeue count: {msg.dequeue_count})")
+
+    # トークンは実行ロックを取得できてから取得する（送り直すだけのメッセージでは更新しない）
+    auth_managers = []
+
+    def get_token() -> str:
+        token, auth_manager = acquire_token()
+        auth_managers.append(auth_manager)
+        return token
+
+    with deadline.start():
+        try:
+            pipeline.run_fetch_stage(message, get_token)
+        finally:
+            for auth_manager in auth_managers:
+                if not auth_manager.flush():
+                    logging.warning("Key Vault update is still pending.")
+
+@app.queue_trigger(arg_name="msg", queue_name=pipeline.DIFF_QUEUE, connection="AzureWebJobsStorage")
+def diff_stage(msg: func.QueueMessage) -> None:
+    """差分ステージ: 変更イベントを作成して通知キューへ"""
+    message = json.loads(msg.get_body().decode("utf-8"))
+    logging.info(f"Diff stage started: {message.get('run_id')} (dequeue count: {msg.dequeue_count})")
+    with deadline.start():
+        pipeline.run_diff_stage(message)
+
+@app.queue_trigger(arg_name="msg", queue_name=pipeline.NOTIFY_QUEUE, connection="AzureWebJobsStorage")
+def notify_stage(msg: func.QueueMessage) -> None:
+    """通知ステージ: 変更イベントのバッチを通知"""
+    message = json.loads(msg.get_body().decode("utf-8"))
+    logging.info(f"Notify stage started: {message.get('run_id')} (dequeue count: {msg.dequeue_count})")
+    with deadline.start():
+        pipeline.run_notify_stage(message)
+
 @app.route(route="manual_trigger", auth_level=func.AuthLevel.FUNCTION)
 def manual_trigger(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
+    # profile=inline|blob（または ENABLE_PROFILING）の場合のみ計測する
+    profile_mode = profiling.get_profile_mode(req.params.get("profile"))
+
     try:
-        data = run_job()
+        with deadline.start():
+            if profile_mode:
+                try:
+                    data, report = profiling.profile_call(run_job_once, profile_mode)
+                    data = {**data, "profile": report}
+                except profiling.ProfilerBusyError as e:
+                    # 明示的に要求された場合は 409、ENABLE_PROFILING による計測なら計測せずに実行
+                    if req.params.get("profile"):
+                        return func.HttpResponse(str(e), status_code=409)
+                    logging.info(f"{e}. Running without profiling.")
+                    data = run_job_once()
+            else:
+                data = run_job_once()
         return func.HttpResponse(
             json.dumps(data, indent=2, ensure_ascii=False),
             mimetype="application/json",
@@ -59,36 +183,168 @@ def manual_trigger(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500
         )
 
-def run_job():
+@app.route(route="issues", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+def issues_query(req: func.HttpRequest) -> func.HttpResponse:
     """
-    メインジョブ: 既知の問題を取得し、前回実行以降の更新をフィルタリング
+    最新スナップショットを読み取り専用で返す（API呼び出し・通知なし）
+
+    クエリ: product, state, changed_since, limit, cursor, format=json|ndjson
+    If-None-Match ヘッダーが一致すれば 304 を返す
     """
-    logging.info("Initializing AuthManager...")
-    auth_manager = AuthManager()
+    try:
+        params = dict(req.params)
+        if "application/x-ndjson" in (req.headers.get("Accept") or "") and "format" not in params:
+            params["format"] = issue_query.FORMAT_NDJSON
+        query = issue_query.parse_params(params)
+    except (ValueError, TypeError) as e:
+        return func.HttpResponse(str(e), status_code=400)
 
-    logging.info("Getting access token...")
-    token = auth_manager.get_access_token()
+    try:
+        snapshot, snapshot_etag = issue_query.get_cached_snapshot()
+    except Exception as e:
+        logging.error(f"Failed to load snapshot: {e}", exc_info=True)
+        return func.HttpResponse(f"Failed to load snapshot: {str(e)}", status_code=500)
 
-    logging.info("Fetching known issues...")
-    all_data = api_client.get_known_issues(token)
+    if snapshot is None:
+        return func.HttpResponse("No snapshot available yet", status_code=404)
 
-    total_count = len(all_data) if isinstance(all_data, list) else 0
-    logging.info(f"Retrieved {total_count} total issues.")
+    etag = issue_query.compute_etag(snapshot_etag, params)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if issue_query.etag_matches(req.headers.get("If-None-Match"), etag):
+        return func.HttpResponse(status_code=304, headers=headers)
 
-    # 前回実行日時を取得してフィルタリング
-    last_run = state_manager.get_last_run_time()
-    logging.info(f"Filtering issues changed since: {last_run}")
+    try:
+        page, next_cursor = issue_query.query_issues(snapshot.get("issues", []), query)
+    except (ValueError, TypeError) as e:
+        return func.HttpResponse(f"Invalid query: {e}", status_code=400)
 
-    if isinstance(all_data, list):
-        new_items = state_manager.filter_by_changed_date(all_data, last_run)
+    if query["format"] == issue_query.FORMAT_NDJSON:
+        body = "".join(issue_query.render_ndjson(page, next_cursor))
+        mimetype = "application/x-ndjson"
     else:
-        new_items = []
+        body = issue_query.render_json(snapshot, page, next_cursor)
+        mimetype = "application/json"
+
+    return func.HttpResponse(body, mimetype=mimetype, status_code=200, headers=headers)
+
+@app.route(route="aggregates", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+def aggregates_view(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    集計ビュー（製品別の未解決件数・状態別件数・日別の新規/解決件数・平均解決時間）を返す
+
+    実行ごとに更新済みの aggregates.json を返すだけで、スナップショットは読まない
+    """
+    try:
+        view, etag = aggregates.load_view()
+    except Exception as e:
+        logging.error(f"Failed to load aggregates: {e}", exc_info=True)
+        return func.HttpResponse(f"Failed to load aggregates: {str(e)}", status_code=500)
+
+    if view is None:
+        return func.HttpResponse("No aggregates available yet", status_code=404)
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+    if etag and issue_query.etag_matches(req.headers.get("If-None-Match"), etag):
+        return func.HttpResponse(status_code=304, headers=headers)
+
+    return func.HttpResponse(
+        json.dumps(view, ensure_ascii=False),
+        mimetype="application/json",
+        status_code=200,
+        headers=headers
+    )
+
+@app.route(route="metrics", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+def metrics_view(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    メトリクスを Prometheus のテキスト形式で返す
+
+    クエリ: source=blob で最後のタイマー実行が保存した値（省略時はこのインスタンスの値）
+    """
+    snapshot = None
+    if req.params.get("source") == "blob":
+        try:
+            snapshot = metrics.load_flushed()
+        except Exception as e:
+            logging.error(f"Failed to load metrics: {e}", exc_info=True)
+            return func.HttpResponse(f"Failed to load metrics: {str(e)}", status_code=500)
+        if snapshot is None:
+            return func.HttpResponse("No metrics flushed yet", status_code=404)
+
+    return func.HttpResponse(
+        metrics.render(snapshot),
+        mimetype="text/plain",
+        status_code=200,
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8", "Cache-Control": "no-cache"}
+    )
+
+@app.route(route="changes", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+def changes_feed(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    変更フィードを cursor の続きから NDJSON で返す（API呼び出し・通知なし）
+
+    クエリ: cursor（前回の next_cursor。省略時は保持している最初から）, limit
+    最終行は {"next_cursor", "has_more"}。cursor が保持期間より古ければ 410
+    """
+    try:
+        params = change_feed.parse_params(dict(req.params))
+    except ValueError as e:
+        return func.HttpResponse(str(e), status_code=400)
+
+    try:
+        page = change_feed.read(params["cursor"], params["limit"])
+    except change_feed.CursorExpiredError as e:
+        return func.HttpResponse(str(e), status_code=410)
+    except Exception as e:
+        logging.error(f"Failed to read change feed: {e}", exc_info=True)
+        return func.HttpResponse(f"Failed to read change feed: {str(e)}", status_code=500)
+
+    return func.HttpResponse(
+        "".join(change_feed.render_ndjson(page)),
+        mimetype="application/x-ndjson",
+        status_code=200,
+        headers={"X-Next-Cursor": str(page["next_cursor"]), "Cache-Control": "no-cache"}
+    )
+
+def run_job_once(token=None, first_page=None):
+    """
+    多重実行を防いで run_job を実行
+
+    同じインスタンスで実行中なら完了を待って結果を共有し、別インスタンスが
+    実行中（Blob リース保持中）ならその完了を待って保存された結果を返す
+    """
+    return _run_flight.do("run_job", lambda: coordination.run_exclusive(lambda: run_job(token, first_page)))
+
+def run_job(token=None, first_page=None):
+    """
+    メインジョブ: 既知の問題を取得し、前回実行以降の更新をフィルタリング
+
+    Args:
+        token: 取得済みのアクセストークン（省略時はリフレッシュして取得）
+        first_page: 取得済みの先頭ページ（api_client.FirstPage、プローブの結果）。
+                    通常の1回での取得の場合のみ使い、残りだけを取得する
+    """
+    started = time.perf_counter()
+    auth_manager = None
+    if token is None:
+        logging.info("Getting access token...")
+        token, auth_manager = acquire_token()
+
+    if api_client.is_streaming_enabled() and not sweep.is_sweep_configured() and not api_client.is_delta_fetch_enabled():
+        new_items, total_count, last_run, current_ids = _fetch_streaming(token)
+    else:
+        new_items, total_count, last_run, current_ids = _fetch_buffered(token, first_page)
 
     logging.info(f"Found {len(new_items)} new/updated issues since last run.")
 
     # 現在時刻を保存（次回実行の基準に）
     state_manager.save_last_run_time()
 
+    # 集計ビューを変更分だけ更新し、変更フィードに追記
+    if deadline.allows_optional("aggregates"):
+        aggregates.update(new_items, current_ids)
+    change_feed.record_changes(new_items)
+
     # 通知を送信（0件でも送信）
     if new_items:
         logging.info(f"New issues to notify: {[item.get('workItemId') for item in new_items]}")
@@ -97,23 +353,234 @@ def run_job():
 
     notification_sent = notifier.send_notification(new_items, total_count)
     logging.info(f"Notification sent: {notification_sent}")
+    logging.info(f"Render cache: {render_cache.get_render_cache().stats()}")
+    if hedging.is_enabled():
+        logging.info(f"Hedged requests: {hedging.stats()}")
+    if deadline.allows_optional("render cache persistence"):
+        render_cache.persist()
+
+    # 通知の後で、バックグラウンドの Key Vault 更新を待つ（インスタンス停止で失わないように）
+    if auth_manager is not None and not auth_manager.flush():
+        logging.warning("Key Vault update is still pending.")
+
+    metrics.set_gauge("issues_total", total_count)
+    metrics.set_gauge("issues_changed", len(new_items))
+    metrics.set_gauge("last_success_timestamp_seconds", time.time())
+    metrics.observe("job_seconds", time.perf_counter() - started)
 
     # 戻り値は新しいアイテムのみ
     return {
         "total_count": total_count,
         "new_count": len(new_items),
         "last_run": last_run.isoformat(),
-        "new_items": new_items
+        "new_items": issues_to_dicts(new_items)
     }
 
+def run_adaptive_tick() -> bool:
+    """
+    アダプティブポーリングの1回分
+
+    Returns:
+        取得またはプローブを行ったか（スキップした場合は False）
+    """
+    state = scheduler.load_state()
+    base = dict(state)
+    action, reason = scheduler.decide(state)
+    logging.info(f"Scheduler decision: {action} ({reason})")
+
+    if action == scheduler.ACTION_SKIP:
+        return False
+
+    token, auth_manager = acquire_token()
+
+    # プローブで変化がなければ全件取得しない（変化があればプローブの結果を先頭ページに使う）
+    first_page = None
+    if action == scheduler.ACTION_PROBE:
+        changed, first_page = scheduler.probe(token, state)
+        if not changed:
+            scheduler.save_state(state, base)
+            auth_manager.flush()
+            return True
+
+    started_at = datetime.now(timezone.utc)
+    result = run_job_once(token, first_page)
+    scheduler.record_full_fetch(
+        state, result["new_count"], auth_manager.refresh_token_expires_at,
+        now=started_at, total_count=result["total_count"]
+    )
+    scheduler.save_state(state, base)
+    auth_manager.flush()
+    return True
+
+def _fetch_buffered(token, first_page=None):
+    """
+    レスポンス全体を受信してからフィルタリング
+
+    Returns:
+        (変更アイテム, 全件数, 前回実行日時, 全件を取得できた場合は workItemId の集合・それ以外は None)
+    """
+    localized = None
+    if sweep.is_sweep_configured():
+        logging.info("Fetching known issues (locale x status x product group sweep)...")
+        result = sweep.run_sweep(token)
+        all_data, localized = result["issues"], result["localized"]
+        complete = result["complete"]
+    elif api_client.is_delta_fetch_enabled():
+        # 差分取得の結果は前回のスナップショットに重ねたもの（消えた問題は全件取得の実行で反映）
+        all_data = _fetch_delta(token)
+        complete = False
+    elif first_page is not None:
+        logging.info("Fetching known issues (after the probe page)...")
+        all_data = api_client.get_known_issues_after(token, first_page)
+        complete = isinstance(all_data, list) and api_client.is_complete(len(all_data))
+    else:
+        logging.info("Fetching known issues...")
+        all_data = api_client.get_known_issues(token)
+        complete = isinstance(all_data, list) and api_client.is_complete(len(all_data))
+
+    total_count = len(all_data) if isinstance(all_data, list) else 0
+    logging.info(f"Retrieved {total_count} total issues.")
+
+    # 最新スナップショットを保存（issues ルートから参照）
+    if isinstance(all_data, list):
+        try:
+            state_manager.save_snapshot(all_data, localized=localized)
+        except Exception as e:
+            logging.warning(f"Snapshot not saved: {e}")
+
+    # 前回実行日時を取得してフィルタリング
+    last_run = state_manager.get_last_run_time()
+    logging.info(f"Filtering issues changed since: {last_run}")
+
+    current_ids = None
+    if isinstance(all_data, list):
+        if complete:
+            current_ids = {str(item.get("workItemId")) for item in all_data if item.get("workItemId")}
+        # 生の dict を保持し続けないよう Issue に変換（description は圧縮保持）
+        issues = issues_from_dicts(all_data)
+        all_data = None
+        new_items = state_manager.filter_by_changed_date(issues, last_run)
+    else:
+        new_items = []
+
+    return new_items, total_count, last_run, current_ids
+
+def _fetch_delta(token):
+    """
+    前回実行以降に変更されたものだけを取得し、前回のスナップショットに重ねて全件にする
+
+    DELTA_FULL_RECONCILE_HOURS ごと（または前回のスナップショットがない場合）は全件取得し、
+    検索条件から外れたアイテム（状態の変化など）を取り除く
+    """
+    state = state_manager.load_json_state(DELTA_STATE_BLOB_NAME)
+    reconcile_hours = float(os.environ.get("DELTA_FULL_RECONCILE_HOURS", "24"))
+    last_full_at = state.get("last_full_at")
+    due = (
+        last_full_at is None
+        or datetime.now(timezone.utc) - datetime.fromisoformat(last_full_at) >= timedelta(hours=reconcile_hours)
+    )
+
+    previous = None
+    if not due:
+        snapshot, _ = state_manager.load_snapshot()
+        previous = snapshot.get("issues") if snapshot else None
+
+    if previous is None:
+        logging.info("Fetching known issues (full reconciliation)...")
+        all_data = api_client.get_known_issues(token)
+        complete = True
+    else:
+        since = state_manager.get_last_run_time()
+        logging.info(f"Fetching known issues (delta since {since})...")
+        all_data, complete = api_client.get_known_issues_since(token, since)
+
+    if complete:
+        state_manager.save_json_state(DELTA_STATE_BLOB_NAME, {"last_full_at": datetime.now(timezone.utc).isoformat()})
+        return all_data
+
+    # 変更分で前回のスナップショットを上書き
+    merged = {str(item.get("workItemId")): item for item in previous}
+    for item in all_data:
+        merged[str(item.get("workItemId"))] = item
+    logging.info(f"Delta fetch: {len(all_data)} fetched, {len(merged)} issues after merge.")
+    return list(merged.values())
+
+def _fetch_streaming(token):
+    """
+    レスポンスをストリーミングで読みながらフィルタリング
+
+    受信 → Issue 変換 → changedDate の抽出 → スナップショットのエンコード・アップロード を
+    ジェネレータで繋ぎ、全件はリストに保持しない（保持するのは通知する変更分だけ）
+    """
+    last_run = state_manager.get_last_run_time()
+    logging.info(f"Fetching known issues (streaming), changed since: {last_run}")
+
+    new_items = []
+    ids = set()
+    progress = {"total": 0, "done": False}
+
+    def _issues():
+        for item in api_client.iter_known_issues(token):
+            progress["total"] += 1
+            if item.get("workItemId"):
+                ids.add(str(item["workItemId"]))
+            yield Issue.from_dict(item)
+        progress["done"] = True
+
+    stream = state_manager.tap_changed_since(_issues(), last_run, new_items)
+
+    # 最新スナップショットを保存（受信しながら1件ずつエンコードしてアップロード）
+    try:
+        state_manager.save_snapshot(stream)
+    except Exception as e:
+        # アップロードが失敗しても通知のために残りを読み切る（受信側の失敗はそのまま上げる）
+        for _ in stream:
+            pass
+        if not progress["done"]:
+            raise
+        logging.warning(f"Snapshot not saved: {e}")
+
+    total_count = progress["total"]
+    logging.info(f"Retrieved {total_count} total issues.")
+    return new_items, total_count, last_run, ids if api_client.is_complete(total_count) else None
+
+def acquire_token():
+    """
+    アクセストークンを取得
+
+    PROACTIVE_TOKEN_REFRESH が有効なら準備済みのトークンを使い（失効前に
+    バックグラウンドでリフレッシュ）、無効ならその場でリフレッシュする
+
+    Returns:
+        (アクセストークン, flush() と refresh_token_expires_at を持つオブジェクト)
+    """
+    if token_refresher.is_enabled():
+        refresher = token_refresher.get_refresher()
+        return refresher.get_access_token(), refresher
+
+    logging.info("Initializing AuthManager...")
+    auth_manager = AuthManager()
+    return auth_manager.get_access_token(), auth_manager
+
 def refresh_token_only():
     """トークンのリフレッシュのみを行う（API呼び出しなし）"""
-    logging.info("Initializing AuthManager for token refresh...")
-    auth_manager = AuthManager()
+    if token_refresher.is_enabled():
+        refresher = token_refresher.get_refresher()
+        logging.info("Refreshing access token...")
+        token = refresher.refresh_now()
+        auth_manager = refresher
+        logging.info(f"Token status: {refresher.status()}")
+    else:
+        logging.info("Initializing AuthManager for token refresh...")
+        auth_manager = AuthManager()
 
-    logging.info("Refreshing access token...")
-    token = auth_manager.get_access_token()
+        logging.info("Refreshing access token...")
+        token = auth_manager.get_access_token()
 
     # トークンの一部をログに出力（確認用）
     logging.info(f"Token refreshed successfully. Token starts with: {token[:20]}...")
-    logging.info("Token refresh completed. Key Vault updated with new refresh token.")
\ No newline at end of file
+    # トークンを維持するための実行なので、保存を見送った値も Key Vault に保存する
+    if auth_manager.flush(force=True):
+        logging.info("Token refresh completed. Key Vault updated with new refresh token.")
+    else:
+        logging.warning("Token refresh completed, but Key Vault update is still pending.")
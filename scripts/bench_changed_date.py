@@ -0,0 +1,104 @@
+"""
+changedDate フィルタのベンチマーク
+
+従来の1件ずつのループ（str.replace + datetime.fromisoformat）と、
+state_manager.filter_by_changed_date（基準日時1つ）・changed_date_masks
+（1件ずつ一度だけパースして複数基準日時と比較）を計測します。
+changedDate は実データと同様にほぼ一意の値（ミリ秒付き）で作成します。
+
+使用方法:
+    python scripts/bench_changed_date.py [件数]
+
+例:
+    python scripts/bench_changed_date.py 1000000
+"""
+import os
+import sys
+import time
+import random
+from datetime import datetime, timezone, timedelta
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import state_manager
+
+
+def make_items(count):
+    """合成データを作成（過去90日間の changedDate、ミリ秒付きでほぼ一意）"""
+    random.seed(42)
+    now = datetime.now(timezone.utc)
+    items = []
+    for i in range(count):
+        changed = now - timedelta(milliseconds=random.randint(0, 90 * 86400 * 1000))
+        items.append({
+            "workItemId": str(i),
+            "changedDate": changed.strftime("%Y-%m-%dT%H:%M:%S.") + f"{changed.microsecond // 1000:03d}Z",
+        })
+    return items
+
+
+def legacy_filter(items, since):
+    """従来実装（1件ずつ replace + fromisoformat）"""
+    filtered = []
+    for item in items:
+        changed_date_str = item.get('changedDate')
+        if not changed_date_str:
+            continue
+        try:
+            changed_date = datetime.fromisoformat(changed_date_str.replace('Z', '+00:00'))
+            if changed_date > since:
+                filtered.append(item)
+        except ValueError:
+            pass
+    return filtered
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<40} {elapsed * 1000:9.1f} ms")
+    return result, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    now = datetime.now(timezone.utc)
+    cutoffs = {
+        "last_run": now - timedelta(hours=24),
+        "7d": now - timedelta(days=7),
+        "30d": now - timedelta(days=30),
+    }
+
+    print(f"合成データ作成中... ({count:,} 件)")
+    items = make_items(count)
+    print(f"  ユニークな changedDate: {len(set(item['changedDate'] for item in items)):,} 件")
+    print()
+
+    single, single_legacy_time = timed("従来ループ（1 基準日時）", lambda: legacy_filter(items, cutoffs["last_run"]))
+    filtered, single_time = timed(
+        "filter_by_changed_date（1 基準日時）",
+        lambda: state_manager.filter_by_changed_date(items, cutoffs["last_run"])
+    )
+    assert len(filtered) == len(single)
+
+    legacy = {}
+    _, legacy_time = timed(
+        "従来ループ x 3 基準日時",
+        lambda: legacy.update({name: legacy_filter(items, since) for name, since in cutoffs.items()})
+    )
+    masks, batch_time = timed("一括マスク（3 基準日時）", lambda: state_manager.changed_date_masks(items, cutoffs))
+
+    for name in cutoffs:
+        assert sum(masks[name]) == len(legacy[name]), name
+
+    print()
+    print(f"  1 基準日時: {single_legacy_time / single_time:.2f}x")
+    print(f"  3 基準日時: {legacy_time / batch_time:.2f}x")
+    for name in cutoffs:
+        print(f"  {name}: {len(legacy[name]):,} 件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Issue モデルのメモリ使用量ベンチマーク
+
+APIのレスポンスをそのまま dict で保持した場合と、src.models.Issue に
+変換した場合のアイテムあたりのメモリを tracemalloc で比較します。
+
+使用方法:
+    python scripts/bench_issue_model.py [件数]
+
+例:
+    python scripts/bench_issue_model.py 50000
+"""
+import gc
+import os
+import sys
+import json
+import random
+import tracemalloc
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models import issues_from_dicts
+
+PRODUCTS = ["Power Apps", "Power Automate", "Power Pages", "Microsoft Dataverse", "Dynamics 365 Sales"]
+STATES = ["Active", "Resolved"]
+
+# 実際の description に近い文章を作るための語彙（文はすべて組み合わせで毎回異なる）
+SUBJECTS = [
+    "キャンバスアプリ", "クラウドフロー", "モデル駆動型アプリ", "Dataverse テーブル", "カスタムコネクタ",
+    "管理センター", "ソリューションのインポート", "環境のコピー", "Copilot", "ギャラリーコントロール",
+    "SharePoint コネクタ", "Outlook トリガー", "ビジネスプロセスフロー", "セキュリティロール", "監査ログ",
+]
+PROBLEMS = [
+    "の読み込みに時間がかかる", "でエラー 0x80040216 が発生する", "の保存が失敗する",
+    "が一部のユーザーに表示されない", "のデータが重複して登録される", "の実行がタイムアウトする",
+    "で日付が UTC のまま表示される", "の権限が正しく評価されない", "のエクスポートが途中で停止する",
+]
+CONDITIONS = [
+    "特定のリージョンの環境で", "大量のレコードを含む場合に", "ゲストユーザーがアクセスした場合に",
+    "マネージドソリューションを更新した後に", "モバイルアプリから開いた場合に", "複数の言語を有効にしていると",
+]
+DETAILS = [
+    "影響を受けるテナントは限定的です。", "修正プログラムを順次展開しています。",
+    "回避策として、該当の操作を再試行してください。", "詳細はサービス正常性ダッシュボードを確認してください。",
+    "次回の更新で修正される予定です。", "調査を継続しており、進展があれば更新します。",
+]
+
+
+def make_sentence(i):
+    """条件・対象・症状・詳細を組み合わせた1文（ID・バージョン番号などを含めて毎回異なる）"""
+    return (
+        f"{random.choice(CONDITIONS)}{random.choice(SUBJECTS)}{random.choice(PROBLEMS)}ことがあります"
+        f"（ビルド {random.randint(1000, 9999)}.{random.randint(0, 99)}、ID {i}-{random.randint(0, 10**6)}）。"
+        f"{random.choice(DETAILS)}"
+    )
+
+
+def make_payload(count):
+    """合成レスポンス（JSON 文字列）を作成"""
+    random.seed(42)
+    items = []
+    for i in range(count):
+        description = "".join(
+            f"<p>{make_sentence(i)}</p>" for _ in range(random.randint(3, 10))
+        )
+        items.append({
+            "workItemId": str(4000000 + i),
+            "title": f"{random.choice(SUBJECTS)}{random.choice(PROBLEMS)}",
+            "product": random.choice(PRODUCTS),
+            "productId": "0ee2e3ac-7684-d519-19e7-b341d426aed7",
+            "state": random.choice(STATES),
+            "changedDate": f"2026-01-{random.randint(1, 28):02d}T{random.randint(0, 23):02d}:"
+                           f"{random.randint(0, 59):02d}:{random.randint(0, 59):02d}.{random.randint(0, 999):03d}Z",
+            "createdDate": f"2025-12-{random.randint(1, 28):02d}T{random.randint(0, 23):02d}:00:00Z",
+            "resolvedDate": None,
+            "description": description,
+        })
+    # 実際の取得と同様に JSON からデコードする（文字列が共有されない状態を再現）
+    return json.dumps(items, ensure_ascii=False)
+
+
+def measure(build):
+    """build() が作成したオブジェクトが保持するメモリを計測"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return result, size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    payload = make_payload(count)
+
+    dicts, dict_size = measure(lambda: json.loads(payload))
+    del dicts
+
+    issues, issue_size = measure(lambda: issues_from_dicts(json.loads(payload)))
+
+    print(f"{count:,} 件")
+    print(f"  dict  : {dict_size / 1024 / 1024:8.1f} MiB  ({dict_size / count:8.0f} B/件)")
+    print(f"  Issue : {issue_size / 1024 / 1024:8.1f} MiB  ({issue_size / count:8.0f} B/件)")
+    print(f"  削減率: {(1 - issue_size / dict_size) * 100:.1f}%")
+
+    # 展開結果が元と一致することを確認
+    original = json.loads(payload)
+    assert issues[0].to_dict() == original[0]
+    assert issues[-1].get("description") == original[-1]["description"]
+
+
+if __name__ == "__main__":
+    main()
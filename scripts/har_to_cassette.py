@@ -0,0 +1,103 @@
+"""
+HARファイルから再生用のカセットを作成
+
+トークンエンドポイントと Known Issues 検索APIのやり取りだけを取り出し、
+秘密情報を置き換えて src/cassette.py の形式で保存します。
+レイテンシには HAR に記録された所要時間（time）を使います。
+
+使用方法:
+    python scripts/har_to_cassette.py <har_file> [出力ファイル]
+
+例:
+    python scripts/har_to_cassette.py network_trace.har
+    HTTP_CASSETTE_MODE=replay HTTP_CASSETTE=data/cassette.json python scripts/known_issues_automation.py
+"""
+
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+
+# プロジェクトルートを基準にパスを設定
+SCRIPT_DIR = Path(__file__).parent
+PROJECT_ROOT = SCRIPT_DIR.parent
+DATA_DIR = PROJECT_ROOT / "data"
+
+sys.path.insert(0, str(PROJECT_ROOT))
+from requests.structures import CaseInsensitiveDict
+from src.cassette import Cassette
+
+
+def is_target(url):
+    """カセットに含めるリクエストか"""
+    if "login.microsoftonline.com" in url and "/oauth2/v2.0/token" in url:
+        return True
+    return "/support/knownissue/search" in url
+
+
+def _response_text(content):
+    """HAR の content から本文を取り出す（Base64 の場合はデコード）"""
+    text = content.get("text", "")
+    if content.get("encoding") == "base64":
+        text = base64.b64decode(text).decode("utf-8", errors="replace")
+    return text
+
+
+def convert(har_file, output_file):
+    """HAR を読み込んでカセットを保存（追加したやり取りの件数を返す）"""
+    with open(har_file, "r", encoding="utf-8") as f:
+        har = json.load(f)
+
+    cassette = Cassette(str(output_file))
+    for entry in har["log"]["entries"]:
+        request = entry["request"]
+        if request["method"] != "POST" or not is_target(request["url"]):
+            continue
+
+        response = entry.get("response", {})
+        text = _response_text(response.get("content", {}))
+        if not text:
+            continue
+
+        headers = CaseInsensitiveDict({h["name"]: h["value"] for h in response.get("headers", [])})
+        cassette.add(
+            "POST",
+            request["url"],
+            request.get("postData", {}).get("text"),
+            response.get("status", 0),
+            headers,
+            text,
+            max(entry.get("time", 0), 0) / 1000,
+        )
+
+    cassette.save()
+    return len(cassette.interactions)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    har_file = sys.argv[1]
+    output_file = Path(sys.argv[2]) if len(sys.argv) > 2 else DATA_DIR / "cassette.json"
+
+    if not os.path.exists(har_file):
+        print(f"❌ ファイルが見つかりません: {har_file}")
+        sys.exit(1)
+
+    count = convert(har_file, output_file)
+    if not count:
+        print("❌ トークン・検索APIのやり取りが見つかりませんでした。")
+        sys.exit(1)
+
+    print(f"✅ {count} 件のやり取りを {output_file} に保存しました（秘密情報は置き換え済み）")
+    print()
+    print("再生:")
+    print(f"  HTTP_CASSETTE_MODE=replay HTTP_CASSETTE={output_file} python scripts/known_issues_automation.py")
+    print("  HTTP_CASSETTE_LATENCY_SCALE=0 で待ち時間なし、2 で記録時の2倍")
+
+
+if __name__ == '__main__':
+    main()
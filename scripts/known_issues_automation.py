@@ -8,6 +8,12 @@ CORS模倣を使用してブラウザのリフレッシュトークンから
   1. 初回: ブラウザのネットワークトレースからHARファイルをエクスポート
   2. python scripts/extract_token.py <har_file> でリフレッシュトークンを抽出
   3. python scripts/known_issues_automation.py で実行
+     （--use-config を付けると config/products.json の settings と有効な製品で取得）
+
+記録・再生（性能比較用）:
+  - HTTP_CASSETTE_MODE=record HTTP_CASSETTE=<ファイル> で実行するとやり取りを記録します
+  - HTTP_CASSETTE_MODE=replay で実行するとトークンなしで記録したレスポンスを再生します
+  - HAR ファイルからカセットを作る場合は scripts/har_to_cassette.py を使います
 
 リフレッシュトークンの更新:
   - スクリプトは自動的に新しいリフレッシュトークンを保存します
@@ -15,11 +21,11 @@ CORS模倣を使用してブラウザのリフレッシュトークンから
   - 期限切れの場合は、再度ブラウザからトークンを取得してください
 """
 
-import requests
 import json
 import base64
 import os
 import sys
+import argparse
 from datetime import datetime
 from pathlib import Path
 
@@ -49,6 +55,14 @@ def load_dotenv():
 
 load_dotenv()
 
+# 記録・再生の切り替え（src/cassette.py）と取得条件（config/products.json）
+sys.path.insert(0, str(PROJECT_ROOT))
+from src import api_client
+from src import cassette
+from src import codec
+from src import sweep
+from src.search_index import update_index_file
+
 # 環境変数から設定を読み込む
 TENANT_ID = os.environ.get("TENANT_ID")
 API_HOST = os.environ.get("API_HOST")
@@ -74,9 +88,6 @@ TOKEN_ENDPOINT = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/tok
 # ブラウザが使用する Origin（CORS模倣用）
 ORIGIN = "https://admin.powerplatform.microsoft.com"
 
-# Known Issues API
-API_URL = f"https://{API_HOST}/support/knownissue/search?api-version=2022-03-01-preview"
-
 # トークン保存ファイル（data/ディレクトリに保存）
 REFRESH_TOKEN_FILE = DATA_DIR / "refresh_token.txt"
 ACCESS_TOKEN_FILE = DATA_DIR / "access_token.txt"
@@ -84,6 +95,15 @@ ACCESS_TOKEN_FILE = DATA_DIR / "access_token.txt"
 # 出力ファイル
 OUTPUT_FILE = DATA_DIR / "known_issues.json"
 
+# 全文検索インデックス（scripts/search_issues.py で使用）
+INDEX_FILE = DATA_DIR / "known_issues_index.json.gz"
+
+# 取得条件の既定値（--use-config を付けない場合。全製品・すべての状態）
+DEFAULT_PRODUCT_IDS = ["00000000-0000-0000-0000-000000000000"]
+DEFAULT_ISSUE_STATUS = "Unknown"
+DEFAULT_LOCALE = "ja-JP"
+DEFAULT_MAX_COUNT = 200
+
 
 # =============================================================================
 # トークン管理
@@ -124,7 +144,7 @@ def refresh_access_token(refresh_token):
         "scope": "https://api.powerplatform.com/.default openid profile offline_access",
     }
     
-    response = requests.post(TOKEN_ENDPOINT, headers=headers, data=data, timeout=30)
+    response = cassette.post(TOKEN_ENDPOINT, headers=headers, data=data, timeout=30)
     
     if response.status_code == 200:
         token_data = response.json()
@@ -134,6 +154,10 @@ def refresh_access_token(refresh_token):
         # dataディレクトリが存在しない場合は作成
         DATA_DIR.mkdir(parents=True, exist_ok=True)
         
+        # 再生中は置き換え済みのトークンなので保存しない
+        if cassette.is_replaying():
+            return access_token
+        
         # アクセストークンを保存
         with open(ACCESS_TOKEN_FILE, "w") as f:
             f.write(access_token)
@@ -156,36 +180,31 @@ def refresh_access_token(refresh_token):
 # API呼び出し
 # =============================================================================
 
-def get_known_issues(access_token, product_ids=None, max_count=200):
+def get_known_issues(access_token, use_config=False):
     """
     Known Issues を取得
+
+    既定では全製品・すべての状態（issueStatus: Unknown）を ja-JP で取得します。
+    use_config=True なら function_app と同じく config/products.json の settings と
+    有効な製品を使い、複数のロケール・状態・製品グループが設定されていれば並列に取得して統合します。
+
+    Returns:
+        (アイテムのリスト, ロケールごとのテキスト。単一ロケールなら None)
     """
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    # デフォルトの製品ID（全製品）
-    if product_ids is None:
-        product_ids = ["00000000-0000-0000-0000-000000000000"]
-    
-    body = {
-        "productIds": product_ids,
-        "minMatchingScore": 0.00001,
-        "searchText": "*",
-        "issueStatus": "Unknown",
-        "maxIssueCount": max_count,
-        "skip": None,
-        "source": "KnownIssueTab",
-        "locale": "ja-JP"
-    }
-    
-    response = requests.post(API_URL, headers=headers, json=body, timeout=60)
-    
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(f"API呼び出し失敗: {response.status_code} - {response.text[:200]}")
+    if not use_config:
+        payload = {
+            **api_client.build_payload(DEFAULT_PRODUCT_IDS, DEFAULT_ISSUE_STATUS, DEFAULT_LOCALE),
+            "maxIssueCount": DEFAULT_MAX_COUNT,
+        }
+        data = api_client.get_known_issues(access_token, payload)
+        return (data if isinstance(data, list) else []), None
+
+    if sweep.is_sweep_configured():
+        result = sweep.run_sweep(access_token)
+        return result["issues"], result["localized"]
+
+    data = api_client.get_known_issues(access_token, api_client.build_payload())
+    return (data if isinstance(data, list) else []), None
 
 
 # =============================================================================
@@ -193,14 +212,21 @@ def get_known_issues(access_token, product_ids=None, max_count=200):
 # =============================================================================
 
 def main():
+    parser = argparse.ArgumentParser(description="Power Platform Known Issues 自動取得")
+    parser.add_argument("--use-config", action="store_true",
+                        help="config/products.json の settings と有効な製品で取得（既定は全製品・すべての状態）")
+    args = parser.parse_args()
+
     print("=" * 60)
     print("Power Platform Known Issues 自動取得")
     print(f"実行日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 60)
     print()
     
-    # リフレッシュトークンを読み込み
-    if not REFRESH_TOKEN_FILE.exists():
+    # リフレッシュトークンを読み込み（再生中は不要）
+    if cassette.is_replaying():
+        refresh_token = cassette.REDACTED
+    elif not REFRESH_TOKEN_FILE.exists():
         print("❌ リフレッシュトークンが見つかりません。")
         print(f"   期待するファイル: {REFRESH_TOKEN_FILE}")
         print()
@@ -209,9 +235,9 @@ def main():
         print("  2. F12 → Network → HAR形式でエクスポート")
         print("  3. python scripts/extract_token.py <har_file> を実行")
         return 1
-    
-    with open(REFRESH_TOKEN_FILE, "r") as f:
-        refresh_token = f.read().strip()
+    else:
+        with open(REFRESH_TOKEN_FILE, "r") as f:
+            refresh_token = f.read().strip()
     
     print(f"[1/3] トークンをリフレッシュ中...")
     try:
@@ -226,7 +252,7 @@ def main():
     
     print(f"[2/3] Known Issues を取得中...")
     try:
-        issues = get_known_issues(access_token)
+        issues, localized = get_known_issues(access_token, use_config=args.use_config)
         print(f"      ✅ {len(issues)} 件取得")
     except Exception as e:
         print(f"      ❌ 失敗: {e}")
@@ -240,11 +266,20 @@ def main():
         "count": len(issues),
         "issues": issues
     }
+    if localized:
+        output_data["localized"] = localized
     
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    # STORAGE_CODEC が設定されていれば圧縮して .gz / .zst で保存（読み込み側は自動で展開）
+    output_file = codec.write_file(OUTPUT_FILE, json.dumps(output_data, ensure_ascii=False, indent=2).encode("utf-8"))
     
-    print(f"      ✅ {OUTPUT_FILE} に保存しました")
+    print(f"      ✅ {output_file} に保存しました")
+
+    # 検索インデックスを差分更新
+    try:
+        _, stats = update_index_file(issues, INDEX_FILE)
+        print(f"      ✅ 検索インデックスを更新しました（追加 {stats['added']} / 更新 {stats['updated']} / 削除 {stats['removed']}）")
+    except Exception as e:
+        print(f"      ⚠️ 検索インデックスの更新に失敗: {e}")
     print()
     
     # サマリーを表示
@@ -0,0 +1,65 @@
+"""
+保存済みの Known Issues をローカルで全文検索
+
+known_issues.json からインデックスを（差分のみ）更新し、検索結果を表示します。
+ネットワークアクセスは行いません。
+
+使用方法:
+    python scripts/search_issues.py <検索文字列> [--product <製品名>] [--limit N]
+
+例:
+    python scripts/search_issues.py "フロー 実行 エラー"
+    python scripts/search_issues.py "Copilot" --product "Power Apps"
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import codec
+from src.search_index import update_index_file
+
+SCRIPT_DIR = Path(__file__).parent
+PROJECT_ROOT = SCRIPT_DIR.parent
+DATA_DIR = PROJECT_ROOT / "data"
+
+ISSUES_FILE = DATA_DIR / "known_issues.json"
+INDEX_FILE = DATA_DIR / "known_issues_index.json.gz"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Known Issues のローカル全文検索")
+    parser.add_argument("query", help="検索文字列")
+    parser.add_argument("--product", help="製品名で絞り込み")
+    parser.add_argument("--limit", type=int, default=20, help="最大表示件数")
+    args = parser.parse_args()
+
+    if not os.path.exists(codec.find_file(ISSUES_FILE)):
+        print(f"❌ スナップショットが見つかりません: {ISSUES_FILE}")
+        print("   先に python scripts/known_issues_automation.py を実行してください。")
+        return 1
+
+    # 圧縮されていれば自動で展開
+    issues = json.loads(codec.read_file(ISSUES_FILE).decode("utf-8")).get("issues", [])
+
+    index, _ = update_index_file(issues, INDEX_FILE)
+
+    start = time.perf_counter()
+    results = index.search(args.query, limit=args.limit, product=args.product)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{len(results)} 件ヒット（{len(index)} 件中, {elapsed_ms:.1f} ms）")
+    print()
+    for r in results:
+        print(f"  [{r['score']:.2f}] {r['workItemId']}  {r['title']}")
+        print(f"         {r['product']}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
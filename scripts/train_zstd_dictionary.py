@@ -0,0 +1,77 @@
+"""
+取得済みの既知の問題から zstd の辞書を学習
+
+1件ずつの JSON をサンプルにして辞書を作成し、辞書あり・なしの圧縮率を表示します。
+作成した辞書のパスを ZSTD_DICTIONARY に設定すると、STORAGE_CODEC=zstd の書き込みで使われます。
+辞書付きで書き込んだデータを読むには同じ辞書が必要なため、辞書ファイルは消さずに残してください。
+
+使用方法:
+    python scripts/train_zstd_dictionary.py [--size 65536] [--output ../config/zstd.dict]
+
+zstandard パッケージが必要です（pip install zstandard）。
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import codec
+
+SCRIPT_DIR = Path(__file__).parent
+PROJECT_ROOT = SCRIPT_DIR.parent
+DATA_DIR = PROJECT_ROOT / "data"
+
+ISSUES_FILE = DATA_DIR / "known_issues.json"
+DEFAULT_OUTPUT = PROJECT_ROOT / "config" / "zstd.dict"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="zstd 辞書の学習")
+    parser.add_argument("--input", default=str(ISSUES_FILE), help="known_issues.json のパス")
+    parser.add_argument("--size", type=int, default=codec.DEFAULT_DICTIONARY_SIZE, help="辞書の最大サイズ（バイト）")
+    parser.add_argument("--output", default=str(DEFAULT_OUTPUT), help="辞書の出力先")
+    args = parser.parse_args()
+
+    if not os.path.exists(codec.find_file(args.input)):
+        print(f"❌ スナップショットが見つかりません: {args.input}")
+        print("   先に python scripts/known_issues_automation.py を実行してください。")
+        return 1
+
+    issues = json.loads(codec.read_file(args.input).decode("utf-8")).get("issues", [])
+    samples = [json.dumps(issue, ensure_ascii=False).encode("utf-8") for issue in issues]
+    if len(samples) < 10:
+        print(f"❌ サンプルが少なすぎます: {len(samples)} 件")
+        return 1
+
+    try:
+        dictionary = codec.train_dictionary(samples, args.size)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    with open(args.output, "wb") as f:
+        f.write(dictionary)
+    print(f"✅ {args.output} に保存しました（{len(dictionary):,} バイト、サンプル {len(samples)} 件）")
+
+    # 1件ずつ圧縮した場合の比較（辞書が効くのは小さいデータ）
+    os.environ["ZSTD_DICTIONARY"] = args.output
+    raw = sum(len(s) for s in samples)
+    plain = sum(len(codec.encode(s, codec.CODEC_ZSTD, use_dictionary=False)) for s in samples)
+    with_dict = sum(len(codec.encode(s, codec.CODEC_ZSTD)) for s in samples)
+    gzipped = sum(len(codec.encode(s, codec.CODEC_GZIP)) for s in samples)
+
+    print()
+    print(f"{'形式':<14}{'合計サイズ':>14}{'圧縮率':>10}")
+    print(f"{'非圧縮':<14}{raw:>14,}{'100.0%':>10}")
+    for name, size in (("gzip", gzipped), ("zstd", plain), ("zstd + 辞書", with_dict)):
+        print(f"{name:<14}{size:>14,}{size / raw:>10.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
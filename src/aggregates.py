@@ -0,0 +1,244 @@
+"""
+集計ビュー（製品別・状態別・日別）を変更分から更新するモジュール
+
+実行ごとの変更アイテム（前回実行以降に changedDate が更新されたもの）だけを反映し、
+スナップショット全体を走査せずに以下を保持します。
+
+- 製品別の未解決件数・状態別件数
+- 日別の新規件数・解決件数・再オープン件数（AGGREGATES_DAYS 日分）
+- 平均解決時間（createdDate から Resolved になった changedDate まで）
+
+集計結果は aggregates.json、差分計算用のアイテムごとの状態（製品・状態・作成日時）は
+aggregates-state.json に保存します。aggregates ルートは前者だけを読みます。
+
+issueStatus: "Active" だけを取得している場合、解決された問題は Resolved として返らず
+検索結果から消えるだけです。そのため全件を取得できた実行（maxIssueCount で打ち切られて
+いない取得）では、取得結果にない未解決の問題をその実行の時刻で解決済みとして扱います
+（reconcile）。再び取得結果に現れた場合は再オープンとして数えます。
+"""
+import os
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterable, Optional
+from . import state_manager
+
+
+VIEW_BLOB_NAME = "aggregates.json"
+STATE_BLOB_NAME = "aggregates-state.json"
+
+STATE_RESOLVED = "Resolved"
+
+
+def get_retention_days() -> int:
+    """日別の集計を保持する日数"""
+    return int(os.environ.get("AGGREGATES_DAYS", "90"))
+
+
+def _parse(value: Optional[str]) -> Optional[datetime]:
+    """ISO 8601 の日時（Z 付きも）"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _day(value: Optional[str]) -> Optional[str]:
+    parsed = _parse(value)
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%d") if parsed else None
+
+
+def _add(counts: Dict[str, int], key: str, delta: int):
+    """件数を増減（0 になったキーは消す）"""
+    value = counts.get(key, 0) + delta
+    if value:
+        counts[key] = value
+    else:
+        counts.pop(key, None)
+
+
+def empty_state() -> Dict[str, Any]:
+    return {
+        "items": {},
+        "open_by_product": {},
+        "by_state": {},
+        "daily": {},
+        "resolve": {"count": 0, "total_hours": 0.0},
+    }
+
+
+def _contribute(state: Dict[str, Any], product: str, issue_state: str, sign: int):
+    """製品別・状態別の件数に1件分を加える（sign=-1 で取り除く）"""
+    _add(state["by_state"], issue_state, sign)
+    if issue_state != STATE_RESOLVED:
+        _add(state["open_by_product"], product, sign)
+
+
+def _count_daily(state: Dict[str, Any], day: Optional[str], field: str):
+    if day:
+        counts = state["daily"].setdefault(day, {})
+        counts[field] = counts.get(field, 0) + 1
+
+
+def apply_changes(state: Dict[str, Any], items: Iterable) -> int:
+    """
+    変更アイテムを集計に反映
+
+    Args:
+        state: 集計の状態（empty_state() または前回保存したもの）
+        items: 変更アイテム（dict または Issue）
+
+    Returns:
+        反映した件数
+    """
+    applied = 0
+    for item in items:
+        work_item_id = str(item.get("workItemId") or "")
+        if not work_item_id:
+            continue
+
+        product = item.get("product") or "Unknown"
+        issue_state = item.get("state") or "Unknown"
+        created = item.get("createdDate")
+        changed = item.get("changedDate")
+
+        previous = state["items"].get(work_item_id)
+        if previous is None:
+            _count_daily(state, _day(created) or _day(changed), "new")
+            was_resolved = False
+        else:
+            _contribute(state, previous[0], previous[1], -1)
+            was_resolved = previous[1] == STATE_RESOLVED
+            created = created or previous[2]
+
+        is_resolved = issue_state == STATE_RESOLVED
+        if is_resolved and not was_resolved:
+            _count_daily(state, _day(changed), "resolved")
+            opened, closed = _parse(created), _parse(changed)
+            if opened and closed and closed >= opened:
+                state["resolve"]["count"] += 1
+                state["resolve"]["total_hours"] += (closed - opened).total_seconds() / 3600
+        elif was_resolved and not is_resolved:
+            _count_daily(state, _day(changed), "reopened")
+
+        _contribute(state, product, issue_state, 1)
+        state["items"][work_item_id] = [product, issue_state, created]
+        applied += 1
+
+    _prune_daily(state)
+    return applied
+
+
+def reconcile(state: Dict[str, Any], current_ids: Iterable[str], closed_at: Optional[datetime] = None) -> int:
+    """
+    全件の取得結果にない未解決の問題を解決済みにする
+
+    Args:
+        state: 集計の状態
+        current_ids: 全件を取得できた実行の workItemId
+        closed_at: 解決日時として扱う時刻（省略時は現在時刻）
+
+    Returns:
+        解決済みにした件数
+    """
+    current_ids = {str(work_item_id) for work_item_id in current_ids}
+    closed_at = closed_at or datetime.now(timezone.utc)
+    closed = 0
+    for work_item_id, (product, issue_state, created) in state["items"].items():
+        if issue_state == STATE_RESOLVED or work_item_id in current_ids:
+            continue
+
+        _contribute(state, product, issue_state, -1)
+        _contribute(state, product, STATE_RESOLVED, 1)
+        _count_daily(state, closed_at.strftime("%Y-%m-%d"), "resolved")
+        opened = _parse(created)
+        if opened and closed_at >= opened:
+            state["resolve"]["count"] += 1
+            state["resolve"]["total_hours"] += (closed_at - opened).total_seconds() / 3600
+        state["items"][work_item_id] = [product, STATE_RESOLVED, created]
+        closed += 1
+
+    _prune_daily(state)
+    return closed
+
+
+def _prune_daily(state: Dict[str, Any]):
+    """保持期間より古い日別の集計を削除"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=get_retention_days())).strftime("%Y-%m-%d")
+    for day in [d for d in state["daily"] if d < cutoff]:
+        del state["daily"][day]
+
+
+def build_view(state: Dict[str, Any]) -> Dict[str, Any]:
+    """aggregates ルートで返す集計結果（アイテムごとの状態は含めない）"""
+    resolve = state["resolve"]
+    return {
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "total": len(state["items"]),
+        "open_total": sum(state["open_by_product"].values()),
+        "open_by_product": dict(sorted(state["open_by_product"].items(), key=lambda kv: -kv[1])),
+        "by_state": state["by_state"],
+        "daily": dict(sorted(state["daily"].items())),
+        "mean_time_to_resolve_hours": (
+            round(resolve["total_hours"] / resolve["count"], 1) if resolve["count"] else None
+        ),
+        "resolved_count": resolve["count"],
+    }
+
+
+def update(changed_items: Iterable, current_ids: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    変更アイテムで集計を更新して保存
+
+    集計の状態がまだなければ、最新スナップショットの全件から作成します
+    （スナップショットは変更アイテムを含む取得結果を保存した後であること）。
+    状態は楽観的排他で更新し、他の実行と競合したら最新の状態に反映し直します。
+
+    Args:
+        changed_items: 前回実行以降の変更アイテム
+        current_ids: 全件を取得できた場合はその workItemId（取得結果から消えた問題を解決済みにする。
+                     打ち切られた可能性のある取得・差分取得では None）
+
+    Returns:
+        保存した集計結果（失敗した場合は None。ジョブは続行する）
+    """
+    changed_items = list(changed_items)
+    current_ids = set(current_ids) if current_ids is not None else None
+    applied = {"count": 0, "closed": 0}
+
+    def _apply(state: Dict[str, Any]) -> Dict[str, Any]:
+        items = changed_items
+        if not state:
+            snapshot, _ = state_manager.load_snapshot()
+            state = empty_state()
+            items = snapshot.get("issues", []) if snapshot else changed_items
+            logging.info("Aggregates not found. Building from the latest snapshot.")
+        applied["count"] = apply_changes(state, items)
+        if current_ids is not None:
+            applied["closed"] = reconcile(state, current_ids)
+        return state
+
+    try:
+        state = state_manager.update_json_state(STATE_BLOB_NAME, _apply)
+        view = build_view(state)
+        state_manager.save_json_state(VIEW_BLOB_NAME, view)
+        logging.info(
+            f"Aggregates updated: {applied['count']} changes, {applied['closed']} no longer listed, "
+            f"{view['open_total']} open issues"
+        )
+        return view
+    except Exception as e:
+        logging.warning(f"Failed to update aggregates: {e}")
+        return None
+
+
+def load_view() -> tuple:
+    """
+    保存済みの集計結果を取得
+
+    Returns:
+        (集計結果, ETag)。なければ (None, None)
+    """
+    return state_manager.load_snapshot(VIEW_BLOB_NAME)
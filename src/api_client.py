@@ -1,9 +1,31 @@
+import os
 import requests
 import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+from . import cassette
 from . import config
+from . import deadline
+from . import hedging
+from . import metrics
+from . import state_manager
+from .json_stream import iter_json_array
 from .settings import get_enabled_product_ids, get_issue_settings
 
 
+# ストリーミング取得時のチャンクサイズ（バイト）
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 検索APIが changedDate の降順で返さないことを確認済みか（以降の差分取得は1回の全件取得にする）
+_unordered_results = False
+
+
+class FirstPage(NamedTuple):
+    """取得済みの先頭ページ（プローブの結果など）と、そのときに要求した件数"""
+    items: List[Dict[str, Any]]
+    requested: int
+
+
 def get_api_url() -> str:
     """API URLを生成"""
     if not config.API_HOST:
@@ -11,6 +33,91 @@ def get_api_url() -> str:
     return f"https://{config.API_HOST}/support/knownissue/search?api-version=2022-03-01-preview"
 
 
+def is_delta_fetch_enabled() -> bool:
+    """差分取得を使うか（環境変数 DELTA_FETCH）"""
+    return os.environ.get("DELTA_FETCH", "false").lower() in ("1", "true", "yes")
+
+
+def get_delta_page_size() -> int:
+    """差分取得の1ページの件数"""
+    return max(1, int(os.environ.get("DELTA_FETCH_PAGE_SIZE", "50")))
+
+
+def get_delta_overlap() -> timedelta:
+    """差分取得で前回実行日時より前に遡る幅（時刻のずれ・反映の遅れ対策）"""
+    return timedelta(minutes=int(os.environ.get("DELTA_FETCH_OVERLAP_MINUTES", "60")))
+
+
+def get_request_timeout() -> float:
+    """検索APIの1リクエストのタイムアウト（秒、締め切りが近ければ残り時間まで）"""
+    return deadline.timeout(float(os.environ.get("SEARCH_TIMEOUT_SECONDS", "120")), "search request")
+
+
+def is_streaming_enabled() -> bool:
+    """ストリーミング取得を使うか（環境変数 STREAMING_FETCH）"""
+    return os.environ.get("STREAMING_FETCH", "false").lower() in ("1", "true", "yes")
+
+
+def build_payload(product_ids=None, issue_status=None, locale=None) -> Dict[str, Any]:
+    """
+    リクエストペイロードを生成
+
+    Args:
+        product_ids: 製品IDのリスト（省略時は設定ファイルの有効な製品）
+        issue_status: 状態（省略時は設定ファイルの issueStatus）
+        locale: ロケール（省略時は設定ファイルの locale）
+    """
+    settings = get_issue_settings()
+    if product_ids is None:
+        product_ids = get_enabled_product_ids()
+    
+    if not product_ids:
+        logging.warning("No products enabled in config, using all products")
+        product_ids = ["00000000-0000-0000-0000-000000000000"]
+    
+    payload = {
+        "productIds": product_ids,
+        "minMatchingScore": 0.00001,
+        "searchText": "*",
+        "issueStatus": issue_status or settings.get("issueStatus", "Active"),
+        "maxIssueCount": settings.get("maxIssueCount", 200),
+        "skip": None,
+        "source": "KnownIssueTab",
+        "locale": locale or settings.get("locale", "ja-JP")
+    }
+    
+    logging.info(f"Filtering by {len(product_ids)} products, status={payload['issueStatus']}, locale={payload['locale']}")
+    return payload
+
+
+def is_complete(count: int, payload=None) -> bool:
+    """
+    1回の検索で全件を取得できたか（件数が maxIssueCount に達していれば打ち切られた可能性がある）
+
+    Args:
+        count: 取得した件数
+        payload: 送ったペイロード（省略時は設定ファイルの maxIssueCount）
+    """
+    limit = (payload or {}).get("maxIssueCount") or get_issue_settings().get("maxIssueCount", 200)
+    return count < limit
+
+
+def _get_headers(access_token) -> Dict[str, str]:
+    """リクエストヘッダーを生成"""
+    return {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+
+
+def _log_request_error(e: requests.exceptions.RequestException):
+    """リクエスト失敗時のログ出力"""
+    logging.error(f"API Request failed: {e}")
+    if e.response is not None:
+        logging.error(f"Response status: {e.response.status_code}")
+        logging.error(f"Response body: {e.response.text}")
+
+
 def get_known_issues(access_token, payload=None):
     """
     既知の問題APIからデータを取得する
@@ -20,41 +127,168 @@ def get_known_issues(access_token, payload=None):
         payload: リクエストペイロード（省略時は設定ファイルから生成）
     """
     url = get_api_url()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    headers = _get_headers(access_token)
 
     # ペイロードを設定ファイルから生成
     if payload is None:
-        product_ids = get_enabled_product_ids()
-        settings = get_issue_settings()
-        
-        if not product_ids:
-            logging.warning("No products enabled in config, using all products")
-            product_ids = ["00000000-0000-0000-0000-000000000000"]
-        
-        payload = {
-            "productIds": product_ids,
-            "minMatchingScore": 0.00001,
-            "searchText": "*",
-            "issueStatus": settings.get("issueStatus", "Active"),
-            "maxIssueCount": settings.get("maxIssueCount", 200),
-            "skip": None,
-            "source": "KnownIssueTab",
-            "locale": settings.get("locale", "ja-JP")
-        }
-        
-        logging.info(f"Filtering by {len(product_ids)} products, status={payload['issueStatus']}")
+        payload = build_payload()
 
     logging.info(f"Calling API: {url}")
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        with metrics.timed("api_request_seconds", "api_requests_total", operation="search"):
+            response = _post_search(url, headers, payload)
+            response.raise_for_status()
+            data = response.json()
+        if isinstance(data, list):
+            metrics.inc("issues_fetched_total", len(data))
+        return data
+    except requests.exceptions.RequestException as e:
+        _log_request_error(e)
+        raise
+
+
+def get_known_issues_after(access_token, first_page: FirstPage, payload=None) -> List[Dict[str, Any]]:
+    """
+    取得済みの先頭ページに残りを足して全件にする（先頭ページの分のリクエストを省く）
+
+    先頭ページと同じ条件（payload）で skip を付けて残りだけを取得します。
+    先頭ページの取得後に並びがずれて重複したアイテムは workItemId で除きます。
+
+    Args:
+        access_token: アクセストークン
+        first_page: 同じ payload で skip なしに取得した先頭ページ
+        payload: リクエストペイロード（省略時は設定ファイルから生成）
+    """
+    if payload is None:
+        payload = build_payload()
+
+    limit = payload.get("maxIssueCount") or 200
+    items = list(first_page.items[:limit])
+    if len(first_page.items) < first_page.requested or len(items) >= limit:
+        logging.info(f"First page already holds all {len(items)} issues.")
+        return items
+
+    rest = get_known_issues(access_token, {**payload, "skip": len(items), "maxIssueCount": limit - len(items)})
+    seen = {str(item.get("workItemId")) for item in items}
+    items.extend(
+        item for item in (rest if isinstance(rest, list) else [])
+        if str(item.get("workItemId")) not in seen
+    )
+    logging.info(f"Fetched {len(items) - len(first_page.items)} issues after a first page of {len(first_page.items)}.")
+    return items
+
+
+def _post_search(url, headers, payload):
+    """
+    検索リクエストを送信（HEDGED_REQUESTS=true なら遅い場合に同じリクエストをもう1つ送る）
+
+    記録・再生中は送ったリクエストがそのままカセットに対応するようにヘッジしない。
+    ヘッジする場合は 2xx 以外を失敗として扱う（先に返った 5xx / 429 でもう一方を捨てないため）
+    """
+    timeout = get_request_timeout()
+    if not hedging.is_enabled() or cassette.get_mode() is not None:
+        return cassette.post(url, headers=headers, json=payload, timeout=timeout)
+
+    def _send():
+        response = cassette.post(url, headers=headers, json=payload, timeout=timeout)
         response.raise_for_status()
-        return response.json()
+        return response
+
+    return hedging.get_hedger("search").call(_send, discard=lambda response: response.close())
+
+
+def iter_known_issues(access_token, payload=None) -> Iterator[Dict[str, Any]]:
+    """
+    既知の問題APIのレスポンスをストリーミングで読み、1件ずつ返す
+    
+    レスポンス本文をチャンク単位で受信しながらデコードするため、
+    件数が多くてもレスポンス全体を一度にメモリへ載せません。
+    
+    Args:
+        access_token: アクセストークン
+        payload: リクエストペイロード（省略時は設定ファイルから生成）
+    
+    Yields:
+        APIのアイテム（dict）
+    """
+    url = get_api_url()
+    headers = _get_headers(access_token)
+
+    if payload is None:
+        payload = build_payload()
+
+    logging.info(f"Calling API (streaming): {url}")
+    try:
+        # 所要時間はレスポンスヘッダーの受信まで（本文は利用側のペースで読まれるため）
+        with metrics.timed("api_request_seconds", "api_requests_total", operation="search_stream"):
+            response = cassette.post(url, headers=headers, json=payload, stream=True, timeout=get_request_timeout())
+            if not response.ok:
+                response.close()
+                response.raise_for_status()
+        with response:
+            count = 0
+            for item in iter_json_array(response.iter_content(chunk_size=STREAM_CHUNK_SIZE)):
+                count += 1
+                yield item
+            logging.info(f"Streamed {count} issues.")
+            metrics.inc("issues_fetched_total", count)
     except requests.exceptions.RequestException as e:
-        logging.error(f"API Request failed: {e}")
-        if e.response:
-            logging.error(f"Response status: {e.response.status_code}")
-            logging.error(f"Response body: {e.response.text}")
+        _log_request_error(e)
         raise
+
+
+def get_known_issues_since(access_token, since: datetime, payload=None) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    changedDate の新しい順に返ってくることを確認しながらページ単位で取得し、
+    ページの末尾が since より古くなったら打ち切る（以降はすべて古いため）
+
+    検索APIは並び順を指定できないため、返ってきた順序が changedDate の降順で
+    なくなった時点で打ち切りをやめ、残りを1回で取得します（全件取得と同じ結果）。
+    並び順の確認はプロセスで1回だけ行い、降順でないと分かった後は最初から1回で全件を取得します。
+
+    Args:
+        access_token: アクセストークン
+        since: 前回実行日時（DELTA_FETCH_OVERLAP_MINUTES だけ遡って比較）
+        payload: リクエストペイロード（省略時は設定ファイルから生成）
+
+    Returns:
+        (アイテム, 最後まで取得したか)。途中で打ち切った場合は False
+    """
+    global _unordered_results
+    if payload is None:
+        payload = build_payload()
+
+    if _unordered_results:
+        items = get_known_issues(access_token, payload)
+        return (items if isinstance(items, list) else []), True
+
+    limit = payload.get("maxIssueCount") or 200
+    page_size = get_delta_page_size()
+    threshold = (since - get_delta_overlap()).timestamp()
+
+    items: List[Dict[str, Any]] = []
+    previous = None
+    while len(items) < limit:
+        count = min(page_size, limit - len(items))
+        page = get_known_issues(access_token, {**payload, "skip": len(items), "maxIssueCount": count})
+        page = page if isinstance(page, list) else []
+        items.extend(page)
+        if len(page) < count:
+            return items, True
+
+        stamps = [state_manager.changed_timestamp(item) for item in page]
+        first = previous if previous is not None else stamps[0]
+        ordered = None not in stamps and all(a >= b for a, b in zip([first] + stamps, stamps))
+        if not ordered:
+            _unordered_results = True
+            logging.info(f"Results are not ordered by changedDate. Fetching the remaining {limit - len(items)} at once.")
+            rest = get_known_issues(access_token, {**payload, "skip": len(items), "maxIssueCount": limit - len(items)})
+            items.extend(rest if isinstance(rest, list) else [])
+            return items, True
+
+        previous = stamps[-1]
+        if previous <= threshold:
+            logging.info(f"Delta fetch stopped early after {len(items)} issues (watermark {since.isoformat()}).")
+            return items, False
+
+    return items, True
@@ -1,8 +1,12 @@
 import logging
-import requests
+from datetime import datetime, timezone, timedelta
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
+from . import cassette
 from . import config
+from . import deadline
+from . import metrics
+from .secret_cache import get_secret_cache
 
 
 class AuthManager:
@@ -24,15 +28,26 @@ class AuthManager:
         if not self.tenant_id:
             raise ValueError("TENANT_ID is not set")
 
-        # Initialize Key Vault Client
-        credential = DefaultAzureCredential()
-        self.secret_client = SecretClient(vault_url=self.kv_url, credential=credential)
+        if cassette.is_replaying():
+            # 記録したやり取りの再生中は Key Vault にアクセスしない
+            self.secret_client = None
+            self.secret_cache = cassette.ReplaySecretCache()
+        else:
+            # Initialize Key Vault Client
+            credential = DefaultAzureCredential()
+            self.secret_client = SecretClient(vault_url=self.kv_url, credential=credential)
+            
+            # 実行をまたいで共有するシークレットキャッシュ（ウォームインスタンスでは Key Vault 往復なし）
+            self.secret_cache = get_secret_cache(self.secret_client, self.kv_url, self.secret_name)
         
         # Token endpoint
         self.token_endpoint = f"https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token"
         
         # CORS模倣用のOrigin
         self.origin = "https://admin.powerplatform.microsoft.com"
+        
+        # リフレッシュトークンの失効日時（SPA はセッション開始から24時間）
+        self.refresh_token_expires_at = None
 
     def get_access_token(self) -> str:
         """
@@ -40,12 +55,12 @@ class AuthManager:
         
         Key Vaultからリフレッシュトークンを取得し、
         ブラウザを模倣したリクエストでトークンをリフレッシュします。
-        新しいリフレッシュトークンが返された場合はKey Vaultを更新します。
+        新しいリフレッシュトークンが返された場合はKey Vaultを更新します
+        （キャッシュを即座に更新し、Key Vault への保存はバックグラウンドで行います）。
         """
-        logging.info("Retrieving refresh token from Key Vault...")
+        logging.info("Retrieving refresh token...")
         try:
-            secret = self.secret_client.get_secret(self.secret_name)
-            refresh_token = secret.value
+            refresh_token = self.secret_cache.get()
         except Exception as e:
             logging.error(f"Failed to get secret from Key Vault: {e}")
             raise
@@ -71,28 +86,39 @@ class AuthManager:
             "scope": "https://api.powerplatform.com/.default openid profile offline_access",
         }
         
-        response = requests.post(self.token_endpoint, headers=headers, data=data, timeout=30)
-        
-        if response.status_code != 200:
-            error_data = response.json() if response.text else {}
-            error = error_data.get("error", "unknown")
-            error_desc = error_data.get("error_description", response.text[:200])
-            error_msg = f"Token refresh failed: {error} - {error_desc}"
-            logging.error(error_msg)
-            raise Exception(error_msg)
+        with metrics.timed("token_refresh_seconds", "token_refresh_total"):
+            response = cassette.post(
+                self.token_endpoint, headers=headers, data=data,
+                timeout=deadline.timeout(30, "token refresh")
+            )
+            
+            if response.status_code != 200:
+                error_data = response.json() if response.text else {}
+                error = error_data.get("error", "unknown")
+                error_desc = error_data.get("error_description", response.text[:200])
+                error_msg = f"Token refresh failed: {error} - {error_desc}"
+                logging.error(error_msg)
+                raise Exception(error_msg)
         
         result = response.json()
         access_token = result.get("access_token")
         new_refresh_token = result.get("refresh_token")
         
+        # SPA の場合はリフレッシュトークンの残り有効期間が返される
+        expires_in = result.get("refresh_token_expires_in")
+        if expires_in:
+            self.refresh_token_expires_at = datetime.now(timezone.utc) + timedelta(seconds=int(expires_in))
+            logging.info(f"Refresh token expires at: {self.refresh_token_expires_at}")
+            metrics.set_gauge("refresh_token_expires_timestamp_seconds", self.refresh_token_expires_at.timestamp())
+        
         # 新しいリフレッシュトークンがあればKey Vaultを更新
         if new_refresh_token and new_refresh_token != refresh_token:
-            logging.info("New refresh token received. Updating Key Vault...")
-            try:
-                self.secret_client.set_secret(self.secret_name, new_refresh_token)
-                logging.info("Key Vault updated successfully.")
-            except Exception as e:
-                logging.warning(f"Failed to update Key Vault: {e}")
-                # トークン更新に失敗してもアクセストークンは取得できているので続行
+            logging.info("New refresh token received. Scheduling Key Vault update...")
+            # 保存に失敗してもバックグラウンドで再試行する（アクセストークンは取得できているので続行）
+            self.secret_cache.set(new_refresh_token)
         
         return access_token
+    
+    def flush(self, timeout: float = 30.0, force: bool = False) -> bool:
+        """保留中の Key Vault 更新の完了を待つ（force: 見送った保存も行う）"""
+        return self.secret_cache.flush(timeout, force=force)
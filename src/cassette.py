@@ -0,0 +1,264 @@
+"""
+HTTP のやり取りを記録・再生するモジュール（性能比較用）
+
+HTTP_CASSETTE_MODE=record の場合は実際にリクエストを送り、トークンエンドポイントと
+検索APIとのやり取りを HTTP_CASSETTE のファイルに記録します。
+HTTP_CASSETTE_MODE=replay の場合はネットワークにも Key Vault にもアクセスせず、
+記録したレスポンスを記録時のレイテンシ（HTTP_CASSETTE_LATENCY_SCALE 倍）で返します。
+
+トークン・リフレッシュトークンなどの秘密情報は記録前に置き換え、
+テナントIDと API ホストは URL 上でプレースホルダーにします。
+リフレッシュトークンの期限（24時間）に関係なく同じ条件で何度でも実行できます。
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl
+import requests
+from . import config
+
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+CASSETTE_VERSION = 1
+
+# 秘密情報の置き換え後の値
+REDACTED = "<redacted>"
+
+# 記録しないフィールド（リクエスト・レスポンスの本文）
+SECRET_FIELDS = frozenset({
+    "access_token", "refresh_token", "id_token", "client_info",
+    "client_secret", "code", "password", "assertion",
+})
+
+# 記録するレスポンスヘッダー
+KEPT_HEADERS = ("Content-Type", "Retry-After")
+
+_TENANT_PATTERN = re.compile(r"(https://login\.microsoftonline\.com/)[^/]+/")
+_API_HOST_PATTERN = re.compile(r"https://[^/]+\.api\.powerplatform\.com/")
+
+
+class CassetteMissError(requests.exceptions.ConnectionError):
+    """再生するやり取りがカセットにない"""
+
+
+def get_mode() -> Optional[str]:
+    """記録・再生のモード（環境変数 HTTP_CASSETTE_MODE、未設定なら None）"""
+    mode = os.environ.get("HTTP_CASSETTE_MODE", "").lower()
+    return mode if mode in (MODE_RECORD, MODE_REPLAY) else None
+
+
+def is_replaying() -> bool:
+    """再生モードか"""
+    return get_mode() == MODE_REPLAY
+
+
+def get_latency_scale() -> float:
+    """再生時に記録したレイテンシに掛ける倍率（0 なら待たない）"""
+    return float(os.environ.get("HTTP_CASSETTE_LATENCY_SCALE", "1.0"))
+
+
+# ----------------------------------------------------------------------
+# 正規化・秘密情報の除去
+# ----------------------------------------------------------------------
+
+def normalize_url(url: str) -> str:
+    """テナントIDと API ホストをプレースホルダーに置き換える"""
+    if config.API_HOST:
+        url = url.replace(f"https://{config.API_HOST}/", "https://{API_HOST}/")
+    url = _API_HOST_PATTERN.sub("https://{API_HOST}/", url)
+    return _TENANT_PATTERN.sub(r"\1{TENANT_ID}/", url)
+
+
+def _parse_body(body: Any) -> Any:
+    """リクエスト本文を dict に（JSON・フォームのどちらも）"""
+    if body is None or isinstance(body, (dict, list)):
+        return body
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+    try:
+        return json.loads(body)
+    except ValueError:
+        pairs = parse_qsl(body, keep_blank_values=True)
+        return dict(pairs) if pairs else body
+
+
+def redact(value: Any) -> Any:
+    """SECRET_FIELDS の値を置き換える（入れ子の dict / list も）"""
+    if isinstance(value, dict):
+        return {
+            key: (REDACTED if key in SECRET_FIELDS and item else redact(item))
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def _redact_text(text: str) -> str:
+    """レスポンス本文（JSON なら）の秘密情報を置き換える"""
+    try:
+        return json.dumps(redact(json.loads(text)), ensure_ascii=False)
+    except ValueError:
+        return text
+
+
+def request_fingerprint(method: str, url: str, body: Any) -> str:
+    """照合に使うキー（秘密情報を除いた本文のハッシュ）"""
+    canonical = json.dumps(redact(_parse_body(body)), sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:16]
+    return f"{method.upper()} {normalize_url(url)} {digest}"
+
+
+# ----------------------------------------------------------------------
+# カセット
+# ----------------------------------------------------------------------
+
+class Cassette:
+    """記録したやり取りの集まり"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.interactions: List[Dict[str, Any]] = []
+        self._cursors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> "Cassette":
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.interactions = data.get("interactions", [])
+        logging.info(f"Loaded cassette: {self.path} ({len(self.interactions)} interactions)")
+        return self
+
+    def save(self):
+        """一時ファイルに書いてから置き換える"""
+        data = {
+            "version": CASSETTE_VERSION,
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+            "interactions": self.interactions,
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def add(self, method: str, url: str, body: Any, status: int, headers: Dict[str, str],
+            text: str, elapsed: float):
+        """やり取りを1件追加（秘密情報は除去して保持）"""
+        kept = {name: headers[name] for name in KEPT_HEADERS if name in headers}
+        with self._lock:
+            self.interactions.append({
+                "key": request_fingerprint(method, url, body),
+                "method": method.upper(),
+                "url": normalize_url(url),
+                "request": redact(_parse_body(body)),
+                "status": status,
+                "headers": kept,
+                "body": _redact_text(text),
+                "elapsed": round(elapsed, 4),
+            })
+
+    def find(self, method: str, url: str, body: Any) -> Dict[str, Any]:
+        """
+        再生するやり取りを探す
+
+        同じリクエストが複数回記録されていれば記録順に返し、使い切ったら最後のものを返します。
+        本文まで一致するものがなければ、同じメソッド・URL のものを使います。
+        """
+        key = request_fingerprint(method, url, body)
+        matches = [i for i in self.interactions if i["key"] == key]
+        if not matches:
+            loose = f"{method.upper()} {normalize_url(url)}"
+            matches = [i for i in self.interactions if f"{i['method']} {i['url']}" == loose]
+            if not matches:
+                raise CassetteMissError(f"No recorded interaction for {key}")
+            key = loose
+
+        with self._lock:
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+        return matches[min(index, len(matches) - 1)]
+
+
+def _to_response(interaction: Dict[str, Any], url: str) -> requests.Response:
+    """記録したやり取りを requests.Response にする"""
+    response = requests.Response()
+    response.status_code = interaction["status"]
+    response.headers.update(interaction.get("headers", {}))
+    response._content = interaction["body"].encode("utf-8")
+    response._content_consumed = True
+    response.encoding = "utf-8"
+    response.url = url
+    return response
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette:
+    """HTTP_CASSETTE のカセットを取得（再生時は読み込む）"""
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None:
+            path = os.environ.get("HTTP_CASSETTE")
+            if not path:
+                raise ValueError("HTTP_CASSETTE is not set")
+            _cassette = Cassette(path)
+            if get_mode() == MODE_REPLAY or os.path.exists(path):
+                _cassette.load()
+        return _cassette
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """
+    requests.post の代わりに使う
+
+    モード未設定なら requests.post そのもの。記録モードでは送信して記録し、
+    再生モードでは記録したレスポンスを返します。
+    """
+    mode = get_mode()
+    if mode is None:
+        return requests.post(url, **kwargs)
+
+    body = kwargs.get("json") if kwargs.get("json") is not None else kwargs.get("data")
+    cassette = get_cassette()
+
+    if mode == MODE_REPLAY:
+        interaction = cassette.find("POST", url, body)
+        delay = interaction.get("elapsed", 0) * get_latency_scale()
+        if delay > 0:
+            time.sleep(delay)
+        return _to_response(interaction, url)
+
+    start = time.perf_counter()
+    response = requests.post(url, **kwargs)
+    text = response.text  # ストリーミングでも全体を読む（以降は読み込み済みの本文から返る）
+    elapsed = time.perf_counter() - start
+
+    cassette.add("POST", url, body, response.status_code, response.headers, text, elapsed)
+    cassette.save()
+    return response
+
+
+class ReplaySecretCache:
+    """再生時に Key Vault の代わりに使う（リフレッシュトークンは記録時と同じく置き換え済みの値）"""
+
+    def get(self) -> str:
+        return REDACTED
+
+    def set(self, value: str):
+        pass
+
+    def flush(self, timeout: float = 30.0, force: bool = False) -> bool:
+        return True
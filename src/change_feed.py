@@ -0,0 +1,314 @@
+"""
+カーソルで読み進める変更フィード
+
+実行ごとの変更イベントに単調増加のシーケンス番号を振り、追記専用の Append Blob
+（change-feed/segment-<先頭番号>.ndjson）に NDJSON で追記します。
+利用側は changes ルートに前回読んだシーケンス番号（cursor）を渡すだけで続きを取得でき、
+利用側ごとに独立して読み進められます（共有の last_run は動かしません）。
+
+change-feed-state.json には追記ブロックごとの (先頭番号, 末尾番号, オフセット, 長さ) を保持し、
+読み込みは cursor より後のブロックだけを範囲指定でダウンロードします。
+"""
+import os
+import json
+import uuid
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
+from . import diff
+from . import state_manager
+
+
+STATE_BLOB_NAME = "change-feed-state.json"
+SEGMENT_PREFIX = "change-feed/segment-"
+
+# 1セグメントあたりの追記ブロック数の上限（Append Blob の上限は 50,000）
+SEGMENT_MAX_BLOCKS = 1000
+
+# 1回の追記の上限（Append Blob の1ブロックは 4MiB まで）
+MAX_BLOCK_BYTES = 4 * 1024 * 1024
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class CursorExpiredError(ValueError):
+    """cursor が保持期間より古い（スナップショットから取り直す必要がある）"""
+
+
+def get_retention_days() -> int:
+    """変更フィードを保持する日数"""
+    return int(os.environ.get("CHANGE_FEED_RETENTION_DAYS", "30"))
+
+
+def _to_dict(item) -> Dict[str, Any]:
+    return item.to_dict() if hasattr(item, "to_dict") else item
+
+
+def _segment_name(first_seq: int, suffix: str = "") -> str:
+    return f"{SEGMENT_PREFIX}{first_seq:012d}{'-' + suffix if suffix else ''}.ndjson"
+
+
+def load_state() -> Dict[str, Any]:
+    """フィードの状態（なければ空）"""
+    state = state_manager.load_json_state(STATE_BLOB_NAME)
+    state.setdefault("last_seq", 0)
+    state.setdefault("segments", [])
+    return state
+
+
+# ----------------------------------------------------------------------
+# 追記
+# ----------------------------------------------------------------------
+
+def append(events: Iterable[Dict[str, Any]]) -> Optional[Dict[str, int]]:
+    """
+    変更イベントにシーケンス番号を振って追記
+
+    実行の多重起動防止（run_job のリース）の内側から呼ぶこと。読み込んだ状態を元に
+    Append Blob へ追記してから、状態を楽観的排他で保存します。その間に他の書き込みで
+    番号が進んでいたら最新の状態から番号を振り直して追記し直します（先に追記したブロックは
+    状態から参照されないまま残り、追記位置がずれるため新しいセグメントに書き直されます）。
+
+    Args:
+        events: diff.compute_changes() 形式の変更イベント
+
+    Returns:
+        {"first_seq", "last_seq"}（イベントがなければ None）
+
+    Raises:
+        state_manager.StateConflictError: やり直しても他の書き込みと競合した
+    """
+    events = list(events)
+    if not events:
+        return None
+    recorded_at = datetime.now(timezone.utc).isoformat()
+
+    for attempt in range(state_manager.STATE_WRITE_RETRIES + 1):
+        state = load_state()
+        base_seq = state["last_seq"]
+
+        seq = base_seq
+        lines = []
+        for event in events:
+            seq += 1
+            record = {**event, "seq": seq, "recorded_at": recorded_at, "item": _to_dict(event.get("item"))}
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+
+        # Blob への追記は状態の更新（競合時に再実行される）の外で1回だけ行う
+        for chunk_first, data in _chunks(lines, base_seq + 1):
+            chunk_last = chunk_first + data.count(b"\n") - 1
+            _append_block(state, chunk_first, chunk_last, data, recorded_at)
+        state["last_seq"] = seq
+        pruned = _prune(state)
+
+        committed = []
+
+        def _apply(latest: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            if latest.get("last_seq", 0) != base_seq:
+                return None
+            committed.append(True)
+            return state
+
+        state_manager.update_json_state(STATE_BLOB_NAME, _apply)
+        if committed:
+            _delete_segments(pruned)
+            first_seq = base_seq + 1
+            logging.info(f"Change feed appended: seq {first_seq}-{seq}")
+            return {"first_seq": first_seq, "last_seq": seq}
+        logging.info(f"Change feed was appended by another writer. Retrying ({attempt + 1})...")
+
+    raise state_manager.StateConflictError(f"Failed to append to the change feed: {STATE_BLOB_NAME} kept changing")
+
+
+def _chunks(lines: List[str], first_seq: int) -> Iterator[tuple]:
+    """1ブロックに収まるように行をまとめる"""
+    buffer, size, start = [], 0, first_seq
+    for line in lines:
+        encoded = line.encode("utf-8")
+        if buffer and size + len(encoded) > MAX_BLOCK_BYTES:
+            yield start, b"".join(buffer)
+            start += len(buffer)
+            buffer, size = [], 0
+        buffer.append(encoded)
+        size += len(encoded)
+    if buffer:
+        yield start, b"".join(buffer)
+
+
+def _new_segment(state: Dict[str, Any], first_seq: int) -> Dict[str, Any]:
+    """
+    新しいセグメントを作成
+
+    既存の Blob は上書きしない（If-None-Match: *）。同じ名前のセグメントがあれば
+    （他の書き込みが同じ番号から作成した場合など）乱数を付けた名前で作成します。
+    """
+    name = _segment_name(first_seq)
+    try:
+        _create_segment(name)
+    except ResourceExistsError:
+        name = _segment_name(first_seq, uuid.uuid4().hex[:8])
+        _create_segment(name)
+    segment = {"blob": name, "size": 0, "last_at": None, "blocks": []}
+    state["segments"].append(segment)
+    logging.info(f"Created change feed segment: {name}")
+    return segment
+
+
+def _create_segment(name: str):
+    state_manager.get_blob_client(name).create_append_blob(
+        match_condition=MatchConditions.IfMissing,
+        timeout=state_manager.blob_timeout(f"creating {name}")
+    )
+
+
+def _append_block(state: Dict[str, Any], first_seq: int, last_seq: int, data: bytes, recorded_at: str):
+    """現在のセグメントに1ブロック追記（いっぱい・不整合なら新しいセグメントへ）"""
+    segment = state["segments"][-1] if state["segments"] else None
+    if segment is None or len(segment["blocks"]) >= SEGMENT_MAX_BLOCKS:
+        segment = _new_segment(state, first_seq)
+
+    try:
+        # 前回の追記が状態の保存前に失敗していれば位置がずれているので 412 になる
+        state_manager.get_blob_client(segment["blob"]).append_block(
+            data, appendpos_condition=segment["size"],
+            timeout=state_manager.blob_timeout(f"appending to {segment['blob']}")
+        )
+    except HttpResponseError as e:
+        if e.status_code not in (409, 412):
+            raise
+        logging.warning(f"Append position mismatch on {segment['blob']}. Starting a new segment.")
+        segment = _new_segment(state, first_seq)
+        state_manager.get_blob_client(segment["blob"]).append_block(
+            data, appendpos_condition=0,
+            timeout=state_manager.blob_timeout(f"appending to {segment['blob']}")
+        )
+
+    segment["blocks"].append([first_seq, last_seq, segment["size"], len(data)])
+    segment["size"] += len(data)
+    segment["last_at"] = recorded_at
+
+
+def _prune(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """保持期間を過ぎたセグメントを状態から外す（書き込み中の最新セグメントは残す）"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=get_retention_days())).isoformat()
+    pruned = []
+    while len(state["segments"]) > 1 and (state["segments"][0]["last_at"] or "") < cutoff:
+        pruned.append(state["segments"].pop(0))
+    return pruned
+
+
+def _delete_segments(segments: List[Dict[str, Any]]):
+    """状態から外したセグメントの Blob を削除"""
+    for segment in segments:
+        try:
+            state_manager.get_blob_client(segment["blob"]).delete_blob()
+        except Exception as e:
+            logging.warning(f"Failed to delete {segment['blob']}: {e}")
+        logging.info(f"Pruned change feed segment: {segment['blob']}")
+
+
+def record_changes(items: Iterable) -> Optional[Dict[str, int]]:
+    """
+    changedDate で抽出した変更アイテムを追記（前回との比較がない経路用）
+
+    失敗してもジョブは続行する
+    """
+    try:
+        return append(diff.compute_changes(None, [_to_dict(item) for item in items]))
+    except Exception as e:
+        logging.warning(f"Failed to append change feed: {e}")
+        return None
+
+
+# ----------------------------------------------------------------------
+# 読み込み
+# ----------------------------------------------------------------------
+
+def parse_params(params: Dict[str, str]) -> Dict[str, int]:
+    """
+    changes ルートのクエリパラメータを解釈
+
+    Raises:
+        ValueError: 値が不正
+    """
+    try:
+        cursor = int(params.get("cursor") or 0)
+        limit = int(params.get("limit") or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("cursor and limit must be integers")
+    if cursor < 0 or limit < 1:
+        raise ValueError("cursor must be >= 0 and limit must be >= 1")
+    return {"cursor": cursor, "limit": min(limit, MAX_PAGE_SIZE)}
+
+
+def read(cursor: int, limit: int = DEFAULT_PAGE_SIZE, state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    cursor より後のイベントを最大 limit 件取得
+
+    Args:
+        cursor: 読み終えた最後のシーケンス番号（0 なら保持している最も古いイベントから）
+        limit: 最大件数
+        state: load_state() の結果（省略時は読み込む）
+
+    Returns:
+        {"events", "next_cursor", "has_more", "last_seq"}
+
+    Raises:
+        CursorExpiredError: cursor の続きが保持期間を過ぎて削除済み
+    """
+    if state is None:
+        state = load_state()
+
+    segments = state["segments"]
+    oldest = segments[0]["blocks"][0][0] if segments and segments[0]["blocks"] else state["last_seq"] + 1
+    if cursor == 0:
+        cursor = oldest - 1
+    elif cursor + 1 < oldest and cursor < state["last_seq"]:
+        raise CursorExpiredError(f"Cursor {cursor} has expired. Oldest available sequence is {oldest}.")
+
+    events: List[Dict[str, Any]] = []
+    for segment in segments:
+        blocks = [b for b in segment["blocks"] if b[1] > cursor]
+        if not blocks:
+            continue
+
+        # 必要な件数分の連続したブロックだけを1回の範囲指定で読む
+        wanted, needed = [], limit - len(events)
+        for block in blocks:
+            wanted.append(block)
+            needed -= block[1] - max(block[0], cursor + 1) + 1
+            if needed <= 0:
+                break
+        offset = wanted[0][2]
+        length = wanted[-1][2] + wanted[-1][3] - offset
+        data = state_manager.get_blob_client(segment["blob"]).download_blob(
+            offset=offset, length=length,
+            timeout=state_manager.blob_timeout(f"reading {segment['blob']}")
+        ).readall()
+
+        for line in data.decode("utf-8").splitlines():
+            event = json.loads(line)
+            if event["seq"] > cursor:
+                events.append(event)
+                if len(events) >= limit:
+                    break
+        if len(events) >= limit:
+            break
+
+    next_cursor = events[-1]["seq"] if events else cursor
+    return {
+        "events": events,
+        "next_cursor": next_cursor,
+        "has_more": next_cursor < state["last_seq"],
+        "last_seq": state["last_seq"],
+    }
+
+
+def render_ndjson(page: Dict[str, Any]) -> Iterator[str]:
+    """1行1イベント、最終行に次の cursor"""
+    for event in page["events"]:
+        yield json.dumps(event, ensure_ascii=False) + "\n"
+    yield json.dumps({"next_cursor": page["next_cursor"], "has_more": page["has_more"]}) + "\n"
@@ -0,0 +1,223 @@
+"""
+Blob・ファイル・Webhook 用の圧縮コーデック
+
+STORAGE_CODEC=gzip|zstd で状態 Blob・スナップショット・ローカルの出力ファイルを圧縮して書き込みます。
+圧縮形式は先頭のマジックバイト（gzip: 1f 8b、zstd: 28 b5 2f fd）で判別できるため、
+読み込み側は設定に関係なく自動で展開します（非圧縮の既存データもそのまま読めます）。
+
+ローカルのファイルは圧縮形式に合わせて拡張子（.gz / .zst）を付けて書き込み、読み込み時は
+拡張子付きのファイルも探します。
+
+zstd は zstandard パッケージがある場合のみ使えます（任意の依存。requirements.txt には含めず、
+なければ gzip で書き込みます）。
+ZSTD_DICTIONARY に過去の問題から学習した辞書（scripts/train_zstd_dictionary.py）を指定すると
+辞書付きで圧縮します。zstd のフレームには辞書IDが入るため、読み込み時は同じ辞書を使います。
+"""
+import os
+import gzip
+import zlib
+import logging
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional
+
+
+CODEC_NONE = "none"
+CODEC_GZIP = "gzip"
+CODEC_ZSTD = "zstd"
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+# これより小さいデータは圧縮しない（ヘッダーの分だけ大きくなるため）
+MIN_COMPRESS_SIZE = 256
+
+DEFAULT_DICTIONARY_SIZE = 64 * 1024
+
+# ローカルのファイルに付ける拡張子
+FILE_SUFFIXES = {CODEC_NONE: "", CODEC_GZIP: ".gz", CODEC_ZSTD: ".zst"}
+
+
+def get_storage_codec() -> str:
+    """保存時のコーデック（環境変数 STORAGE_CODEC、既定は非圧縮）"""
+    return os.environ.get("STORAGE_CODEC", CODEC_NONE).lower()
+
+
+def _zstd():
+    """zstandard モジュール（なければ None）"""
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def resolve(codec: Optional[str]) -> str:
+    """使用可能なコーデックに解決（zstandard がなければ gzip）"""
+    codec = (codec or CODEC_NONE).lower()
+    if codec == CODEC_ZSTD and _zstd() is None:
+        _warn_zstd_unavailable()
+        return CODEC_GZIP
+    if codec not in (CODEC_GZIP, CODEC_ZSTD):
+        return CODEC_NONE
+    return codec
+
+
+@lru_cache(maxsize=1)
+def _warn_zstd_unavailable():
+    logging.warning("zstandard is not installed. Falling back to gzip.")
+
+
+@lru_cache(maxsize=4)
+def _load_dictionary(path: str):
+    zstandard = _zstd()
+    with open(path, "rb") as f:
+        dictionary = zstandard.ZstdCompressionDict(f.read())
+    logging.info(f"Loaded zstd dictionary: {path} (id={dictionary.dict_id()})")
+    return dictionary
+
+
+def get_dictionary():
+    """ZSTD_DICTIONARY の辞書（未設定なら None）"""
+    path = os.environ.get("ZSTD_DICTIONARY")
+    if not path or _zstd() is None:
+        return None
+    return _load_dictionary(path)
+
+
+def _zstd_compressor(use_dictionary: bool):
+    zstandard = _zstd()
+    dictionary = get_dictionary() if use_dictionary else None
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary, write_content_size=True)
+
+
+def detect(data: bytes) -> str:
+    """先頭のマジックバイトからコーデックを判別"""
+    if data[:2] == GZIP_MAGIC:
+        return CODEC_GZIP
+    if data[:4] == ZSTD_MAGIC:
+        return CODEC_ZSTD
+    return CODEC_NONE
+
+
+def encode(data: bytes, codec: Optional[str] = None, use_dictionary: bool = True) -> bytes:
+    """
+    圧縮
+
+    Args:
+        data: 圧縮するデータ
+        codec: コーデック（省略時は STORAGE_CODEC）
+        use_dictionary: zstd で ZSTD_DICTIONARY を使うか（受信側が辞書を持たない Webhook では False）
+    """
+    codec = resolve(codec if codec is not None else get_storage_codec())
+    if codec == CODEC_NONE or len(data) < MIN_COMPRESS_SIZE:
+        return data
+    if codec == CODEC_GZIP:
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return _zstd_compressor(use_dictionary).compress(data)
+
+
+def encode_stream(chunks: Iterable[bytes], codec: Optional[str] = None) -> Iterator[bytes]:
+    """
+    チャンク単位で圧縮（upload_blob にジェネレータのまま渡せる）
+
+    Args:
+        chunks: 圧縮するデータのチャンク
+        codec: コーデック（省略時は STORAGE_CODEC）
+    """
+    codec = resolve(codec if codec is not None else get_storage_codec())
+    if codec == CODEC_NONE:
+        yield from chunks
+        return
+
+    if codec == CODEC_GZIP:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = _zstd_compressor(use_dictionary=True).compressobj()
+
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def decode(data: bytes) -> bytes:
+    """形式を自動判別して展開（非圧縮ならそのまま）"""
+    codec = detect(data)
+    if codec == CODEC_GZIP:
+        return gzip.decompress(data)
+    if codec == CODEC_NONE:
+        return data
+
+    zstandard = _zstd()
+    if zstandard is None:
+        raise ValueError("Data is zstd-compressed but zstandard is not installed")
+
+    dict_id = zstandard.get_frame_parameters(data).dict_id
+    dictionary = None
+    if dict_id:
+        dictionary = get_dictionary()
+        if dictionary is None or dictionary.dict_id() != dict_id:
+            raise ValueError(f"Data requires zstd dictionary id={dict_id} (set ZSTD_DICTIONARY)")
+    return zstandard.ZstdDecompressor(dict_data=dictionary).decompressobj().decompress(data)
+
+
+def _file_variants(path) -> List[str]:
+    """path とその圧縮版（.gz / .zst）のファイル名"""
+    return [f"{path}{suffix}" for suffix in FILE_SUFFIXES.values()]
+
+
+def find_file(path) -> str:
+    """
+    path またはその圧縮版のうち、最後に書き込まれたもの
+
+    どれもなければ path をそのまま返す
+    """
+    existing = [variant for variant in _file_variants(path) if os.path.exists(variant)]
+    if not existing:
+        return str(path)
+    return max(existing, key=os.path.getmtime)
+
+
+def write_file(path, data: bytes, codec: Optional[str] = None) -> str:
+    """
+    圧縮してファイルに書き込む
+
+    圧縮した場合は path に拡張子（.gz / .zst）を付けて書き込み、別の形式で書いた
+    古いファイルは削除します。
+
+    Returns:
+        書き込んだファイル名
+    """
+    encoded = encode(data, codec)
+    target = f"{path}{FILE_SUFFIXES[detect(encoded)]}"
+    with open(target, "wb") as f:
+        f.write(encoded)
+
+    for variant in _file_variants(path):
+        if variant != target and os.path.exists(variant):
+            os.remove(variant)
+    return target
+
+
+def read_file(path) -> bytes:
+    """ファイル（なければ圧縮版）を読み込んで展開"""
+    with open(find_file(path), "rb") as f:
+        return decode(f.read())
+
+
+def train_dictionary(samples: List[bytes], size: int = DEFAULT_DICTIONARY_SIZE) -> bytes:
+    """
+    zstd の辞書を学習
+
+    Args:
+        samples: 学習用のサンプル（1件ずつの JSON など）
+        size: 辞書の最大サイズ（バイト）
+    """
+    zstandard = _zstd()
+    if zstandard is None:
+        raise ValueError("zstandard is not installed")
+    return zstandard.train_dictionary(size, samples).as_bytes()
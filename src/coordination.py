@@ -0,0 +1,202 @@
+"""
+run_job の多重実行を防ぐモジュール
+
+- プロセス内: SingleFlight で同時の呼び出しを1回の実行にまとめ、結果を共有
+- インスタンス間: Blob リースによるロックで1インスタンスだけが実行し、
+  他のインスタンスは実行完了を待って保存された結果を返す
+  （結果には実行ID・状態を付けて保存し、待ち始めた後に成功した実行の結果だけを使う。
+  実行していたインスタンスが失敗・停止した場合は、待っていたインスタンスが自分で実行する）
+"""
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+from . import deadline
+from . import state_manager
+
+
+RESULT_BLOB_NAME = "last-run-result.json"
+
+# 他インスタンスの実行完了を待つ上限（秒）と確認間隔（秒）
+WAIT_TIMEOUT = 600
+POLL_INTERVAL = 2.0
+
+# リースを延長する間隔（秒）
+RENEW_INTERVAL = state_manager.LEASE_DURATION / 3
+
+
+class LockTimeoutError(TimeoutError):
+    """他インスタンスの実行完了を待ちきれなかった"""
+
+
+class _Call:
+    """実行中の呼び出し"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    同じキーの同時呼び出しを1回の実行にまとめる
+
+    実行中に呼ばれた場合は新たに実行せず、実行中の呼び出しの完了を待って
+    同じ結果（または例外）を返します。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            logging.info(f"Joining in-flight call: {key}")
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+def _renew_until(lease, stop: threading.Event):
+    """stop されるまでリースを延長し続ける"""
+    while not stop.wait(RENEW_INTERVAL):
+        try:
+            lease.renew()
+        except Exception as e:
+            logging.warning(f"Failed to renew run lock lease: {e}")
+
+
+@contextmanager
+def hold_lease(lease):
+    """ブロックを抜けるまでリースを延長し、抜けたら解放する"""
+    stop = threading.Event()
+    renewer = threading.Thread(target=_renew_until, args=(lease, stop), daemon=True)
+    renewer.start()
+    try:
+        yield lease
+    finally:
+        stop.set()
+        renewer.join()
+        try:
+            lease.release()
+        except Exception as e:
+            logging.warning(f"Failed to release run lock lease: {e}")
+
+
+def _save_result(run_id: str, status: str, result: Any = None):
+    """実行ID・状態を付けて結果を保存（失敗しても処理は続ける）"""
+    try:
+        state_manager.save_json_state(RESULT_BLOB_NAME, {
+            "run_id": run_id,
+            "status": status,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "result": result,
+        })
+    except Exception as e:
+        logging.warning(f"Failed to save run result: {e}")
+
+
+def _run_holding(lease, fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """リースを保持したまま fn を実行し、結果（または失敗）を保存"""
+    run_id = uuid.uuid4().hex
+    with hold_lease(lease):
+        try:
+            result = fn()
+        except BaseException:
+            _save_result(run_id, "error")
+            raise
+        _save_result(run_id, "success", result)
+        return result
+
+
+def acquire_lock(wait_timeout: float = WAIT_TIMEOUT):
+    """
+    リースを取得できるまで待つ（他の実行の結果は使わない）
+
+    自分の処理を必ず実行する必要がある場合（ファンアウトの統合など）に使い、
+    取得したリースは hold_lease() で保持すること。
+
+    Raises:
+        LockTimeoutError: wait_timeout 秒（締め切りが近ければ残り時間）待っても取得できなかった
+    """
+    left = deadline.remaining()
+    if left is not None:
+        wait_timeout = max(0.0, min(wait_timeout, left))
+
+    wait_until = time.monotonic() + wait_timeout
+    while True:
+        lease = state_manager.try_acquire_lock()
+        if lease is not None:
+            return lease
+        if time.monotonic() >= wait_until:
+            raise LockTimeoutError(f"Timed out after {wait_timeout}s waiting for the run lock")
+        logging.info("Another instance holds the run lock. Waiting...")
+        time.sleep(POLL_INTERVAL)
+
+
+def run_exclusive(fn: Callable[[], Dict[str, Any]], wait_timeout: float = WAIT_TIMEOUT) -> Dict[str, Any]:
+    """
+    Blob リースを取得できたインスタンスだけが fn を実行する
+
+    リースを取得できなかった場合は、保持しているインスタンスの実行完了
+    （リース解放）を待ち、そのインスタンスが保存した結果を返します。
+    待ち始めた時点の結果から実行IDが変わっていない（保存前に停止した）、
+    または失敗した場合は、取得したリースを保持したまま自分で fn を実行します。
+
+    Args:
+        fn: 実行する処理（JSON に変換できる dict を返すこと）
+        wait_timeout: 他インスタンスの完了を待つ上限（秒）
+    """
+    lease = state_manager.try_acquire_lock()
+    if lease is not None:
+        return _run_holding(lease, fn)
+
+    previous_run_id = state_manager.load_json_state(RESULT_BLOB_NAME).get("run_id")
+
+    # 呼び出しの締め切りより長くは待たない
+    left = deadline.remaining()
+    if left is not None:
+        wait_timeout = max(0.0, min(wait_timeout, left))
+
+    logging.info("Another instance is running the job. Waiting for its result...")
+    wait_until = time.monotonic() + wait_timeout
+    while time.monotonic() < wait_until:
+        time.sleep(POLL_INTERVAL)
+        lease = state_manager.try_acquire_lock()
+        if lease is None:
+            continue
+
+        saved = state_manager.load_json_state(RESULT_BLOB_NAME)
+        if saved.get("run_id") not in (None, previous_run_id) and saved.get("status") == "success":
+            lease.release()
+            logging.info(f"Using the result of run {saved['run_id']} finished at {saved.get('finished_at')}.")
+            return saved["result"]
+
+        logging.warning(
+            f"The other run did not save a new successful result (status={saved.get('status')}). Running the job here."
+        )
+        return _run_holding(lease, fn)
+
+    raise LockTimeoutError(f"Timed out after {wait_timeout}s waiting for the running job")
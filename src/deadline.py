@@ -0,0 +1,157 @@
+"""
+呼び出し（invocation）ごとの締め切り
+
+functionTimeout（host.json、未設定ならプランの既定値）を超えると実行は状態を保存しないまま打ち切られるため、
+呼び出しの開始時に締め切りを決め（start）、各ネットワーク呼び出しのタイムアウトを
+残り時間から求めます（timeout）。
+
+- 締め切りは contextvars で持ち回るため、引数で渡す必要はありません
+  （スレッドプールに渡す処理は bind() で包むと同じ締め切りが使われます）
+- 残り時間が DEADLINE_OPTIONAL_RESERVE_SECONDS を下回ったら、集計の更新などの
+  省略できる処理は行いません（allows_optional）
+- 締め切りを過ぎてからネットワーク呼び出しをしようとすると DeadlineExceeded になります
+
+締め切りが設定されていない（start の外の）呼び出しは従来どおり既定のタイムアウトを使います。
+"""
+import os
+import json
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+
+HOST_JSON = Path(__file__).resolve().parent.parent / "host.json"
+
+# host.json に functionTimeout がない場合のプランごとの既定値（秒）
+# Consumption は5分、Premium・Dedicated・Flex Consumption は30分
+CONSUMPTION_FUNCTION_TIMEOUT = 300.0
+DEFAULT_FUNCTION_TIMEOUT = 1800.0
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """呼び出しの締め切りを過ぎた"""
+
+
+def _parse_timespan(value: str) -> Optional[float]:
+    """hh:mm:ss 形式を秒に変換（-1 などの無制限は None）"""
+    parts = value.split(":")
+    if len(parts) != 3:
+        return None
+    hours, minutes, seconds = parts
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _plan_default_timeout() -> float:
+    """プランの既定の functionTimeout（WEBSITE_SKU が Dynamic なら Consumption）"""
+    if os.environ.get("WEBSITE_SKU", "").lower() == "dynamic":
+        return CONSUMPTION_FUNCTION_TIMEOUT
+    return DEFAULT_FUNCTION_TIMEOUT
+
+
+@lru_cache(maxsize=1)
+def get_function_timeout() -> float:
+    """host.json の functionTimeout（秒、未設定・無制限ならプランの既定値）"""
+    try:
+        with open(HOST_JSON, "r", encoding="utf-8") as f:
+            value = json.load(f).get("functionTimeout")
+        if value:
+            return _parse_timespan(value) or _plan_default_timeout()
+    except (OSError, ValueError) as e:
+        logging.warning(f"Failed to read functionTimeout from host.json: {e}")
+    return _plan_default_timeout()
+
+
+def get_budget() -> float:
+    """
+    1回の呼び出しで使える時間（秒）
+
+    DEADLINE_BUDGET_SECONDS、未設定なら functionTimeout から
+    DEADLINE_MARGIN_SECONDS（状態の保存・ログ出力の分）を引いた時間
+    """
+    value = os.environ.get("DEADLINE_BUDGET_SECONDS")
+    if value:
+        return float(value)
+    margin = float(os.environ.get("DEADLINE_MARGIN_SECONDS", "30"))
+    return max(1.0, get_function_timeout() - margin)
+
+
+def get_optional_reserve() -> float:
+    """省略できる処理を行うのに必要な残り時間（秒）"""
+    return float(os.environ.get("DEADLINE_OPTIONAL_RESERVE_SECONDS", "60"))
+
+
+@contextmanager
+def start(budget: Optional[float] = None) -> Iterator[float]:
+    """
+    この呼び出しの締め切りを設定
+
+    すでに締め切りがある場合（manual_trigger から run_job を呼ぶなど）は、
+    短い方を使います。
+
+    Args:
+        budget: 使える時間（秒、省略時は get_budget()）
+    """
+    at = time.monotonic() + (budget if budget is not None else get_budget())
+    current = _deadline.get()
+    if current is not None:
+        at = min(at, current)
+    token = _deadline.set(at)
+    try:
+        yield at
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """締め切りまでの残り時間（秒、締め切りがなければ None）"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check(operation: str = "operation"):
+    """
+    締め切りを過ぎていれば DeadlineExceeded
+
+    Raises:
+        DeadlineExceeded: 締め切りを過ぎた
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {operation}")
+
+
+def timeout(default: float, operation: str = "operation") -> float:
+    """
+    ネットワーク呼び出しのタイムアウト（既定値と残り時間の短い方）
+
+    Raises:
+        DeadlineExceeded: 締め切りを過ぎた
+    """
+    check(operation)
+    left = remaining()
+    return default if left is None else min(default, left)
+
+
+def allows_optional(stage: str) -> bool:
+    """省略できる処理を行う余裕があるか（なければログに出して False）"""
+    left = remaining()
+    if left is None or left >= get_optional_reserve():
+        return True
+    logging.warning(f"Skipping {stage}: only {left:.1f}s left before the deadline.")
+    return False
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    呼び出し元の締め切りを引き継いで fn を実行する関数を返す
+
+    スレッドプールのワーカーには contextvars が引き継がれないため、submit / map に渡す前に包む
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
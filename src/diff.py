@@ -0,0 +1,70 @@
+"""
+スナップショット間の差分を変更イベントに変換するモジュール
+
+前回と今回のスナップショットを workItemId で突き合わせ、
+新規・更新・削除（今回の取得結果から消えたもの）をイベントとして返します。
+"""
+from datetime import datetime
+from typing import List, Dict, Any, Iterable, Optional
+from . import state_manager
+
+
+# イベントの種類
+EVENT_NEW = "new"
+EVENT_UPDATED = "updated"
+EVENT_REMOVED = "removed"
+
+
+def _index(items: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """workItemId -> アイテム"""
+    return {
+        str(item.get("workItemId")): item
+        for item in items
+        if item.get("workItemId")
+    }
+
+
+def _event(event_type: str, item: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """変更イベントを作成"""
+    return {
+        "type": event_type,
+        "workItemId": str(item.get("workItemId")),
+        "product": item.get("product"),
+        "state": item.get("state"),
+        "previousState": previous.get("state") if previous else None,
+        "changedDate": item.get("changedDate"),
+        "item": item,
+    }
+
+
+def compute_changes(previous: Optional[List[Dict[str, Any]]], current: List[Dict[str, Any]],
+                    since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    前回と今回のスナップショットから変更イベントを作成
+
+    Args:
+        previous: 前回のアイテム（初回など前回がない場合は None）
+        current: 今回のアイテム
+        since: 前回がない場合に changedDate でフィルタする基準日時
+
+    Returns:
+        変更イベントのリスト（new / updated / removed）
+    """
+    if previous is None:
+        # 前回がなければ全件を新規扱いにせず、changedDate で絞る
+        items = state_manager.filter_by_changed_date(current, since) if since else current
+        return [_event(EVENT_UPDATED, item) for item in items]
+
+    before = _index(previous)
+    events = []
+    for work_item_id, item in _index(current).items():
+        old = before.pop(work_item_id, None)
+        if old is None:
+            events.append(_event(EVENT_NEW, item))
+        elif old.get("changedDate") != item.get("changedDate") or old.get("state") != item.get("state"):
+            events.append(_event(EVENT_UPDATED, item, old))
+
+    for item in before.values():
+        events.append(_event(EVENT_REMOVED, item, item))
+
+    return events
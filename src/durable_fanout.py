@@ -0,0 +1,275 @@
+"""
+Durable Functions による製品グループ単位のファンアウト / ファンイン
+
+オーケストレーターが製品グループ（× ロケール × 状態）ごとに取得アクティビティを
+並列に起動し、全件そろったら統合して差分・通知に渡します。
+
+- 各アクティビティの結果は Blob（fanout/<インスタンスID>/part-NNNN.json）に保存し、
+  オーケストレーションの履歴には Blob 名だけを残します
+- 失敗したインスタンスを同じインスタンスIDで再実行すると、保存済みのグループは
+  取得せずに再利用するため、失敗したところから再開できます
+  （既定のインスタンスIDは実行ごとに一意。完了済みのインスタンスは再実行しない）
+- 統合・通知は run_job と同じロックを取得できるまで待ってから行う（他の実行の結果は使わず、
+  必ずこのインスタンスの結果を反映する。各タスクの結果は反映に成功してから削除する）
+
+azure-functions-durable が必要です（function_app.py でブループリントとして登録）。
+"""
+import os
+import uuid
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import azure.functions as func
+import azure.durable_functions as df
+from . import aggregates
+from . import change_feed
+from . import coordination
+from . import deadline
+from . import notifier
+from . import pipeline
+from . import state_manager
+from . import sweep
+from . import token_refresher
+from .auth_manager import AuthManager
+from .settings import get_sweep_settings
+
+
+ORCHESTRATOR_NAME = "fanout_orchestrator"
+BLOB_PREFIX = "fanout/"
+
+# 取得アクティビティの再試行
+RETRY_FIRST_INTERVAL_MS = 5000
+RETRY_MAX_ATTEMPTS = 3
+
+bp = df.Blueprint()
+
+
+def is_enabled() -> bool:
+    """日次実行をオーケストレーションで行うか（環境変数 DURABLE_FANOUT）"""
+    return os.environ.get("DURABLE_FANOUT", "false").lower() in ("1", "true", "yes")
+
+
+def get_group_size() -> int:
+    """1アクティビティで取得する製品数（FANOUT_GROUP_SIZE、未設定なら productGroupSize、それも0なら10）"""
+    value = os.environ.get("FANOUT_GROUP_SIZE")
+    if value:
+        return max(1, int(value))
+    return get_sweep_settings()["productGroupSize"] or 10
+
+
+def default_instance_id() -> str:
+    """実行ごとのインスタンスID（同じ日に再実行しても前回の結果を再利用しない）"""
+    return "fanout-" + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + "-" + uuid.uuid4().hex[:8]
+
+
+def _part_blob(instance_id: str, index: int) -> str:
+    return f"{BLOB_PREFIX}{instance_id}/part-{index:04d}.json"
+
+
+def _result_blob(instance_id: str) -> str:
+    return f"{BLOB_PREFIX}{instance_id}/result.json"
+
+
+def _get_access_token() -> str:
+    """アクティビティ用のアクセストークン"""
+    if token_refresher.is_enabled():
+        return token_refresher.get_refresher().get_access_token()
+    auth_manager = AuthManager()
+    token = auth_manager.get_access_token()
+    auth_manager.flush()
+    return token
+
+
+# ----------------------------------------------------------------------
+# 起動
+# ----------------------------------------------------------------------
+
+async def _start(client: df.DurableOrchestrationClient, instance_id: str) -> str:
+    """
+    オーケストレーションを開始（実行中・完了済みならそのまま、失敗していれば同じIDで再実行）
+    """
+    status = await client.get_status(instance_id)
+    if status and status.runtime_status in (
+        df.OrchestrationRuntimeStatus.Running,
+        df.OrchestrationRuntimeStatus.Pending,
+    ):
+        logging.info(f"Orchestration {instance_id} is already running.")
+        return instance_id
+    if status and status.runtime_status == df.OrchestrationRuntimeStatus.Completed:
+        logging.info(f"Orchestration {instance_id} has already completed.")
+        return instance_id
+
+    await client.start_new(ORCHESTRATOR_NAME, instance_id, {"instance_id": instance_id})
+    logging.info(f"Started orchestration: {instance_id}")
+    return instance_id
+
+
+@bp.route(route="orchestrators/fanout", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
+@bp.durable_client_input(client_name="client")
+async def fanout_start(req: func.HttpRequest, client) -> func.HttpResponse:
+    """
+    ファンアウト取得を開始して状態確認用 URL を返す
+
+    クエリ: instance_id（省略時は新しい実行。失敗したインスタンスを指定すると続きから再開）
+    """
+    instance_id = req.params.get("instance_id") or default_instance_id()
+    await _start(client, instance_id)
+    return client.create_check_status_response(req, instance_id)
+
+
+# TZ=Asia/Tokyo が設定されているため、cron式はJST基準
+@bp.schedule(schedule="0 0 9 * * *", arg_name="myTimer", run_on_startup=False,
+             use_monitor=True)
+@bp.durable_client_input(client_name="client")
+async def fanout_timer(myTimer: func.TimerRequest, client) -> None:
+    """毎日 JST 9:00 にファンアウト取得を開始（DURABLE_FANOUT=true の場合のみ）"""
+    if not is_enabled():
+        return
+    await _start(client, default_instance_id())
+
+
+# ----------------------------------------------------------------------
+# オーケストレーター
+# ----------------------------------------------------------------------
+
+@bp.orchestration_trigger(context_name="context")
+def fanout_orchestrator(context: df.DurableOrchestrationContext):
+    """取得タスクをファンアウトし、結果を統合して差分・通知へ"""
+    instance_id = context.instance_id
+    retry = df.RetryOptions(
+        first_retry_interval_in_milliseconds=RETRY_FIRST_INTERVAL_MS,
+        max_number_of_attempts=RETRY_MAX_ATTEMPTS,
+    )
+
+    plan = yield context.call_activity("fanout_plan", None)
+    context.set_custom_status({"stage": "fetch", "tasks": len(plan)})
+
+    fetches = [
+        context.call_activity_with_retry(
+            "fanout_fetch_group", retry,
+            {"instance_id": instance_id, "index": index, "task": task}
+        )
+        for index, task in enumerate(plan)
+    ]
+    parts = yield context.task_all(fetches)
+
+    context.set_custom_status({"stage": "finalize", "tasks": len(plan)})
+    result = yield context.call_activity_with_retry(
+        "fanout_finalize", retry, {"instance_id": instance_id, "parts": parts}
+    )
+
+    context.set_custom_status({"stage": "done", "tasks": len(plan)})
+    return result
+
+
+# ----------------------------------------------------------------------
+# アクティビティ
+# ----------------------------------------------------------------------
+
+@bp.activity_trigger(input_name="payload")
+def fanout_plan(payload: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """有効な製品を製品グループ × ロケール × 状態のタスクに分割"""
+    plan = sweep.plan_sweep(group_size=get_group_size())
+    logging.info(f"Fan-out plan: {len(plan)} tasks")
+    return plan
+
+
+@bp.activity_trigger(input_name="payload")
+def fanout_fetch_group(payload: Dict[str, Any]) -> str:
+    """
+    1タスク分を取得して Blob に保存
+
+    保存済みなら取得しない（再実行時はここから再開される）
+
+    Returns:
+        結果を保存した Blob 名
+    """
+    with deadline.start():
+        return _fetch_group(payload)
+
+
+def _fetch_group(payload: Dict[str, Any]) -> str:
+    blob_name = _part_blob(payload["instance_id"], payload["index"])
+    if state_manager.load_json_state(blob_name):
+        logging.info(f"Reusing checkpoint: {blob_name}")
+        return blob_name
+
+    task = payload["task"]
+    items = sweep.run_task(_get_access_token(), task)
+    state_manager.save_json_state(blob_name, {"task": task, "items": items})
+    logging.info(
+        f"Fan-out task done: locale={task['locale']}, status={task['issueStatus']}, "
+        f"products={len(task['productIds'] or [])}, issues={len(items)}"
+    )
+    return blob_name
+
+
+@bp.activity_trigger(input_name="payload")
+def fanout_finalize(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    全タスクの結果を統合して差分・通知へ渡す
+
+    QUEUE_PIPELINE=true なら差分キューへ、そうでなければこの場で
+    前回実行以降の更新を通知します。run_job（タイマー・manual_trigger）と
+    重ならないよう、統合後の処理は run_job と同じロックを取得してから行います。
+    """
+    with deadline.start():
+        return _finalize(payload)
+
+
+def _finalize(payload: Dict[str, Any]) -> Dict[str, Any]:
+    instance_id = payload["instance_id"]
+    result_blob = _result_blob(instance_id)
+    done = state_manager.load_json_state(result_blob)
+    if done:
+        logging.info(f"Orchestration {instance_id} already finalized.")
+        return done
+
+    results = []
+    for blob_name in payload["parts"]:
+        part = state_manager.load_json_state(blob_name)
+        results.append((part["task"], part.get("items", [])))
+
+    merged = sweep.merge_results(results, primary_locale=get_sweep_settings()["locales"][0])
+    issues, localized, complete = merged["issues"], merged["localized"], merged["complete"]
+    logging.info(f"Fan-in merged: {len(issues)} unique issues from {len(results)} tasks")
+
+    # 取得できなければ LockTimeoutError でアクティビティを再試行（各タスクの結果は残したまま）
+    lease = coordination.acquire_lock()
+    with coordination.hold_lease(lease):
+        result = _publish(instance_id, issues, localized, complete)
+    state_manager.save_json_state(result_blob, result)
+
+    # 統合が済んだら各タスクの結果は不要
+    for blob_name in payload["parts"]:
+        try:
+            state_manager.get_blob_client(blob_name).delete_blob()
+        except Exception as e:
+            logging.warning(f"Failed to delete {blob_name}: {e}")
+
+    return result
+
+
+def _publish(instance_id: str, issues: List[Dict[str, Any]], localized: Optional[dict],
+             complete: bool) -> Dict[str, Any]:
+    """統合した結果を差分キューへ送る、またはこの場で通知する（ロック保持中に呼ぶ）"""
+    if pipeline.is_enabled():
+        pipeline.publish_snapshot(instance_id, issues, localized, complete)
+        return {"total_count": len(issues), "queued": True}
+
+    state_manager.save_snapshot(issues, localized=localized)
+    last_run = state_manager.get_last_run_time()
+    new_items = state_manager.filter_by_changed_date(issues, last_run)
+    state_manager.save_last_run_time()
+    if deadline.allows_optional("aggregates"):
+        current_ids = {str(item.get("workItemId")) for item in issues} if complete else None
+        aggregates.update(new_items, current_ids)
+    change_feed.record_changes(new_items)
+    notification_sent = notifier.send_notification(new_items, len(issues))
+    logging.info(f"Notification sent: {notification_sent}")
+    return {
+        "total_count": len(issues),
+        "new_count": len(new_items),
+        "last_run": last_run.isoformat(),
+        "notification_sent": notification_sent,
+    }
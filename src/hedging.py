@@ -0,0 +1,228 @@
+"""
+検索APIのヘッジリクエスト
+
+1回目のリクエストが直近の所要時間の p95 を過ぎても返ってこない場合に、同じリクエストを
+もう1つ送り、先に成功した方の結果を使います（HEDGED_REQUESTS=true の場合のみ）。
+
+- p95 は直近 HEDGE_WINDOW 回の所要時間から求めます（HEDGE_MIN_SAMPLES 回に満たない間は
+  HEDGE_INITIAL_DELAY_SECONDS 秒を使います）
+- 追加のリクエストは全リクエストの HEDGE_BUDGET_PERCENT % までに抑えます
+- 送信済みのリクエストは途中で止められないため、負けた側は待たずに捨て、
+  応答が届いた時点で接続を閉じます（まだ送信前なら取り消します）
+
+ヘッジ率と短縮できた時間はメトリクス（hedge_*）と stats() で確認できます。
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+from . import metrics
+
+
+MAX_WORKERS = 8
+
+# 予算とは別に使える追加リクエストの数（リクエストの少ない実行でもヘッジできるように）
+BUDGET_BURST = 1
+
+
+def is_enabled() -> bool:
+    """ヘッジリクエストを使うか（環境変数 HEDGED_REQUESTS）"""
+    return os.environ.get("HEDGED_REQUESTS", "false").lower() in ("1", "true", "yes")
+
+
+def get_budget_ratio() -> float:
+    """全リクエストに対する追加リクエストの上限（割合）"""
+    return float(os.environ.get("HEDGE_BUDGET_PERCENT", "10")) / 100
+
+
+def get_initial_delay() -> float:
+    """所要時間の記録が少ない間のヘッジまでの待ち時間（秒）"""
+    return float(os.environ.get("HEDGE_INITIAL_DELAY_SECONDS", "5"))
+
+
+def get_min_samples() -> int:
+    return int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+
+
+def get_window() -> int:
+    return int(os.environ.get("HEDGE_WINDOW", "200"))
+
+
+class LatencyTracker:
+    """直近の所要時間から分位点を求める（保持する件数は window まで）"""
+
+    def __init__(self, window: int):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HedgeBudget:
+    """追加リクエストを全リクエストの一定割合までに抑える"""
+
+    def __init__(self, ratio: float):
+        self.ratio = ratio
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_spend(self) -> bool:
+        """追加リクエストを送ってよければ True（1回分を使う）"""
+        with self._lock:
+            if self.hedges + 1 > self.ratio * self.requests + BUDGET_BURST:
+                return False
+            self.hedges += 1
+            return True
+
+
+class Hedger:
+    """1種類のリクエストのヘッジ（所要時間・予算・結果を保持）"""
+
+    def __init__(self, name: str, ratio: float, window: int):
+        self.name = name
+        self.tracker = LatencyTracker(window)
+        self.budget = HedgeBudget(ratio)
+        self.wins = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def get_delay(self) -> float:
+        """ヘッジを送るまでの待ち時間（p95、記録が少なければ初期値）"""
+        if len(self.tracker) < get_min_samples():
+            return get_initial_delay()
+        return self.tracker.quantile(0.95)
+
+    def call(self, fn: Callable[[], Any], discard: Optional[Callable[[Any], None]] = None) -> Any:
+        """
+        fn を実行し、遅ければ同じ fn をもう1つ実行して先に成功した方を返す
+
+        Args:
+            fn: リクエストを送って結果を返す処理（スレッドから呼ばれる）。
+                エラー応答は例外にすること（返した結果はすべて成功として扱う）
+            discard: 使わなかった結果の後始末（レスポンスを閉じるなど）
+        """
+        self.budget.record_request()
+        metrics.inc("hedge_requests_total", target=self.name)
+        delay = self.get_delay()
+
+        started = time.perf_counter()
+        primary = _submit(fn)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.budget.try_spend():
+            result = primary.result()
+            self.tracker.record(time.perf_counter() - started)
+            return result
+
+        logging.info(f"{self.name}: no response after {delay:.2f}s. Sending a hedged request.")
+        metrics.inc("hedges_total", target=self.name)
+        hedge = _submit(fn)
+        attempts = {primary: "primary", hedge: "hedge"}
+
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+
+                finished = time.perf_counter()
+                self.tracker.record(finished - started)
+                winner = attempts[future]
+                if winner == "hedge":
+                    with self._lock:
+                        self.wins += 1
+                for loser in pending:
+                    self._abandon(loser, winner, finished, discard)
+                logging.info(f"{self.name}: {winner} request won after {finished - started:.2f}s.")
+                metrics.inc("hedge_wins_total", target=self.name, winner=winner)
+                return future.result()
+
+        raise error
+
+    def _abandon(self, future: Future, winner: str, won_at: float, discard: Optional[Callable[[Any], None]]):
+        """負けたリクエストを取り消す（送信済みなら応答を待たずに捨てる）"""
+        if future.cancel():
+            return
+
+        def _on_done(f: Future):
+            if f.exception() is not None:
+                return
+            # 1回目が負けた場合、その応答が届くまでの時間がヘッジで短縮できた時間
+            if winner == "hedge":
+                saved = time.perf_counter() - won_at
+                with self._lock:
+                    self.saved_seconds += saved
+                metrics.inc("hedge_saved_seconds_total", saved, target=self.name)
+            if discard is not None:
+                discard(f.result())
+
+        future.add_done_callback(_on_done)
+
+    def stats(self) -> Dict[str, Any]:
+        """ヘッジ率・短縮できた時間"""
+        requests, hedges = self.budget.requests, self.budget.hedges
+        p95 = self.tracker.quantile(0.95)
+        return {
+            "requests": requests,
+            "hedges": hedges,
+            "hedge_rate": round(hedges / requests, 3) if requests else 0.0,
+            "hedge_wins": self.wins,
+            "latency_saved_seconds": round(self.saved_seconds, 3),
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+        }
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_hedgers: Dict[str, Hedger] = {}
+_lock = threading.Lock()
+
+
+def _submit(fn: Callable[[], Any]) -> Future:
+    """
+    共有のスレッドプールで実行
+
+    負けたリクエストの終了を待たずに戻れるように、with で閉じるプールは使わない
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="hedge")
+    return _executor.submit(fn)
+
+
+def get_hedger(name: str) -> Hedger:
+    """プロセス内で共有するヘッジ（所要時間の記録はウォームインスタンスの実行をまたいで使う）"""
+    with _lock:
+        hedger = _hedgers.get(name)
+        if hedger is None:
+            hedger = _hedgers[name] = Hedger(name, get_budget_ratio(), get_window())
+        return hedger
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """すべてのヘッジの集計"""
+    with _lock:
+        hedgers = list(_hedgers.values())
+    return {hedger.name: hedger.stats() for hedger in hedgers}
@@ -0,0 +1,218 @@
+"""
+保存済みスナップショットを読み取り専用で検索するモジュール
+
+HTTP ルートから呼ばれ、Blob のスナップショットをプロセス内にキャッシュします。
+トークンリフレッシュ・API呼び出し・通知は一切行いません。
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+from . import state_manager
+
+
+# ページサイズ
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# 形式
+FORMAT_JSON = "json"
+FORMAT_NDJSON = "ndjson"
+
+_cache: Dict[str, Any] = {
+    "etag": None,
+    "snapshot": None,
+    "checked_at": 0.0,
+}
+_cache_lock = threading.Lock()
+
+
+class QueryError(ValueError):
+    """クエリパラメータが不正"""
+
+
+def get_cache_ttl() -> float:
+    """Blob の ETag を再確認するまでの秒数（環境変数でカスタマイズ可能）"""
+    return float(os.environ.get("SNAPSHOT_CACHE_TTL", "60"))
+
+
+def get_cached_snapshot() -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    キャッシュ済みのスナップショットを取得
+
+    TTL を過ぎていたら ETag だけを確認し、変わっていた場合のみ再ダウンロードします。
+
+    Returns:
+        (スナップショット, ETag)
+    """
+    with _cache_lock:
+        now = time.monotonic()
+        if _cache["snapshot"] is not None and now - _cache["checked_at"] < get_cache_ttl():
+            return _cache["snapshot"], _cache["etag"]
+
+        etag = state_manager.get_snapshot_etag()
+        if etag is None or etag != _cache["etag"]:
+            snapshot, etag = state_manager.load_snapshot()
+            if snapshot is not None:
+                snapshot["issues"] = _sort_issues(snapshot.get("issues", []))
+            _cache["snapshot"] = snapshot
+            _cache["etag"] = etag
+            logging.info(f"Snapshot cache refreshed: etag={etag}")
+
+        _cache["checked_at"] = now
+        return _cache["snapshot"], _cache["etag"]
+
+
+def _sort_key(item: Dict[str, Any]) -> Tuple[float, str]:
+    """
+    ページングのキー（changedDate 降順、workItemId）
+
+    changedDate は UNIX 秒で比較します（タイムゾーン表記の違いで順序が崩れないように）。
+    ない・不正な changedDate は最も古いものとして扱います。
+    """
+    return (state_manager.changed_timestamp(item) or 0.0, str(item.get("workItemId") or ""))
+
+
+def _sort_issues(issues: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """changedDate の新しい順に並べる"""
+    return sorted(issues, key=_sort_key, reverse=True)
+
+
+def encode_cursor(item: Dict[str, Any]) -> str:
+    """最後に返したアイテムからカーソルを作成"""
+    raw = json.dumps(list(_sort_key(item)), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """カーソルをページングキーに戻す"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        changed_at, work_item_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise QueryError(f"Invalid cursor: {cursor}")
+    if isinstance(changed_at, bool) or not isinstance(changed_at, (int, float)) or not isinstance(work_item_id, str):
+        raise QueryError(f"Invalid cursor: {cursor}")
+    return (float(changed_at), work_item_id)
+
+
+def parse_params(params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    クエリパラメータを解釈
+
+    product / state: カンマ区切りで複数指定可
+    changed_since:   ISO 8601 日時（タイムゾーンなし・日付のみは UTC とみなす）
+    limit:           1ページの件数
+    cursor:          前ページの next_cursor
+    format:          json（既定）または ndjson
+    """
+    def _split(value):
+        return {v.strip() for v in value.split(",") if v.strip()} if value else None
+
+    changed_since = params.get("changed_since")
+    if changed_since:
+        try:
+            changed_since = datetime.fromisoformat(changed_since.replace("Z", "+00:00"))
+        except ValueError:
+            raise QueryError(f"Invalid changed_since: {changed_since}")
+        if changed_since.tzinfo is None:
+            changed_since = changed_since.replace(tzinfo=timezone.utc)
+
+    try:
+        limit = int(params.get("limit") or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise QueryError(f"Invalid limit: {params.get('limit')}")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    cursor = params.get("cursor")
+
+    output_format = (params.get("format") or FORMAT_JSON).lower()
+    if output_format not in (FORMAT_JSON, FORMAT_NDJSON):
+        raise QueryError(f"Invalid format: {output_format}")
+
+    return {
+        "products": _split(params.get("product")),
+        "states": _split(params.get("state")),
+        "changed_since": changed_since.timestamp() if changed_since else None,
+        "limit": limit,
+        "cursor": decode_cursor(cursor) if cursor else None,
+        "format": output_format,
+    }
+
+
+def compute_etag(snapshot_etag: str, params: Dict[str, str]) -> str:
+    """スナップショットの ETag とクエリからレスポンスの ETag を作成"""
+    digest = hashlib.sha1()
+    digest.update((snapshot_etag or "").encode("utf-8"))
+    for key in sorted(params):
+        digest.update(f"&{key}={params[key]}".encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match ヘッダーが ETag に一致するか"""
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _matches(item: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """フィルタ条件に一致するか"""
+    if query["products"] and item.get("product") not in query["products"]:
+        return False
+    if query["states"] and item.get("state") not in query["states"]:
+        return False
+    if query["changed_since"] is not None:
+        changed_at = state_manager.changed_timestamp(item)
+        if changed_at is None or changed_at <= query["changed_since"]:
+            return False
+    return True
+
+
+def query_issues(issues: List[Dict[str, Any]], query: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    changedDate 降順に並んだアイテムをフィルタし、1ページ分を返す
+
+    Returns:
+        (ページのアイテム, 次ページのカーソル。最終ページなら None)
+    """
+    cursor = query["cursor"]
+    page = []
+    has_more = False
+
+    for item in issues:
+        if cursor is not None and _sort_key(item) >= cursor:
+            continue
+        if not _matches(item, query):
+            continue
+        if len(page) >= query["limit"]:
+            has_more = True
+            break
+        page.append(item)
+
+    next_cursor = encode_cursor(page[-1]) if has_more and page else None
+    return page, next_cursor
+
+
+def render_json(snapshot: Dict[str, Any], page: List[Dict[str, Any]], next_cursor: Optional[str]) -> str:
+    """JSON レスポンス本文を作成"""
+    return json.dumps({
+        "retrieved_at": snapshot.get("retrieved_at"),
+        "total_count": snapshot.get("count", len(snapshot.get("issues", []))),
+        "count": len(page),
+        "next_cursor": next_cursor,
+        "items": page,
+    }, ensure_ascii=False)
+
+
+def render_ndjson(page: List[Dict[str, Any]], next_cursor: Optional[str]):
+    """NDJSON レスポンスを1行ずつ生成（最終行にカーソル）"""
+    for item in page:
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+    yield json.dumps({"next_cursor": next_cursor}) + "\n"
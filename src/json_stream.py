@@ -0,0 +1,107 @@
+"""
+JSON 配列をチャンク単位で読み込み、要素を1件ずつデコードするモジュール
+
+レスポンス全体をバッファしてから json.loads する代わりに、
+受信したチャンクから完成した要素だけを順次取り出します。
+保持するのは未処理のテキスト（最大で1要素 + 1チャンク程度）のみです。
+"""
+import json
+import codecs
+from typing import Any, Iterable, Iterator
+
+
+_WHITESPACE = " \t\n\r"
+
+
+class _Buffer:
+    """デコード済みテキストのバッファ（消費済みの部分は随時破棄）"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.text = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def fill(self) -> bool:
+        """次のチャンクを読み込む（これ以上なければ False）"""
+        while not self.exhausted:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self.exhausted = True
+                tail = self._decoder.decode(b"", final=True)
+                if tail:
+                    self.text = self.text[self.pos:] + tail
+                    self.pos = 0
+                    return True
+                return False
+            if not chunk:
+                continue
+            self.text = self.text[self.pos:] + self._decoder.decode(chunk)
+            self.pos = 0
+            return True
+        return False
+
+    def peek(self) -> str:
+        """空白を読み飛ばして次の1文字を返す（終端なら空文字）"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    バイト列のチャンクから JSON 配列の要素を1件ずつ返す
+
+    Args:
+        chunks: レスポンス本文のチャンク（response.iter_content など）
+
+    Yields:
+        配列の各要素
+
+    Raises:
+        ValueError: トップレベルが配列でない、または JSON として不正な場合
+    """
+    decoder = json.JSONDecoder()
+    buffer = _Buffer(chunks)
+
+    if buffer.peek() != "[":
+        raise ValueError("Top-level JSON value is not an array")
+    buffer.pos += 1
+
+    if buffer.peek() == "]":
+        return
+
+    while True:
+        if not buffer.peek():
+            raise ValueError("Unexpected end of JSON array")
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer.text, buffer.pos)
+            except json.JSONDecodeError:
+                if buffer.fill():
+                    continue
+                raise
+            # 数値などチャンク境界で途切れている可能性がある場合は続きを読んでから再デコード
+            if end == len(buffer.text) and buffer.fill():
+                continue
+            break
+
+        buffer.pos = end
+        yield value
+
+        separator = buffer.peek()
+        if separator == ",":
+            buffer.pos += 1
+        elif separator == "]":
+            return
+        elif not separator:
+            raise ValueError("Unexpected end of JSON array")
+        else:
+            raise ValueError(f"Unexpected character in JSON array: {separator!r}")
@@ -0,0 +1,263 @@
+"""
+プロセス内のメトリクス（カウンター・ゲージ・ヒストグラム）
+
+取得件数・API/トークン/Key Vault/Blob の所要時間・通知の結果などを数値で記録し、
+metrics ルートで Prometheus のテキスト形式として返します。
+タイマー実行の終わりには flush() で Blob（metrics.json）にも保存します
+（次の実行が別インスタンスになっても、最後の実行の値を metrics ルートの source=blob で参照できます）。
+
+メモリは上限付きです。
+- ヒストグラムはバケットごとの件数・合計・件数だけを持つ（観測値は保持しない）
+- 1メトリクスあたりのラベルの組み合わせは MAX_SERIES まで（超えた分は記録しない）
+"""
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+BLOB_NAME = "metrics.json"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# 所要時間（秒）のバケット
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+MAX_SERIES = 100
+
+PREFIX = "known_issues_"
+
+# 名前 -> (種類, 説明)
+METRICS: Dict[str, Tuple[str, str]] = {
+    "api_requests_total": (COUNTER, "Search API requests by outcome"),
+    "api_request_seconds": (HISTOGRAM, "Search API request latency"),
+    "issues_fetched_total": (COUNTER, "Issues returned by the search API"),
+    "issues_total": (GAUGE, "Issues in the latest fetch"),
+    "issues_changed": (GAUGE, "Issues changed since the previous run in the latest run"),
+    "token_refresh_total": (COUNTER, "Access token refreshes by outcome"),
+    "token_refresh_seconds": (HISTOGRAM, "Access token refresh latency"),
+    "refresh_token_expires_timestamp_seconds": (GAUGE, "Unix time of the refresh token's hard expiry"),
+    "refresh_token_expiry_seconds": (GAUGE, "Seconds until the refresh token's hard expiry, as of the scrape"),
+    "keyvault_seconds": (HISTOGRAM, "Key Vault round-trip latency"),
+    "keyvault_requests_total": (COUNTER, "Key Vault requests by operation and outcome"),
+    "blob_seconds": (HISTOGRAM, "State blob round-trip latency"),
+    "blob_requests_total": (COUNTER, "State blob requests by operation and outcome"),
+    "blob_not_modified_total": (COUNTER, "State blob reads answered from the in-process cache (304)"),
+    "blob_write_conflicts_total": (COUNTER, "Conditional state blob writes rejected by a concurrent writer"),
+    "notifications_total": (COUNTER, "Notifications by mode and outcome"),
+    "notification_seconds": (HISTOGRAM, "Notification send latency"),
+    "notified_issues_total": (COUNTER, "Issues included in sent notifications"),
+    "hedge_requests_total": (COUNTER, "Requests eligible for hedging"),
+    "hedges_total": (COUNTER, "Hedged (duplicate) requests sent"),
+    "hedge_wins_total": (COUNTER, "Hedged calls by the attempt that answered first"),
+    "hedge_saved_seconds_total": (COUNTER, "Latency saved when the hedged request won"),
+    "job_seconds": (HISTOGRAM, "Job duration"),
+    "last_success_timestamp_seconds": (GAUGE, "Unix time of the last successful job"),
+}
+
+
+# 出力時に計算するゲージ: 名前 -> 元にする Unix 時刻のゲージ（その時刻までの残り秒数）
+SECONDS_UNTIL = {
+    "refresh_token_expiry_seconds": "refresh_token_expires_timestamp_seconds",
+}
+
+
+def _key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    """
+    メトリクスの保持
+
+    series: 名前 -> {ラベル: 値}
+    値はカウンター・ゲージなら数値、ヒストグラムなら {"buckets", "sum", "count"}
+    """
+
+    def __init__(self):
+        self.series: Dict[str, Dict[Tuple, Any]] = {}
+        self._lock = threading.Lock()
+        self._dropped = set()
+
+    def _series(self, name: str, key: Tuple) -> Optional[Dict[Tuple, Any]]:
+        series = self.series.setdefault(name, {})
+        if key not in series and len(series) >= MAX_SERIES:
+            if name not in self._dropped:
+                self._dropped.add(name)
+                logging.warning(f"Metric {name} exceeded {MAX_SERIES} label sets. Dropping new ones.")
+            return None
+        return series
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = _key(labels)
+        with self._lock:
+            series = self._series(name, key)
+            if series is not None:
+                series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = _key(labels)
+        with self._lock:
+            series = self._series(name, key)
+            if series is not None:
+                series[key] = float(value)
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(labels)
+        with self._lock:
+            series = self._series(name, key)
+            if series is None:
+                return
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+                    break
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON にできる形で取り出す"""
+        with self._lock:
+            return {
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "series": {
+                    name: [
+                        {"labels": dict(key), "value": value if not isinstance(value, dict)
+                         else {**value, "buckets": list(value["buckets"])}}
+                        for key, value in series.items()
+                    ]
+                    for name, series in self.series.items()
+                },
+            }
+
+
+_registry = Registry()
+
+
+def get_registry() -> Registry:
+    return _registry
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    """カウンターを増やす"""
+    _registry.inc(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    """ゲージを設定"""
+    _registry.set(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    """ヒストグラムに観測値を加える"""
+    _registry.observe(name, value, **labels)
+
+
+@contextmanager
+def timed(name: str, counter: Optional[str] = None, **labels) -> Iterator[None]:
+    """
+    所要時間をヒストグラムに記録（counter を指定すると outcome=success|error も数える）
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+        if counter:
+            inc(counter, outcome=outcome, **labels)
+
+
+# ----------------------------------------------------------------------
+# 出力
+# ----------------------------------------------------------------------
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels.items()) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    """数値の表記（無限大・非数は Prometheus の +Inf / -Inf / NaN）"""
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if value != int(value) else str(int(value))
+
+
+def render(snapshot: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Prometheus のテキスト形式（version 0.0.4）
+
+    Args:
+        snapshot: Registry.snapshot() の結果（省略時はこのプロセスの値）
+    """
+    if snapshot is None:
+        snapshot = _registry.snapshot()
+
+    lines: List[str] = []
+    for name, entries in sorted(_with_seconds_until(snapshot["series"]).items()):
+        kind, help_text = METRICS.get(name, (GAUGE, name))
+        full_name = PREFIX + name
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        for entry in entries:
+            labels, value = entry["labels"], entry["value"]
+            if kind != HISTOGRAM:
+                lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, value["buckets"]):
+                cumulative += count
+                lines.append(f"{full_name}_bucket{_format_labels(labels, ('le', str(bound)))} {cumulative}")
+            lines.append(f"{full_name}_bucket{_format_labels(labels, ('le', '+Inf'))} {value['count']}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _with_seconds_until(series: Dict[str, Any]) -> Dict[str, Any]:
+    """SECONDS_UNTIL のゲージを現在時刻から計算して加える"""
+    now = time.time()
+    derived = {
+        name: [{"labels": entry["labels"], "value": entry["value"] - now} for entry in series[source]]
+        for name, source in SECONDS_UNTIL.items()
+        if series.get(source)
+    }
+    return {**series, **derived}
+
+
+def flush() -> bool:
+    """このプロセスの値を Blob に保存（失敗してもジョブは続行する）"""
+    from . import state_manager
+
+    try:
+        state_manager.save_json_state(BLOB_NAME, _registry.snapshot())
+        return True
+    except Exception as e:
+        logging.warning(f"Failed to flush metrics: {e}")
+        return False
+
+
+def load_flushed() -> Optional[Dict[str, Any]]:
+    """最後に Blob に保存した値（なければ None）"""
+    from . import state_manager
+
+    return state_manager.load_json_state(BLOB_NAME) or None
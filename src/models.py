@@ -0,0 +1,176 @@
+"""
+既知の問題のレコードモデル
+
+APIのレスポンス（dict）をそのまま持ち回るとアイテムごとに dict と
+長い HTML の description を保持することになるため、__slots__ で
+フィールドを固定し、値の種類が少ない文字列（製品名・状態）は intern、
+description は圧縮して保持してアクセス時に展開します。
+to_dict() は API が返したキーを同じ順序ですべて（値が None のものも）返します。
+
+既存コードとの互換のため、Issue は dict と同じ get(key, default) を提供します。
+"""
+import sys
+import zlib
+from typing import List, Dict, Any, Iterable, Optional
+from .search_index import strip_html
+
+
+# この長さ以上の description は圧縮して保持
+COMPRESS_THRESHOLD = 256
+
+# API のキー -> 属性名
+_FIELDS = {
+    "workItemId": "work_item_id",
+    "title": "title",
+    "product": "product",
+    "productId": "product_id",
+    "state": "state",
+    "changedDate": "changed_date",
+    "createdDate": "created_date",
+}
+
+# API が返したキーの並び（同じ並びのアイテムで1つのタプルを共有する）
+_KEY_ORDERS: Dict[tuple, tuple] = {}
+
+
+def _intern(value):
+    """文字列なら intern する（製品名・状態など値の種類が少ないものだけに使う）"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _key_order(keys: tuple) -> tuple:
+    """キーの並びを共有のタプルにする"""
+    return _KEY_ORDERS.setdefault(keys, keys)
+
+
+class Issue:
+    """
+    既知の問題1件
+
+    description は COMPRESS_THRESHOLD 以上なら zlib 圧縮した UTF-8 で保持し、
+    description / description_text にアクセスした時点で展開します。
+    """
+
+    __slots__ = (
+        "work_item_id",
+        "title",
+        "product",
+        "product_id",
+        "state",
+        "changed_date",
+        "created_date",
+        "_description",
+        "_extra",
+        "_keys",
+    )
+
+    def __init__(self, work_item_id=None, title=None, product=None, product_id=None,
+                 state=None, changed_date=None, created_date=None,
+                 description: Optional[str] = None, extra: Optional[Dict[str, Any]] = None):
+        self.work_item_id = work_item_id
+        self.title = title
+        self.product = _intern(product)
+        self.product_id = product_id
+        self.state = _intern(state)
+        self.changed_date = changed_date
+        self.created_date = created_date
+        self._description = self._pack(description)
+        self._extra = extra or None
+        self._keys = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Issue":
+        """APIのアイテム（dict）から作成"""
+        kwargs = {}
+        extra = {}
+        for key, value in data.items():
+            attr = _FIELDS.get(key)
+            if attr:
+                kwargs[attr] = value
+            elif key == "description":
+                kwargs["description"] = value
+            else:
+                extra[sys.intern(key)] = value
+        issue = cls(extra=extra, **kwargs)
+        issue._keys = _key_order(tuple(data))
+        return issue
+
+    def to_dict(self) -> Dict[str, Any]:
+        """APIのアイテムと同じ形の dict に戻す（from_dict で作成した場合は元のキーをすべて同じ順序で）"""
+        if self._keys is not None:
+            return {key: self._raw(key) for key in self._keys}
+
+        data = {}
+        for key, attr in _FIELDS.items():
+            value = getattr(self, attr)
+            if value is not None:
+                data[key] = value
+        if self._description is not None:
+            data["description"] = self.description
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    # ------------------------------------------------------------------
+    # description
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _pack(description: Optional[str]):
+        """長い description は圧縮した bytes にする"""
+        if description is None or len(description) < COMPRESS_THRESHOLD:
+            return description
+        return zlib.compress(description.encode("utf-8"))
+
+    @property
+    def description(self) -> str:
+        """元の description（HTML）"""
+        value = self._description
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode("utf-8")
+        return value or ""
+
+    @property
+    def description_text(self) -> str:
+        """HTMLタグを除去した description"""
+        return strip_html(self.description)
+
+    def summary(self, max_length: int) -> str:
+        """HTMLタグを除去し、指定長で切り詰めた description"""
+        text = self.description_text
+        if len(text) > max_length:
+            return text[:max_length] + "..."
+        return text
+
+    # ------------------------------------------------------------------
+    # dict 互換
+    # ------------------------------------------------------------------
+
+    def get(self, key: str, default=None):
+        """dict.get と同じ形でフィールドを取得"""
+        value = self._raw(key)
+        return default if value is None else value
+
+    def _raw(self, key: str):
+        """フィールドの値（ない場合は None）"""
+        attr = _FIELDS.get(key)
+        if attr:
+            return getattr(self, attr)
+        if key == "description":
+            return self.description if self._description is not None else None
+        if self._extra:
+            return self._extra.get(key)
+        return None
+
+    def __repr__(self) -> str:
+        return f"Issue(work_item_id={self.work_item_id!r}, title={self.title!r}, state={self.state!r})"
+
+
+def issues_from_dicts(items: Iterable[Dict[str, Any]]) -> List[Issue]:
+    """APIのアイテムリストを Issue のリストに変換"""
+    return [Issue.from_dict(item) for item in items]
+
+
+def issues_to_dicts(issues: Iterable[Issue]) -> List[Dict[str, Any]]:
+    """Issue のリストを dict のリストに戻す"""
+    return [issue.to_dict() for issue in issues]
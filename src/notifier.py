@@ -1,13 +1,22 @@
 """
-通知モジュール - メール通知（SendGrid/SMTP）とWebhook通知をサポート
+通知モジュール - メール通知（SendGrid/SMTP）、Webhook通知、Teams通知をサポート
 """
 import os
+import copy
+import json
 import logging
 import requests
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from . import codec
+from . import deadline
+from . import metrics
+from . import routing
+from .render_cache import get_render_cache, content_hash
+from .rate_limiter import TokenBucket
 
 
 # 通知方式の定数
@@ -15,6 +24,19 @@ NOTIFY_MODE_WEBHOOK = "webhook"
 NOTIFY_MODE_EMAIL = "email"
 NOTIFY_MODE_SENDGRID = "sendgrid"
 NOTIFY_MODE_ACS = "acs"  # Azure Communication Services
+NOTIFY_MODE_TEAMS = "teams"
+
+# 1リクエストのタイムアウト（秒、締め切りが近ければ残り時間まで）
+NOTIFY_TIMEOUT = 30
+# ACS の送信完了を待つ上限（秒）
+ACS_SEND_TIMEOUT = 120
+
+# Teams のメッセージサイズ上限は約 28KB（余裕を持たせた既定値）
+TEAMS_MAX_CARD_BYTES = 24 * 1024
+# Teams コネクタのレート制限（1 Webhook あたり 4 リクエスト/秒）
+TEAMS_RATE_PER_SECOND = 4.0
+TEAMS_MAX_CONCURRENCY = 4
+TEAMS_MAX_RETRIES = 3
 
 
 def get_notify_mode() -> str:
@@ -31,21 +53,43 @@ def get_email_subject(item_count: int) -> str:
     return template.format(count=item_count)
 
 
-def get_webhook_url() -> str:
-    """Webhook URL を環境変数から取得"""
-    url = os.environ.get("POWER_AUTOMATE_WEBHOOK_URL")
+def get_webhook_url(url: Optional[str] = None) -> str:
+    """Webhook URL を環境変数から取得（url を指定した場合はそちらを使う）"""
+    url = url or os.environ.get("POWER_AUTOMATE_WEBHOOK_URL")
     if not url:
         raise ValueError("POWER_AUTOMATE_WEBHOOK_URL is not set")
     return url
 
 
-def get_sendgrid_config() -> Dict[str, str]:
-    """SendGrid設定を環境変数から取得"""
+def get_webhook_content_encoding() -> str:
+    """
+    Webhook 本文の Content-Encoding（環境変数 WEBHOOK_CONTENT_ENCODING=gzip|zstd）
+
+    受信側が対応している場合のみ設定すること（既定は非圧縮）
+    """
+    return codec.resolve(os.environ.get("WEBHOOK_CONTENT_ENCODING"))
+
+
+def get_teams_config(webhook_url: Optional[str] = None) -> Dict[str, Any]:
+    """Teams Webhook 設定を環境変数から取得（webhook_url を指定した場合はそちらを使う）"""
+    url = webhook_url or os.environ.get("TEAMS_WEBHOOK_URL")
+    if not url:
+        raise ValueError("TEAMS_WEBHOOK_URL is not set")
+    return {
+        "webhook_url": url,
+        "max_card_bytes": int(os.environ.get("TEAMS_MAX_CARD_BYTES", TEAMS_MAX_CARD_BYTES)),
+        "rate_per_second": float(os.environ.get("TEAMS_RATE_PER_SECOND", TEAMS_RATE_PER_SECOND)),
+        "max_concurrency": int(os.environ.get("TEAMS_MAX_CONCURRENCY", TEAMS_MAX_CONCURRENCY)),
+    }
+
+
+def get_sendgrid_config(to_address: Optional[str] = None) -> Dict[str, str]:
+    """SendGrid設定を環境変数から取得（to_address を指定した場合は宛先を差し替え）"""
     config = {
         "api_key": os.environ.get("SENDGRID_API_KEY"),
         "from_address": os.environ.get("EMAIL_FROM"),
         "from_name": os.environ.get("EMAIL_FROM_NAME", "Power Platform Monitor"),
-        "to_address": os.environ.get("EMAIL_TO"),
+        "to_address": to_address or os.environ.get("EMAIL_TO"),
     }
     
     required = ["api_key", "from_address", "to_address"]
@@ -56,8 +100,8 @@ def get_sendgrid_config() -> Dict[str, str]:
     return config
 
 
-def get_smtp_config() -> Dict[str, str]:
-    """SMTP設定を環境変数から取得"""
+def get_smtp_config(to_address: Optional[str] = None) -> Dict[str, str]:
+    """SMTP設定を環境変数から取得（to_address を指定した場合は宛先を差し替え）"""
     config = {
         "smtp_server": os.environ.get("SMTP_SERVER", "smtp.office365.com"),
         "smtp_port": int(os.environ.get("SMTP_PORT", "587")),
@@ -65,7 +109,7 @@ def get_smtp_config() -> Dict[str, str]:
         "smtp_password": os.environ.get("SMTP_PASSWORD"),
         "from_address": os.environ.get("EMAIL_FROM"),
         "from_name": os.environ.get("EMAIL_FROM_NAME", "Power Platform Monitor"),
-        "to_address": os.environ.get("EMAIL_TO"),
+        "to_address": to_address or os.environ.get("EMAIL_TO"),
     }
     
     required = ["smtp_user", "smtp_password", "from_address", "to_address"]
@@ -76,12 +120,12 @@ def get_smtp_config() -> Dict[str, str]:
     return config
 
 
-def get_acs_config() -> Dict[str, str]:
-    """Azure Communication Services設定を環境変数から取得"""
+def get_acs_config(to_address: Optional[str] = None) -> Dict[str, str]:
+    """Azure Communication Services設定を環境変数から取得（to_address を指定した場合は宛先を差し替え）"""
     config = {
         "connection_string": os.environ.get("ACS_CONNECTION_STRING"),
         "from_address": os.environ.get("EMAIL_FROM"),
-        "to_address": os.environ.get("EMAIL_TO"),
+        "to_address": to_address or os.environ.get("EMAIL_TO"),
     }
     
     required = ["connection_string", "from_address", "to_address"]
@@ -102,23 +146,85 @@ def send_notification(new_items: List[Dict[str, Any]], total_count: int) -> bool
     
     Returns:
         成功した場合 True
+
+    config/subscriptions.json に有効な購読者がいる場合は、購読者ごとに
+    該当するアイテムだけをまとめて送信します（send_routed_notifications）。
     """
-    mode = get_notify_mode()
-    
-    if mode == NOTIFY_MODE_ACS:
-        return send_acs_notification(new_items, total_count)
-    elif mode == NOTIFY_MODE_SENDGRID:
-        return send_sendgrid_notification(new_items, total_count)
-    elif mode == NOTIFY_MODE_EMAIL:
-        return send_smtp_notification(new_items, total_count)
-    else:
-        return send_webhook_notification(new_items, total_count)
+    if routing.is_enabled():
+        return send_routed_notifications(new_items, total_count)
+    return _send(get_notify_mode(), new_items, total_count)
 
 
-def send_acs_notification(new_items: List[Dict[str, Any]], total_count: int) -> bool:
+def _send(mode: str, new_items: List[Dict[str, Any]], total_count: int, target: Optional[str] = None) -> bool:
+    """通知方式ごとに送信（target は宛先アドレスまたは Webhook URL の差し替え）"""
+    with metrics.timed("notification_seconds", mode=mode):
+        try:
+            if mode == NOTIFY_MODE_ACS:
+                sent = send_acs_notification(new_items, total_count, to_address=target)
+            elif mode == NOTIFY_MODE_SENDGRID:
+                sent = send_sendgrid_notification(new_items, total_count, to_address=target)
+            elif mode == NOTIFY_MODE_EMAIL:
+                sent = send_smtp_notification(new_items, total_count, to_address=target)
+            elif mode == NOTIFY_MODE_TEAMS:
+                sent = send_teams_notification(new_items, total_count, webhook_url=target)
+            else:
+                sent = send_webhook_notification(new_items, total_count, webhook_url=target)
+        except deadline.DeadlineExceeded as e:
+            logging.error(f"Notification ({mode}) skipped: {e}")
+            sent = False
+
+    metrics.inc("notifications_total", mode=mode, outcome="success" if sent else "failure")
+    if sent:
+        metrics.inc("notified_issues_total", len(new_items), mode=mode)
+    return sent
+
+
+def send_routed_notifications(new_items: List[Dict[str, Any]], total_count: int) -> bool:
+    """
+    購読者ごとに該当アイテムを1通にまとめて送信
+
+    購読者の mode（省略時は NOTIFY_MODE）と target / targetEnvVar（省略時は既定の宛先）で送ります。
+    該当アイテムのない購読者には送信しません。
+
+    Returns:
+        全購読者への送信が成功した場合 True
+    """
+    batches = routing.get_index().route(new_items)
+    logging.info(f"Routing {len(new_items)} items to {len(batches)} subscribers...")
+
+    failed = []
+    for index, (subscriber, items) in enumerate(batches):
+        name = subscriber.get("name") or subscriber.get("id") or "(unnamed)"
+        try:
+            deadline.check(f"notifying {name}")
+        except deadline.DeadlineExceeded as e:
+            # 締め切りを過ぎたら残りの購読者には送らない
+            skipped = len(batches) - index
+            logging.error(f"{e}. Skipping the remaining {skipped} subscribers.")
+            failed.extend(s.get("name") or s.get("id") or "(unnamed)" for s, _ in batches[index:])
+            break
+        target = subscriber.get("target")
+        if not target and subscriber.get("targetEnvVar"):
+            target = os.environ.get(subscriber["targetEnvVar"])
+            if not target:
+                logging.warning(f"Subscriber {name}: {subscriber['targetEnvVar']} is not set")
+                failed.append(name)
+                continue
+
+        mode = (subscriber.get("mode") or get_notify_mode()).lower()
+        if not _send(mode, items, total_count, target):
+            failed.append(name)
+
+    if failed:
+        logging.error(f"Routed notification failed for {len(failed)}/{len(batches)} subscribers: {', '.join(failed)}")
+        return False
+    return True
+
+
+def send_acs_notification(new_items: List[Dict[str, Any]], total_count: int, to_address: Optional[str] = None) -> bool:
     """Azure Communication Services でメール送信"""
     try:
-        config = get_acs_config()
+        config = get_acs_config(to_address)
     except ValueError as e:
         logging.warning(f"ACS notification skipped: {e}")
         return False
@@ -146,6 +252,10 @@ def send_acs_notification(new_items: List[Dict[str, Any]], total_count: int) ->
         }
         
         poller = client.begin_send(message)
+        poller.wait(deadline.timeout(ACS_SEND_TIMEOUT, "ACS email"))
+        if not poller.done():
+            logging.error("ACS email notification did not complete before the timeout")
+            return False
         result = poller.result()
         
         logging.info(f"ACS email sent successfully. Message ID: {result['id']}")
@@ -156,10 +266,10 @@ def send_acs_notification(new_items: List[Dict[str, Any]], total_count: int) ->
         return False
 
 
-def send_sendgrid_notification(new_items: List[Dict[str, Any]], total_count: int) -> bool:
+def send_sendgrid_notification(new_items: List[Dict[str, Any]], total_count: int, to_address: Optional[str] = None) -> bool:
     """SendGrid API でメール送信"""
     try:
-        config = get_sendgrid_config()
+        config = get_sendgrid_config(to_address)
     except ValueError as e:
         logging.warning(f"SendGrid notification skipped: {e}")
         return False
@@ -195,7 +305,7 @@ def send_sendgrid_notification(new_items: List[Dict[str, Any]], total_count: int
                 "Authorization": f"Bearer {config['api_key']}",
                 "Content-Type": "application/json"
             },
-            timeout=30
+            timeout=deadline.timeout(NOTIFY_TIMEOUT, "notification")
         )
         
         # SendGridは成功時に202を返す
@@ -211,10 +321,10 @@ def send_sendgrid_notification(new_items: List[Dict[str, Any]], total_count: int
         return False
 
 
-def send_webhook_notification(new_items: List[Dict[str, Any]], total_count: int) -> bool:
+def send_webhook_notification(new_items: List[Dict[str, Any]], total_count: int, webhook_url: Optional[str] = None) -> bool:
     """Power Automate Webhook に通知を送信"""
     try:
-        webhook_url = get_webhook_url()
+        webhook_url = get_webhook_url(webhook_url)
     except ValueError as e:
         logging.warning(f"Webhook notification skipped: {e}")
         return False
@@ -223,27 +333,29 @@ def send_webhook_notification(new_items: List[Dict[str, Any]], total_count: int)
     payload = {
         "total_count": total_count,
         "new_count": len(new_items),
-        "items": [
-            {
-                "workItemId": item.get("workItemId", ""),
-                "title": item.get("title", ""),
-                "product": item.get("product", ""),
-                "state": item.get("state", ""),
-                "changedDate": item.get("changedDate", ""),
-                "description": _truncate(item.get("description", ""), 500)
-            }
-            for item in new_items
-        ]
+        "items": [_render_item_json(item) for item in new_items]
     }
     
     logging.info(f"Sending webhook notification for {len(new_items)} items...")
     
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json; charset=utf-8"}
+    
+    # 受信側が対応していれば圧縮して送る（辞書は受信側が持たないので使わない）
+    encoding = get_webhook_content_encoding()
+    if encoding != codec.CODEC_NONE:
+        compressed = codec.encode(body, encoding, use_dictionary=False)
+        if compressed is not body:
+            logging.info(f"Webhook payload compressed ({encoding}): {len(body)} -> {len(compressed)} bytes")
+            body = compressed
+            headers["Content-Encoding"] = encoding
+    
     try:
         response = requests.post(
             webhook_url,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=30
+            data=body,
+            headers=headers,
+            timeout=deadline.timeout(NOTIFY_TIMEOUT, "notification")
         )
         
         if response.status_code in [200, 202]:
@@ -258,10 +370,193 @@ def send_webhook_notification(new_items: List[Dict[str, Any]], total_count: int)
         return False
 
 
-def send_smtp_notification(new_items: List[Dict[str, Any]], total_count: int) -> bool:
+def send_teams_notification(new_items: List[Dict[str, Any]], total_count: int, webhook_url: Optional[str] = None) -> bool:
+    """
+    Teams の Incoming Webhook に Adaptive Card で通知
+
+    カードのサイズ上限に収まるだけのアイテムを1枚にまとめ、
+    トークンバケットでレート制限に合わせながら並列に送信します。
+    """
+    try:
+        config = get_teams_config(webhook_url)
+    except ValueError as e:
+        logging.warning(f"Teams notification skipped: {e}")
+        return False
+
+    cards = _pack_teams_cards(new_items, total_count, config["max_card_bytes"])
+    logging.info(f"Sending Teams notification for {len(new_items)} items in {len(cards)} cards...")
+
+    bucket = TokenBucket(rate=config["rate_per_second"], capacity=config["rate_per_second"])
+    workers = max(1, min(config["max_concurrency"], len(cards)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            deadline.bind(lambda card: _post_teams_card(config["webhook_url"], card, bucket)),
+            cards
+        ))
+
+    sent = sum(results)
+    if sent == len(cards):
+        logging.info(f"Teams notification sent successfully. Cards: {sent}")
+        return True
+    logging.error(f"Teams notification partially failed. Sent {sent}/{len(cards)} cards")
+    return False
+
+
+def _post_teams_card(webhook_url: str, card: Dict[str, Any], bucket: TokenBucket) -> bool:
+    """カード1枚を送信（429 の場合は Retry-After に従って再試行）"""
+    message = {
+        "type": "message",
+        "attachments": [{
+            "contentType": "application/vnd.microsoft.card.adaptive",
+            "contentUrl": None,
+            "content": card
+        }]
+    }
+    body = json.dumps(message, ensure_ascii=False).encode("utf-8")
+
+    for attempt in range(TEAMS_MAX_RETRIES + 1):
+        bucket.acquire()
+        try:
+            response = requests.post(
+                webhook_url,
+                data=body,
+                headers={"Content-Type": "application/json"},
+                timeout=deadline.timeout(NOTIFY_TIMEOUT, "notification")
+            )
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Teams notification request failed: {e}")
+            return False
+
+        if response.status_code in [200, 202]:
+            return True
+        if response.status_code == 429 and attempt < TEAMS_MAX_RETRIES:
+            retry_after = float(response.headers.get("Retry-After", 2 ** attempt))
+            logging.warning(f"Teams rate limited. Retrying after {retry_after}s")
+            # バケットを空にして補充を遅らせる（次の acquire() が retry_after だけ待つ。全ワーカー共通）
+            bucket.pause(retry_after)
+            continue
+
+        logging.error(f"Teams notification failed. Status: {response.status_code}, Response: {response.text[:200]}")
+        return False
+    return False
+
+
+def _teams_card(body: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Adaptive Card を作成"""
+    return {
+        "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
+        "type": "AdaptiveCard",
+        "version": "1.4",
+        "msteams": {"width": "Full"},
+        "body": body
+    }
+
+
+def _teams_header(total_count: int, item_count: int, page: int, pages: int) -> List[Dict[str, Any]]:
+    """カードの見出し部分"""
+    title = "Power Platform Known Issues 更新通知"
+    if pages > 1:
+        title += f" ({page}/{pages})"
+    return [
+        {"type": "TextBlock", "text": title, "weight": "Bolder", "size": "Medium", "color": "Accent", "wrap": True},
+        {"type": "TextBlock", "text": f"全件数: {total_count}件 | 更新件数: {item_count}件", "wrap": True, "spacing": "None"},
+    ]
+
+
+def _render_item_teams(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Adaptive Card のアイテム部分（キャッシュ付き。FactSet の値は文字列にそろえる）"""
+    item_hash = content_hash(item)
+    return get_render_cache().get_or_render(item, "teams:2", lambda item: {
+        "type": "Container",
+        "separator": True,
+        "spacing": "Medium",
+        "items": [
+            {"type": "TextBlock", "text": str(item.get("title") or "No Title"), "weight": "Bolder", "wrap": True},
+            {"type": "FactSet", "facts": [
+                {"title": "Work Item ID", "value": str(item.get("workItemId") or "")},
+                {"title": "製品", "value": str(item.get("product") or "")},
+                {"title": "状態", "value": str(item.get("state") or "")},
+                {"title": "更新日時", "value": str(item.get("changedDate") or "")},
+            ]},
+            {"type": "TextBlock", "text": _summary(item, 300, item_hash), "wrap": True, "size": "Small", "isSubtle": True},
+        ]
+    }, item_hash)
+
+
+def _clip_utf8(text: str, max_bytes: int) -> str:
+    """UTF-8 で max_bytes 以内に切り詰め（切り詰めた場合は末尾に ...）"""
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max(0, max_bytes - 3)].decode("utf-8", errors="ignore") + "..."
+
+
+def _fit_teams_item(element: Dict[str, Any], excess: int) -> Dict[str, Any]:
+    """
+    1件だけで上限を超えるアイテムを excess バイト分縮める
+
+    概要、足りなければタイトルの順に切り詰めます（キャッシュした要素は変更しない）。
+    """
+    element = copy.deepcopy(element)
+    for block in (element["items"][2], element["items"][0]):
+        if excess <= 0:
+            break
+        # JSON のエスケープ分を見込んでエンコード後のサイズで比べる
+        text = block["text"]
+        size = len(json.dumps(text, ensure_ascii=False).encode("utf-8"))
+        block["text"] = _clip_utf8(text, max(0, len(text.encode("utf-8")) - excess))
+        excess -= size - len(json.dumps(block["text"], ensure_ascii=False).encode("utf-8"))
+    return element
+
+
+def _pack_teams_cards(items: List[Dict[str, Any]], total_count: int, max_bytes: int) -> List[Dict[str, Any]]:
+    """
+    アイテムをサイズ上限に収まるようにカードへ詰める
+
+    見出し（ページ番号を含む）の分を見込んでからアイテムを順に追加し、
+    上限を超える手前で次のカードに移ります。
+    """
+    if not items:
+        return [_teams_card(_teams_header(total_count, 0, 1, 1) + [
+            {"type": "TextBlock", "text": "✅ 本日の更新はありませんでした", "color": "Good", "wrap": True}
+        ])]
+
+    def _size(obj) -> int:
+        return len(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+    # 見出しはページ番号が最大桁になった場合でも収まるように見積もる
+    overhead = _size({"type": "message", "attachments": [{
+        "contentType": "application/vnd.microsoft.card.adaptive",
+        "contentUrl": None,
+        "content": _teams_card(_teams_header(total_count, len(items), len(items), len(items)))
+    }]})
+
+    pages: List[List[Dict[str, Any]]] = [[]]
+    used = overhead
+    for item in items:
+        element = _render_item_teams(item)
+        size = _size(element) + 2  # 区切りの ", "
+        if overhead + size > max_bytes:
+            element = _fit_teams_item(element, overhead + size - max_bytes)
+            size = _size(element) + 2
+            logging.warning(f"Teams card item {item.get('workItemId')} exceeded the size limit and was truncated.")
+        if pages[-1] and used + size > max_bytes:
+            pages.append([])
+            used = overhead
+        pages[-1].append(element)
+        used += size
+
+    return [
+        _teams_card(_teams_header(total_count, len(items), i + 1, len(pages)) + elements)
+        for i, elements in enumerate(pages)
+    ]
+
+
+def send_smtp_notification(new_items: List[Dict[str, Any]], total_count: int, to_address: Optional[str] = None) -> bool:
     """SMTPでメール送信"""
     try:
-        config = get_smtp_config()
+        config = get_smtp_config(to_address)
     except ValueError as e:
         logging.warning(f"SMTP notification skipped: {e}")
         return False
@@ -282,7 +577,8 @@ def send_smtp_notification(new_items: List[Dict[str, Any]], total_count: int) ->
         msg.attach(text_part)
         msg.attach(html_part)
         
-        with smtplib.SMTP(config["smtp_server"], config["smtp_port"]) as server:
+        timeout = deadline.timeout(NOTIFY_TIMEOUT, "SMTP")
+        with smtplib.SMTP(config["smtp_server"], config["smtp_port"], timeout=timeout) as server:
             server.starttls()
             server.login(config["smtp_user"], config["smtp_password"])
             server.send_message(msg)
@@ -313,16 +609,7 @@ def _create_email_body(items: List[Dict[str, Any]], total_count: int) -> Dict[st
     
     if items:
         for item in items:
-            text_lines.extend([
-                f"",
-                f"■ {item.get('title', 'No Title')}",
-                f"  Work Item ID: {item.get('workItemId', '')}",
-                f"  製品: {item.get('product', '')}",
-                f"  状態: {item.get('state', '')}",
-                f"  更新日時: {item.get('changedDate', '')}",
-                f"  概要: {_truncate(item.get('description', ''), 200)}",
-                "",
-            ])
+            text_lines.extend(_render_item_text(item))
     else:
         text_lines.extend([
             f"",
@@ -333,19 +620,7 @@ def _create_email_body(items: List[Dict[str, Any]], total_count: int) -> Dict[st
     # HTML版
     html_items = ""
     if items:
-        for item in items:
-            html_items += f"""
-            <div style="margin-bottom: 20px; padding: 15px; border: 1px solid #ddd; border-radius: 5px;">
-                <h3 style="margin: 0 0 10px 0; color: #0078d4;">{item.get('title', 'No Title')}</h3>
-                <table style="font-size: 14px;">
-                    <tr><td style="padding: 2px 10px 2px 0; color: #666;">Work Item ID:</td><td>{item.get('workItemId', '')}</td></tr>
-                    <tr><td style="padding: 2px 10px 2px 0; color: #666;">製品:</td><td>{item.get('product', '')}</td></tr>
-                    <tr><td style="padding: 2px 10px 2px 0; color: #666;">状態:</td><td>{item.get('state', '')}</td></tr>
-                    <tr><td style="padding: 2px 10px 2px 0; color: #666;">更新日時:</td><td>{item.get('changedDate', '')}</td></tr>
-                </table>
-                <p style="margin: 10px 0 0 0; font-size: 13px; color: #333;">{_truncate(item.get('description', ''), 300)}</p>
-            </div>
-            """
+        html_items = "".join(_render_item_html(item) for item in items)
     else:
         html_items = """
         <div style="padding: 30px; text-align: center; background-color: #f8f9fa; border-radius: 5px;">
@@ -382,6 +657,60 @@ def _create_email_body(items: List[Dict[str, Any]], total_count: int) -> Dict[st
     }
 
 
+def _render_item_json(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Webhook ペイロードのアイテム（キャッシュ付き）"""
+    item_hash = content_hash(item)
+    return get_render_cache().get_or_render(item, "json", lambda item: {
+        "workItemId": item.get("workItemId", ""),
+        "title": item.get("title", ""),
+        "product": item.get("product", ""),
+        "state": item.get("state", ""),
+        "changedDate": item.get("changedDate", ""),
+        "description": _summary(item, 500, item_hash)
+    }, item_hash)
+
+
+def _render_item_text(item: Dict[str, Any]) -> List[str]:
+    """メール本文（テキスト）のアイテム部分（キャッシュ付き）"""
+    item_hash = content_hash(item)
+    return get_render_cache().get_or_render(item, "text", lambda item: [
+        f"",
+        f"■ {item.get('title', 'No Title')}",
+        f"  Work Item ID: {item.get('workItemId', '')}",
+        f"  製品: {item.get('product', '')}",
+        f"  状態: {item.get('state', '')}",
+        f"  更新日時: {item.get('changedDate', '')}",
+        f"  概要: {_summary(item, 200, item_hash)}",
+        "",
+    ], item_hash)
+
+
+def _render_item_html(item: Dict[str, Any]) -> str:
+    """メール本文（HTML）のアイテム部分（キャッシュ付き）"""
+    item_hash = content_hash(item)
+    return get_render_cache().get_or_render(item, "html", lambda item: f"""
+            <div style="margin-bottom: 20px; padding: 15px; border: 1px solid #ddd; border-radius: 5px;">
+                <h3 style="margin: 0 0 10px 0; color: #0078d4;">{item.get('title', 'No Title')}</h3>
+                <table style="font-size: 14px;">
+                    <tr><td style="padding: 2px 10px 2px 0; color: #666;">Work Item ID:</td><td>{item.get('workItemId', '')}</td></tr>
+                    <tr><td style="padding: 2px 10px 2px 0; color: #666;">製品:</td><td>{item.get('product', '')}</td></tr>
+                    <tr><td style="padding: 2px 10px 2px 0; color: #666;">状態:</td><td>{item.get('state', '')}</td></tr>
+                    <tr><td style="padding: 2px 10px 2px 0; color: #666;">更新日時:</td><td>{item.get('changedDate', '')}</td></tr>
+                </table>
+                <p style="margin: 10px 0 0 0; font-size: 13px; color: #333;">{_summary(item, 300, item_hash)}</p>
+            </div>
+            """, item_hash)
+
+
+def _summary(item: Dict[str, Any], max_length: int, item_hash: str = None) -> str:
+    """HTMLタグを除去して切り詰めた description（キャッシュ付き）"""
+    return get_render_cache().get_or_render(
+        item, f"summary:{max_length}",
+        lambda item: _truncate(item.get("description", ""), max_length),
+        item_hash
+    )
+
+
 def _truncate(text: str, max_length: int) -> str:
     """テキストを指定長で切り詰め"""
     if not text:
@@ -0,0 +1,423 @@
+"""
+キュー連携のパイプライン（取得 → 差分 → 通知）
+
+run_job の処理を Azure Storage Queue で繋いだ3つのステージに分けます。
+各ステージは別々の関数として実行され、失敗した場合はそのステージだけが
+キューの再配信で再試行されます（maxDequeueCount を超えると <キュー名>-poison へ）。
+
+- 取得: 既知の問題を取得し、実行ごとのスナップショットを保存して差分キューへ
+- 差分: 前回のスナップショットと比較して変更イベントを作成し、通知キューへ
+        （既定は1実行1通。PIPELINE_NOTIFY_BATCH_SIZE を設定すると、その件数ずつの
+        バッチに分けて複数ワーカーで並列に通知し、通知もバッチごとに1通になる）
+- 通知: 変更イベントのバッチを受け取って通知を送信
+
+取得・差分ステージは run_job と同じロック（run-job.lock）を使うため、パイプラインと
+run_job（manual_trigger など）が同時に取得・差分を行うことはありません。
+ロックを取得できなかったメッセージは PIPELINE_RETRY_DELAY_SECONDS 秒後に見えるように
+送り直します（再配信の回数・poison キューには数えない）。
+
+キューメッセージは 64KB までのため、スナップショットや変更イベントの本体は Blob に置き、
+メッセージには Blob 名だけを載せます。
+"""
+import os
+import json
+import uuid
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+from . import aggregates
+from . import api_client
+from . import change_feed
+from . import coordination
+from . import deadline
+from . import diff
+from . import notifier
+from . import render_cache
+from . import state_manager
+from . import sweep
+
+
+# キュー名（function_app.py の queue_trigger と合わせる）
+FETCH_QUEUE = "known-issues-fetch"
+DIFF_QUEUE = "known-issues-diff"
+NOTIFY_QUEUE = "known-issues-notify"
+
+STATE_BLOB_NAME = "pipeline-state.json"
+BLOB_PREFIX = "pipeline/"
+
+# ステージごとの同時実行数の既定値（インスタンス内）
+DEFAULT_CONCURRENCY = {"fetch": 1, "diff": 1, "notify": 4}
+
+# ロックを取得できずに送り直す回数の上限
+MAX_REQUEUES = 20
+
+
+def is_enabled() -> bool:
+    """キュー連携のパイプラインを使うか（環境変数 QUEUE_PIPELINE）"""
+    return os.environ.get("QUEUE_PIPELINE", "false").lower() in ("1", "true", "yes")
+
+
+def get_notify_batch_size() -> int:
+    """通知メッセージ1件あたりの変更イベント数（0 なら分けずに1実行1通）"""
+    return max(0, int(os.environ.get("PIPELINE_NOTIFY_BATCH_SIZE", "0")))
+
+
+def get_retry_delay() -> int:
+    """ロックを取得できなかったメッセージを送り直すときの遅延（秒）"""
+    return int(os.environ.get("PIPELINE_RETRY_DELAY_SECONDS", "60"))
+
+
+def get_concurrency(stage: str) -> int:
+    """ステージのインスタンス内同時実行数（PIPELINE_<STAGE>_CONCURRENCY）"""
+    value = os.environ.get(f"PIPELINE_{stage.upper()}_CONCURRENCY")
+    return max(1, int(value)) if value else DEFAULT_CONCURRENCY[stage]
+
+
+_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_semaphores_lock = threading.Lock()
+
+
+def _stage_semaphore(stage: str) -> threading.BoundedSemaphore:
+    """ステージごとの同時実行数を制限するセマフォ"""
+    with _semaphores_lock:
+        if stage not in _semaphores:
+            _semaphores[stage] = threading.BoundedSemaphore(get_concurrency(stage))
+        return _semaphores[stage]
+
+
+# ----------------------------------------------------------------------
+# キュー
+# ----------------------------------------------------------------------
+
+# 接続文字列とキュー名 -> キュークライアント（作成済みのキュー）
+_queue_clients: Dict[tuple, QueueClient] = {}
+_queue_clients_lock = threading.Lock()
+
+
+def get_queue_client(queue_name: str) -> QueueClient:
+    """
+    キュークライアントを取得
+
+    Functions の queue_trigger は既定で Base64 のメッセージを受け取るため、
+    Base64 でエンコードして送信します。
+    クライアントはキューごとに使い回し、キューの作成はプロセスで初回のみ行います。
+    """
+    connection_string = os.environ.get("AzureWebJobsStorage")
+    if not connection_string:
+        raise ValueError("AzureWebJobsStorage is not set")
+
+    key = (connection_string, queue_name)
+    with _queue_clients_lock:
+        queue_client = _queue_clients.get(key)
+        if queue_client is None:
+            queue_client = QueueClient.from_connection_string(
+                connection_string,
+                queue_name,
+                message_encode_policy=TextBase64EncodePolicy()
+            )
+
+            # キューがなければ作成
+            try:
+                queue_client.create_queue()
+                logging.info(f"Created queue: {queue_name}")
+            except ResourceExistsError:
+                pass
+            _queue_clients[key] = queue_client
+
+    return queue_client
+
+
+def send_message(queue_name: str, payload: Dict[str, Any], delay: Optional[int] = None):
+    """JSON メッセージを送信（delay 秒後に見えるようにする）"""
+    get_queue_client(queue_name).send_message(
+        json.dumps(payload, ensure_ascii=False),
+        visibility_timeout=delay
+    )
+
+
+def requeue(queue_name: str, message: Dict[str, Any]) -> bool:
+    """
+    ロックを取得できなかったメッセージを遅延付きで送り直す
+
+    Returns:
+        送り直したら True（上限回数を超えて破棄した場合は False）
+    """
+    requeues = message.get("requeues", 0) + 1
+    if requeues > MAX_REQUEUES:
+        logging.error(f"Dropping {message.get('run_id')} after {MAX_REQUEUES} requeues on {queue_name}.")
+        return False
+    delay = get_retry_delay()
+    send_message(queue_name, {**message, "requeues": requeues}, delay=delay)
+    logging.info(f"Requeued {message.get('run_id')} on {queue_name} in {delay}s (attempt {requeues}).")
+    return True
+
+
+def enqueue_fetch(reason: str = "timer") -> str:
+    """
+    取得ステージを起動するメッセージを送信
+
+    Returns:
+        実行 ID
+    """
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + "-" + uuid.uuid4().hex[:8]
+    send_message(FETCH_QUEUE, {"run_id": run_id, "reason": reason})
+    logging.info(f"Enqueued fetch stage: {run_id} ({reason})")
+    return run_id
+
+
+# ----------------------------------------------------------------------
+# 取得ステージ
+# ----------------------------------------------------------------------
+
+def run_fetch_stage(message: Dict[str, Any], get_token: Callable[[], str]) -> Optional[Dict[str, Any]]:
+    """
+    既知の問題を取得してスナップショットを保存し、差分ステージへ渡す
+
+    トークンはロックを取得できた場合だけ get_token() で取得します
+    （送り直すだけのメッセージでトークンを更新しないため）。
+
+    Args:
+        message: 取得キューのメッセージ（run_id）
+        get_token: アクセストークンを返す関数
+
+    Returns:
+        差分キューに送ったメッセージ（run_job などが実行中で送り直した場合は None）
+    """
+    run_id = message["run_id"]
+    with _stage_semaphore("fetch"):
+        lease = state_manager.try_acquire_lock()
+        if lease is None:
+            logging.info(f"Another run holds the run lock. Requeueing fetch {run_id}.")
+            requeue(FETCH_QUEUE, message)
+            return None
+
+        with coordination.hold_lease(lease):
+            token = get_token()
+            localized = None
+            if sweep.is_sweep_configured():
+                result = sweep.run_sweep(token)
+                items, localized, complete = result["issues"], result["localized"], result["complete"]
+            else:
+                items = api_client.get_known_issues(token)
+                complete = isinstance(items, list) and api_client.is_complete(len(items))
+            if not isinstance(items, list):
+                items = []
+
+            diff_message = publish_snapshot(run_id, items, localized, complete)
+
+    logging.info(f"Fetch stage completed: {run_id}, {len(items)} issues")
+    return diff_message
+
+
+def publish_snapshot(run_id: str, items: List[Dict[str, Any]], localized: Optional[dict] = None,
+                     complete: bool = False) -> Dict[str, Any]:
+    """
+    実行ごとのスナップショットを保存して差分キューへ送る
+
+    Args:
+        run_id: 実行 ID
+        items: 取得したアイテム
+        localized: ロケールごとのテキスト
+        complete: 全件を取得できたか（集計で取得結果から消えた問題を解決済みにする）
+
+    Returns:
+        差分キューに送ったメッセージ
+    """
+    retrieved_at = datetime.now(timezone.utc)
+    snapshot_blob = f"{BLOB_PREFIX}{run_id}/snapshot.json"
+    state_manager.save_snapshot(items, retrieved_at, localized, blob_name=snapshot_blob)
+
+    # 最新スナップショット（issues ルートから参照）も更新
+    try:
+        state_manager.save_snapshot(items, retrieved_at, localized)
+    except Exception as e:
+        logging.warning(f"Snapshot not saved: {e}")
+
+    diff_message = {
+        "run_id": run_id,
+        "snapshot": snapshot_blob,
+        "retrieved_at": retrieved_at.isoformat(),
+        "total_count": len(items),
+        "complete": complete,
+    }
+    send_message(DIFF_QUEUE, diff_message)
+    return diff_message
+
+
+# ----------------------------------------------------------------------
+# 差分ステージ
+# ----------------------------------------------------------------------
+
+def _batches(events: List[Dict[str, Any]], size: int) -> List[List[Dict[str, Any]]]:
+    """
+    size 件ずつに分割（size が 0 なら分けない）
+
+    0件でも空のバッチを1つ返す（0件でも通知するため）
+    """
+    if size <= 0:
+        return [events]
+    return [events[i:i + size] for i in range(0, len(events), size)] or [[]]
+
+
+def run_diff_stage(message: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    前回のスナップショットと比較して変更イベントを作成し、通知ステージへ渡す
+
+    実行の順序を保つため、インスタンス間で1つずつ処理します。
+    古い実行のメッセージが後から届いた場合は何もしません。
+
+    Args:
+        message: 差分キューのメッセージ（run_id, snapshot, retrieved_at, total_count）
+
+    Returns:
+        通知キューに送ったメッセージ（run_job などが実行中で送り直した場合は空）
+    """
+    run_id = message["run_id"]
+    with _stage_semaphore("diff"):
+        lease = state_manager.try_acquire_lock()
+        if lease is None:
+            logging.info(f"Another run holds the run lock. Requeueing diff {run_id}.")
+            requeue(DIFF_QUEUE, message)
+            return []
+
+        with coordination.hold_lease(lease):
+            state = state_manager.load_json_state(STATE_BLOB_NAME)
+            if state.get("last_run_id") == run_id:
+                pending = state.get("pending_notify") or []
+                if not pending:
+                    logging.info(f"Diff stage already processed {run_id}. Skipping.")
+                    return []
+                # 状態の保存後に送信が中断した場合は、未送信のメッセージだけを送る
+                logging.info(f"Resending {len(pending)} pending notify messages for {run_id}.")
+                _send_notify_messages(run_id, pending)
+                return pending
+            if state.get("retrieved_at") and state["retrieved_at"] > message["retrieved_at"]:
+                logging.info(f"Skipping stale run {run_id} (latest: {state.get('last_run_id')})")
+                if message["snapshot"] != state.get("snapshot"):
+                    _delete_blob(message["snapshot"])
+                return []
+
+            current, _ = state_manager.load_snapshot(message["snapshot"])
+            if current is None:
+                raise RuntimeError(f"Snapshot not found: {message['snapshot']}")
+
+            previous = None
+            if state.get("snapshot"):
+                previous_snapshot, _ = state_manager.load_snapshot(state["snapshot"])
+                previous = previous_snapshot.get("issues", []) if previous_snapshot else None
+
+            last_run = state_manager.get_last_run_time()
+            all_events = diff.compute_changes(previous, current.get("issues", []), last_run)
+            try:
+                change_feed.append(all_events)
+            except Exception as e:
+                logging.warning(f"Failed to append change feed: {e}")
+
+            events = [event for event in all_events if event["type"] != diff.EVENT_REMOVED]
+            logging.info(f"Found {len(events)} new/updated issues in {run_id}.")
+            if deadline.allows_optional("aggregates"):
+                current_ids = None
+                if message.get("complete"):
+                    current_ids = {str(item.get("workItemId")) for item in current.get("issues", [])}
+                aggregates.update((event["item"] for event in events), current_ids)
+
+            batches = _batches(events, get_notify_batch_size())
+            notify_messages = []
+            for index, batch in enumerate(batches):
+                batch_blob = f"{BLOB_PREFIX}{run_id}/notify-{index:04d}.json"
+                state_manager.save_json_state(batch_blob, {
+                    "run_id": run_id,
+                    "total_count": message.get("total_count", 0),
+                    "events": batch,
+                })
+                notify_messages.append({
+                    "run_id": run_id,
+                    "batch": index,
+                    "batches": len(batches),
+                    "blob": batch_blob,
+                })
+
+            # 通知を送る前に次回の比較基準と未送信のメッセージを保存する
+            # （再試行で変更イベントを作り直して同じ通知を送らないため）
+            state_manager.save_last_run_time()
+            state_manager.update_json_state(STATE_BLOB_NAME, lambda latest: None if (
+                latest.get("retrieved_at") and latest["retrieved_at"] > message["retrieved_at"]
+            ) else {
+                "last_run_id": run_id,
+                "snapshot": message["snapshot"],
+                "retrieved_at": message["retrieved_at"],
+                "pending_notify": notify_messages,
+            })
+
+            # 不要になった前回のスナップショットを削除
+            if state.get("snapshot") and state["snapshot"] != message["snapshot"]:
+                _delete_blob(state["snapshot"])
+
+            _send_notify_messages(run_id, notify_messages)
+
+    return notify_messages
+
+
+def _send_notify_messages(run_id: str, notify_messages: List[Dict[str, Any]]) -> None:
+    """通知キューへ送り、送ったメッセージを状態の未送信リストから外す"""
+    for notify_message in notify_messages:
+        send_message(NOTIFY_QUEUE, notify_message)
+
+        def _mark_sent(latest, blob=notify_message["blob"]):
+            pending = latest.get("pending_notify")
+            if latest.get("last_run_id") != run_id or not pending:
+                return None
+            latest["pending_notify"] = [item for item in pending if item["blob"] != blob]
+            return latest
+
+        state_manager.update_json_state(STATE_BLOB_NAME, _mark_sent)
+
+
+# ----------------------------------------------------------------------
+# 通知ステージ
+# ----------------------------------------------------------------------
+
+def run_notify_stage(message: Dict[str, Any]) -> bool:
+    """
+    変更イベントのバッチを通知
+
+    Args:
+        message: 通知キューのメッセージ（run_id, batch, batches, blob）
+
+    Returns:
+        送信に成功したか
+
+    Raises:
+        RuntimeError: 送信に失敗した（メッセージは再配信される）
+    """
+    with _stage_semaphore("notify"):
+        data = state_manager.load_json_state(message["blob"])
+        if not data:
+            # 送信済みで削除された（再配信による重複）
+            logging.info(f"Notify batch already handled: {message['blob']}")
+            return True
+
+        items = [event["item"] for event in data.get("events", [])]
+        logging.info(
+            f"Notifying batch {message['batch'] + 1}/{message['batches']} of {message['run_id']}: "
+            f"{[item.get('workItemId') for item in items]}"
+        )
+
+        if not notifier.send_notification(items, data.get("total_count", 0)):
+            raise RuntimeError(f"Notification failed for {message['blob']}")
+
+        if deadline.allows_optional("render cache persistence"):
+            render_cache.persist()
+        _delete_blob(message["blob"])
+    return True
+
+
+def _delete_blob(blob_name: str):
+    """Blob を削除（失敗しても処理は続ける）"""
+    try:
+        state_manager.get_blob_client(blob_name).delete_blob()
+    except Exception as e:
+        logging.warning(f"Failed to delete {blob_name}: {e}")
@@ -0,0 +1,146 @@
+"""
+オンデマンドのプロファイリング
+
+manual_trigger から明示的に要求された場合のみ、処理を cProfile と
+tracemalloc で計測し、ホットスポットとメモリ割り当て箇所の上位を返します。
+要求されていない場合はこのモジュールの処理は一切通りません。
+
+cProfile はプロセス内で同時に1つしか有効にできないため、計測は1件ずつ行います。
+tracemalloc の値（ピーク・割り当て上位）はプロセス全体のもので、計測中に
+並行して動いた他の関数呼び出しの割り当ても含みます。
+"""
+import io
+import os
+import time
+import pstats
+import logging
+import marshal
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+from . import state_manager
+
+
+# 出力先
+OUTPUT_INLINE = "inline"
+OUTPUT_BLOB = "blob"
+
+DEFAULT_TOP_N = 25
+PROFILE_BLOB_PREFIX = "profiles/"
+
+# 計測中（cProfile は同時に1つしか有効にできない）
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    """他の要求を計測中"""
+
+
+def get_profile_mode(param: Optional[str]) -> Optional[str]:
+    """
+    プロファイリングの出力先を決める
+
+    クエリパラメータ profile=inline|blob、または環境変数 ENABLE_PROFILING=inline|blob。
+    どちらもなければ None（プロファイリングしない）
+    """
+    value = (param or os.environ.get("ENABLE_PROFILING") or "").lower()
+    if value in ("1", "true", "yes", OUTPUT_INLINE):
+        return OUTPUT_INLINE
+    if value == OUTPUT_BLOB:
+        return OUTPUT_BLOB
+    return None
+
+
+def profile_call(fn: Callable[[], Any], mode: str, top_n: int = DEFAULT_TOP_N) -> Tuple[Any, Dict[str, Any]]:
+    """
+    fn を cProfile と tracemalloc で計測して実行
+
+    peak_memory_bytes と allocations はプロセス全体の値です（並行する他の処理の分を含む）。
+
+    Args:
+        fn: 計測する処理
+        mode: OUTPUT_INLINE（結果に含める）または OUTPUT_BLOB（.prof と統計を Blob に保存）
+        top_n: 出力する上位件数
+
+    Returns:
+        (fn の戻り値, プロファイル結果)
+
+    Raises:
+        ProfilerBusyError: 他の要求を計測中（fn は実行しない）
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("Another profiled run is in progress")
+    try:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            result = profiler.runcall(fn)
+        finally:
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+    finally:
+        _profile_lock.release()
+
+    stats_text = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stats_text)
+    stats.sort_stats("cumulative").print_stats(top_n)
+
+    report = {
+        "elapsed_seconds": round(elapsed, 3),
+        "peak_memory_bytes": peak,
+        "hotspots": _hotspots(stats, top_n),
+        "allocations": [
+            {
+                "location": str(stat.traceback[0]) if stat.traceback else "",
+                "size_bytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:top_n]
+        ],
+    }
+
+    if mode == OUTPUT_BLOB:
+        report["blobs"] = _upload(profiler, stats_text.getvalue())
+        # Blob に保存した場合は応答を小さくする
+        report["hotspots"] = report["hotspots"][:5]
+        report["allocations"] = report["allocations"][:5]
+
+    logging.info(f"Profiled run: {report['elapsed_seconds']}s, peak memory {peak} bytes")
+    return result, report
+
+
+def _hotspots(stats: pstats.Stats, top_n: int):
+    """累積時間の上位関数"""
+    rows = []
+    for (filename, line, name), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": nc,
+            "total_seconds": round(tt, 4),
+            "cumulative_seconds": round(ct, 4),
+        })
+    rows.sort(key=lambda r: -r["cumulative_seconds"])
+    return rows[:top_n]
+
+
+def _upload(profiler: cProfile.Profile, stats_text: str) -> Dict[str, str]:
+    """.prof（pstats 形式）と統計テキストを Blob に保存"""
+    profiler.create_stats()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    prof_name = f"{PROFILE_BLOB_PREFIX}run-{stamp}.prof"
+    text_name = f"{PROFILE_BLOB_PREFIX}run-{stamp}.txt"
+
+    state_manager.get_blob_client(prof_name).upload_blob(marshal.dumps(profiler.stats), overwrite=True)
+    state_manager.get_blob_client(text_name).upload_blob(stats_text.encode("utf-8"), overwrite=True)
+    logging.info(f"Uploaded profile: {prof_name}")
+    return {"prof": prof_name, "stats": text_name}
@@ -0,0 +1,44 @@
+"""
+トークンバケットによるレート制限
+"""
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット
+
+    rate 個/秒でトークンが補充され、最大 capacity 個まで貯まります。
+    acquire() はトークンが1つ取れるまで待ちます。
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """トークンを1つ取得（なければ補充されるまで待つ）"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """429 などで待つよう指示された場合にバケットを空にして補充を遅らせる"""
+        with self._lock:
+            self._refill()
+            # 同時に複数の 429 を受けても待ち時間は加算せず、最も長い指示に合わせる
+            self._tokens = min(self._tokens, -seconds * self.rate)
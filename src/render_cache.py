@@ -0,0 +1,139 @@
+"""
+通知のアイテム単位レンダリング結果のキャッシュ
+
+メール（テキスト/HTML）・Webhook（JSON）で使うアイテムごとの断片と、
+HTMLタグ除去・切り詰め済みの description を
+(workItemId, 内容のハッシュ, 形式) をキーに LRU でキャッシュします。
+内容が変わればハッシュが変わるため、古いエントリは使われずに押し出されます。
+
+RENDER_CACHE_PERSIST=true の場合は Blob に保存し、次回以降の実行でも再利用します。
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from . import state_manager
+
+
+BLOB_NAME = "render-cache.json"
+
+# ハッシュに含めるフィールド（レンダリング結果に影響するもの）
+HASHED_FIELDS = ("title", "product", "state", "changedDate", "description")
+
+
+def get_max_size() -> int:
+    """キャッシュする最大エントリ数"""
+    return int(os.environ.get("RENDER_CACHE_SIZE", "5000"))
+
+
+def is_persist_enabled() -> bool:
+    """Blob に保存するか（環境変数 RENDER_CACHE_PERSIST）"""
+    return os.environ.get("RENDER_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+
+
+def content_hash(item) -> str:
+    """レンダリングに影響するフィールドのハッシュ"""
+    digest = hashlib.blake2b(digest_size=8)
+    for field in HASHED_FIELDS:
+        digest.update(str(item.get(field, "") or "").encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """サイズ上限付きの LRU キャッシュ"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_render(self, item, fmt: str, render: Callable[[Any], Any], item_hash: Optional[str] = None) -> Any:
+        """
+        キャッシュ済みならそれを返し、なければ render(item) の結果を保存して返す
+
+        Args:
+            item: アイテム（dict または Issue）
+            fmt: 形式（例: "html", "text", "json", "summary:200"）
+            render: レンダリング関数
+            item_hash: content_hash(item)（同じアイテムで複数形式を扱う場合に再計算を省く）
+        """
+        key = (str(item.get("workItemId", "")), item_hash or content_hash(item), fmt)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value = render(item)
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        """ヒット数・ミス数・エントリ数"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    # ------------------------------------------------------------------
+    # Blob への保存
+    # ------------------------------------------------------------------
+
+    def load(self):
+        """Blob から読み込む（古い順に保存されている）"""
+        data = state_manager.load_json_state(BLOB_NAME)
+        with self._lock:
+            for key, value in data.get("entries", [])[-self.max_size:]:
+                self._entries[tuple(key)] = value
+            self._dirty = False
+        logging.info(f"Render cache loaded: {len(self._entries)} entries")
+
+    def save(self):
+        """変更があれば Blob に保存"""
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [[list(key), value] for key, value in self._entries.items()]
+            self._dirty = False
+        state_manager.save_json_state(BLOB_NAME, {"entries": entries})
+
+
+_cache: Optional[RenderCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    """プロセス内で共有するキャッシュを取得（初回は Blob から読み込む）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache(get_max_size())
+            if is_persist_enabled():
+                try:
+                    _cache.load()
+                except Exception as e:
+                    logging.warning(f"Failed to load render cache: {e}")
+        return _cache
+
+
+def persist():
+    """Blob への保存が有効なら保存"""
+    if _cache is None or not is_persist_enabled():
+        return
+    try:
+        _cache.save()
+    except Exception as e:
+        logging.warning(f"Failed to save render cache: {e}")
@@ -0,0 +1,184 @@
+"""
+購読者ごとの通知振り分け
+
+config/subscriptions.json の購読者（製品・状態・キーワードの条件と送信先）を
+あらかじめインデックスにまとめ、変更アイテムごとに1回の走査で該当する購読者を求めます。
+
+- 製品: 製品名・製品ID -> 購読者のインデックス（条件なしの購読者は別に保持）
+- 状態: 購読者ごとの集合
+- キーワード: 全購読者のキーワードから作った Aho-Corasick オートマトンで、
+  タイトルと description（HTMLタグ除去）を1回だけ走査
+  （NFKC 正規化・小文字化した部分一致。日本語も区切りなしで一致します）
+
+振り分けた結果は購読者ごとに1通にまとめて送信します（notifier.send_notification）。
+"""
+import logging
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from .search_index import strip_html
+from .settings import load_subscriptions_config, get_subscriptions_mtime
+
+
+def normalize(text: str) -> str:
+    """キーワード照合用の正規化（NFKC・小文字化）"""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+class KeywordAutomaton:
+    """
+    複数キーワードの同時検索（Aho-Corasick）
+
+    テキストの長さ + 一致数に比例する時間で、登録した全キーワードの出現を求めます。
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Set[str]] = [set()]
+        for keyword in keywords:
+            if keyword:
+                self._insert(keyword)
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def _insert(self, keyword: str):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+            state = next_state
+        self._output[state].add(keyword)
+
+    def _build(self):
+        """失敗遷移を幅優先で作成（出力は失敗先の分も合わせて持つ）"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> Set[str]:
+        """テキストに出現するキーワード"""
+        found: Set[str] = set()
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+
+class RoutingIndex:
+    """
+    購読条件のインデックス
+
+    subscribers:  有効な購読者（設定の順）
+    by_product:   製品名・製品ID -> 購読者の番号
+    any_product:  製品条件のない購読者の番号
+    """
+
+    def __init__(self, subscribers: List[Dict[str, Any]]):
+        self.subscribers = subscribers
+        self.by_product: Dict[str, List[int]] = {}
+        self.any_product: List[int] = []
+        self._states: List[Optional[Set[str]]] = []
+        self._keywords: List[Optional[Set[str]]] = []
+        self._excludes: List[Set[str]] = []
+        all_keywords: Set[str] = set()
+
+        for index, subscriber in enumerate(subscribers):
+            products = subscriber.get("products") or []
+            if products:
+                for product in products:
+                    self.by_product.setdefault(product, []).append(index)
+            else:
+                self.any_product.append(index)
+
+            states = subscriber.get("states") or []
+            self._states.append(set(states) if states else None)
+
+            keywords = {normalize(k) for k in subscriber.get("keywords") or [] if k}
+            excludes = {normalize(k) for k in subscriber.get("excludeKeywords") or [] if k}
+            self._keywords.append(keywords or None)
+            self._excludes.append(excludes)
+            all_keywords |= keywords | excludes
+
+        self.automaton = KeywordAutomaton(sorted(all_keywords))
+
+    def match(self, item) -> List[int]:
+        """アイテムに該当する購読者の番号"""
+        candidates = set(self.any_product)
+        for key in (item.get("product"), item.get("productId")):
+            if key:
+                candidates.update(self.by_product.get(key, ()))
+
+        state = item.get("state")
+        candidates = [i for i in candidates if self._states[i] is None or state in self._states[i]]
+        if not candidates:
+            return []
+
+        found: Set[str] = set()
+        if any(self._keywords[i] or self._excludes[i] for i in candidates):
+            text = normalize(f"{item.get('title') or ''}\n{strip_html(item.get('description') or '')}")
+            found = self.automaton.find(text)
+
+        return sorted(
+            i for i in candidates
+            if (self._keywords[i] is None or self._keywords[i] & found)
+            and not self._excludes[i] & found
+        )
+
+    def route(self, items: Iterable) -> List[Tuple[Dict[str, Any], List[Any]]]:
+        """
+        アイテムを購読者ごとに振り分け
+
+        Returns:
+            (購読者, 該当アイテム) のリスト（該当なしの購読者は含めない）
+        """
+        batches: Dict[int, List[Any]] = {}
+        for item in items:
+            for index in self.match(item):
+                batches.setdefault(index, []).append(item)
+        return [(self.subscribers[i], batches[i]) for i in sorted(batches)]
+
+
+def _enabled_subscribers(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [s for s in config.get("subscribers", []) if s.get("enabled", True)]
+
+
+@lru_cache(maxsize=1)
+def _compile(mtime: Optional[float]) -> RoutingIndex:
+    subscribers = _enabled_subscribers(load_subscriptions_config())
+    index = RoutingIndex(subscribers)
+    logging.info(
+        f"Routing index compiled: {len(subscribers)} subscribers, "
+        f"{len(index.by_product)} product keys, {len(index.automaton)} automaton states"
+    )
+    return index
+
+
+def get_index() -> RoutingIndex:
+    """購読条件のインデックス（設定ファイルが更新されるまで再利用）"""
+    return _compile(get_subscriptions_mtime())
+
+
+def is_enabled() -> bool:
+    """有効な購読者が設定されているか"""
+    return bool(get_index().subscribers)
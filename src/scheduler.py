@@ -0,0 +1,218 @@
+"""
+アダプティブなポーリングスケジューラ
+
+高頻度のタイマーから毎回呼ばれ、その時点で
+- 全件取得（run_job）を行うか
+- 軽量なプローブ（先頭の少数件だけ取得して変化を確認）を行うか
+- 何もしないか
+を、直近の変更頻度・最後の変更からの経過時間・リフレッシュトークンの残り有効期間から判断します。
+
+プローブは件数と changedDate の最大値で変化を判断し、変化があればプローブで取得した
+ページを全件取得の先頭ページとして使います（全件取得の前に改めてプローブはしません）。
+
+状態は Blob（scheduler-state.json）に保存します。
+"""
+import os
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+from . import api_client
+from . import state_manager
+
+
+STATE_BLOB_NAME = "scheduler-state.json"
+
+# 判定結果
+ACTION_FULL = "full"
+ACTION_PROBE = "probe"
+ACTION_SKIP = "skip"
+
+# 変更頻度（件/日）の指数移動平均の重み
+RATE_SMOOTHING = 0.3
+
+# 最後の変更からこの時間以内は「活発」とみなして最短間隔で取得
+HOT_WINDOW = timedelta(hours=6)
+
+
+def is_enabled() -> bool:
+    """アダプティブポーリングを使うか（環境変数 ADAPTIVE_POLLING）"""
+    return os.environ.get("ADAPTIVE_POLLING", "false").lower() in ("1", "true", "yes")
+
+
+def get_scheduler_config() -> Dict[str, Any]:
+    """スケジューラ設定を環境変数から取得"""
+    return {
+        "min_interval": timedelta(minutes=int(os.environ.get("ADAPTIVE_MIN_INTERVAL_MINUTES", "30"))),
+        "max_interval": timedelta(hours=int(os.environ.get("ADAPTIVE_MAX_INTERVAL_HOURS", "24"))),
+        "probe_interval": timedelta(minutes=int(os.environ.get("ADAPTIVE_PROBE_INTERVAL_MINUTES", "15"))),
+        "probe_size": int(os.environ.get("ADAPTIVE_PROBE_SIZE", "20")),
+        "token_margin": timedelta(minutes=int(os.environ.get("ADAPTIVE_TOKEN_MARGIN_MINUTES", "60"))),
+    }
+
+
+def _parse(value: Optional[str]) -> Optional[datetime]:
+    """状態に保存した ISO 形式の日時を戻す"""
+    return datetime.fromisoformat(value) if value else None
+
+
+def load_state() -> Dict[str, Any]:
+    """スケジューラの状態を取得"""
+    return state_manager.load_json_state(STATE_BLOB_NAME)
+
+
+def save_state(state: Dict[str, Any], base: Dict[str, Any]):
+    """
+    スケジューラの状態を保存
+
+    読み込んだ状態（base）から変わったキーだけを最新の状態に反映します
+    （楽観的排他で更新し、他の書き込みと競合したら読み直して反映し直す）。
+
+    Args:
+        state: 更新した状態
+        base: load_state() で読み込んだときの状態（state のコピー）
+    """
+    changed = {key: value for key, value in state.items() if base.get(key) != value}
+    removed = [key for key in base if key not in state]
+    if not changed and not removed:
+        return
+
+    def _merge(latest: Dict[str, Any]) -> Dict[str, Any]:
+        latest.update(changed)
+        for key in removed:
+            latest.pop(key, None)
+        return latest
+
+    state_manager.update_json_state(STATE_BLOB_NAME, _merge)
+
+
+def target_interval(state: Dict[str, Any], now: datetime, config: Dict[str, Any]) -> timedelta:
+    """
+    次の全件取得までの目標間隔
+
+    変更頻度（件/日）が高いほど短く、最後の変更が直近なら最短間隔にします。
+    """
+    last_change = _parse(state.get("last_change"))
+    if last_change and now - last_change < HOT_WINDOW:
+        return config["min_interval"]
+
+    rate = state.get("change_rate", 0.0)
+    interval = config["max_interval"] / (1.0 + rate)
+    return max(config["min_interval"], min(config["max_interval"], interval))
+
+
+def decide(state: Dict[str, Any], now: Optional[datetime] = None,
+           config: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+    """
+    このタイマー実行で何をするか判断
+
+    Returns:
+        (ACTION_FULL / ACTION_PROBE / ACTION_SKIP, 理由)
+    """
+    now = now or datetime.now(timezone.utc)
+    config = config or get_scheduler_config()
+
+    last_full = _parse(state.get("last_full_fetch"))
+    if last_full is None:
+        return ACTION_FULL, "no previous full fetch"
+
+    since_full = now - last_full
+    if since_full >= config["max_interval"]:
+        return ACTION_FULL, f"max interval reached ({since_full})"
+
+    # リフレッシュトークンが失効する前に最後の取得を済ませる
+    token_expires_at = _parse(state.get("token_expires_at"))
+    if token_expires_at and token_expires_at - now < config["token_margin"] and since_full >= config["min_interval"]:
+        return ACTION_FULL, f"refresh token expires at {token_expires_at}"
+
+    interval = target_interval(state, now, config)
+    if since_full >= interval:
+        return ACTION_FULL, f"target interval reached ({since_full} >= {interval})"
+
+    # 並び順が changedDate の降順でないとプローブでは変化を判断できないため、しばらくプローブしない
+    unordered_at = _parse(state.get("probe_unordered_at"))
+    if unordered_at and now - unordered_at < config["max_interval"]:
+        return ACTION_SKIP, f"probe unavailable (unordered results), next full fetch in {interval - since_full}"
+
+    last_probe = _parse(state.get("last_probe"))
+    if last_probe is None or now - last_probe >= config["probe_interval"]:
+        return ACTION_PROBE, f"probe (next full fetch in {interval - since_full})"
+
+    return ACTION_SKIP, f"next full fetch in {interval - since_full}"
+
+
+def probe(access_token, state: Dict[str, Any],
+          config: Optional[Dict[str, Any]] = None) -> Tuple[bool, api_client.FirstPage]:
+    """
+    先頭の少数件だけ取得し、前回の全件取得から変化があるか確認
+
+    - 先頭ページの changedDate の最大値が前回の全件取得より後なら変化あり
+      （検索結果は changedDate の降順で返ることを確認した上で、最大値を全体の最大値とみなす）
+    - 全件が1ページに収まった場合は件数も比較（条件から外れたアイテムも検知）
+    - 降順でなければ判断できないため変化ありとし、max_interval の間はプローブしない
+
+    Returns:
+        (変化があれば True（全件取得すべき）, 全件取得の先頭ページに使う取得結果)
+    """
+    config = config or get_scheduler_config()
+    payload = api_client.build_payload()
+    payload["maxIssueCount"] = config["probe_size"]
+
+    items = api_client.get_known_issues(access_token, payload)
+    if not isinstance(items, list):
+        items = []
+    now = datetime.now(timezone.utc)
+    state["last_probe"] = now.isoformat()
+
+    changed, reason = _detect_change(state, items, config["probe_size"])
+    if reason == "unordered results":
+        state["probe_unordered_at"] = now.isoformat()
+    logging.info(f"Probe: {len(items)} items, changed={changed} ({reason})")
+    return changed, api_client.FirstPage(items, config["probe_size"])
+
+
+def _detect_change(state: Dict[str, Any], items: List[Dict[str, Any]], requested: int) -> Tuple[bool, str]:
+    """プローブ結果と前回の全件取得を比較（Returns: (変化があるか, 理由)）"""
+    last_full = _parse(state.get("last_full_fetch"))
+    if last_full is None:
+        return True, "no previous full fetch"
+
+    stamps = [state_manager.changed_timestamp(item) for item in items]
+    if None in stamps or any(a < b for a, b in zip(stamps, stamps[1:])):
+        return True, "unordered results"
+
+    if stamps and stamps[0] > last_full.timestamp():
+        return True, f"changed after the last full fetch ({items[0].get('changedDate')})"
+
+    if len(items) < requested and len(items) != state.get("issue_count"):
+        return True, f"issue count changed ({state.get('issue_count')} -> {len(items)})"
+
+    return False, "no change"
+
+
+def record_full_fetch(state: Dict[str, Any], new_count: int, token_expires_at: Optional[datetime] = None,
+                      now: Optional[datetime] = None, total_count: Optional[int] = None):
+    """
+    全件取得の結果を状態に反映
+
+    変更頻度（件/日）を指数移動平均で更新し、次のプローブの比較基準（日時・件数）を記録します。
+
+    Args:
+        now: 全件取得の開始日時（これより後の changedDate を変化とみなす）
+    """
+    now = now or datetime.now(timezone.utc)
+
+    last_full = _parse(state.get("last_full_fetch"))
+    if last_full:
+        elapsed_days = max((now - last_full).total_seconds() / 86400, 1e-6)
+        observed = new_count / elapsed_days
+        state["change_rate"] = RATE_SMOOTHING * observed + (1 - RATE_SMOOTHING) * state.get("change_rate", 0.0)
+
+    if new_count:
+        state["last_change"] = now.isoformat()
+    state["last_full_fetch"] = now.isoformat()
+    if total_count is not None:
+        state["issue_count"] = total_count
+    state.pop("probe_fingerprint", None)
+
+    if token_expires_at:
+        state["token_expires_at"] = token_expires_at.isoformat()
@@ -0,0 +1,330 @@
+"""
+既知の問題のローカル全文検索インデックス
+
+保存済みスナップショット（known_issues.json）の title / description / product から
+転置インデックスを構築し、ネットワークなしでランク付き検索を行います。
+
+- 日本語（ja-JP）はスペースで区切られないため、CJK 文字列は bi-gram に分割
+- それ以外の文字（アクセント付きのラテン文字なども含む）は単語単位でトークン化
+- ランキングは BM25（フィールドごとに重み付け）
+- workItemId ごとに内容のハッシュを持ち、再構築は変更分のみ（インクリメンタル）
+- gzip 圧縮した JSON として保存
+"""
+import gzip
+import hashlib
+import html
+import json
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+
+# インデックスファイルのフォーマットバージョン（トークン化を変えたら上げて再構築させる）
+INDEX_VERSION = 2
+
+# フィールドごとの重み（タイトル・製品名の一致を本文より高く評価）
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "product": 2.0,
+    "description": 1.0,
+}
+
+# BM25 パラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# CJK 文字（ひらがな・カタカナ・漢字・長音記号）
+_CJK_CHARS = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+# CJK 文字の連続、または CJK 以外の単語構成文字（Unicode の \w）の連続
+_TOKEN_PATTERN = re.compile(rf"([{_CJK_CHARS}]+)|([^\W{_CJK_CHARS}]+)", re.UNICODE)
+_TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+def strip_html(text: str) -> str:
+    """HTMLタグを除去し、文字参照をデコード"""
+    if not text:
+        return ""
+    return html.unescape(_TAG_PATTERN.sub(" ", text))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    テキストをトークン列に分割
+
+    NFKC 正規化と casefold の後、CJK 文字列は bi-gram（1文字なら uni-gram）、
+    それ以外の単語構成文字（é・ß などの非 ASCII を含む）は単語単位で切り出します。
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", text).casefold()
+
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        cjk, word = match.groups()
+        if cjk:
+            if len(cjk) == 1:
+                tokens.append(cjk)
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def _document_fields(item: Dict[str, Any]) -> Dict[str, str]:
+    """インデックス対象のフィールドを取り出す"""
+    return {
+        "title": item.get("title") or "",
+        "product": item.get("product") or "",
+        "description": strip_html(item.get("description") or ""),
+    }
+
+
+def _content_hash(fields: Dict[str, str]) -> str:
+    """インデックス対象フィールドのハッシュ（変更検知用）"""
+    digest = hashlib.blake2b(digest_size=8)
+    for name in FIELD_WEIGHTS:
+        digest.update(fields[name].encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class SearchIndex:
+    """
+    既知の問題の転置インデックス
+
+    postings: トークン -> {workItemId: 重み付き出現回数}
+    docs:     workItemId -> {"hash", "length", "terms", "title", "product"}
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self._total_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    # ------------------------------------------------------------------
+    # 更新
+    # ------------------------------------------------------------------
+
+    def update(self, items: Iterable[Dict[str, Any]], remove_missing: bool = True) -> Dict[str, int]:
+        """
+        スナップショットからインデックスをインクリメンタルに更新
+
+        内容ハッシュが変わっていないドキュメントはスキップします。
+
+        Args:
+            items: APIから取得したアイテム
+            remove_missing: スナップショットに存在しないドキュメントを削除するか
+
+        Returns:
+            added / updated / removed / unchanged の件数
+        """
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        seen = set()
+
+        for item in items:
+            doc_id = str(item.get("workItemId") or "")
+            if not doc_id:
+                continue
+            seen.add(doc_id)
+
+            fields = _document_fields(item)
+            content_hash = _content_hash(fields)
+            existing = self.docs.get(doc_id)
+            if existing and existing["hash"] == content_hash:
+                stats["unchanged"] += 1
+                continue
+
+            if existing:
+                self._remove(doc_id)
+                stats["updated"] += 1
+            else:
+                stats["added"] += 1
+            self._add(doc_id, fields, content_hash)
+
+        if remove_missing:
+            for doc_id in [d for d in self.docs if d not in seen]:
+                self._remove(doc_id)
+                stats["removed"] += 1
+
+        return stats
+
+    def _add(self, doc_id: str, fields: Dict[str, str], content_hash: str):
+        """ドキュメントを追加"""
+        weighted = Counter()
+        for name, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(fields[name]):
+                weighted[token] += weight
+
+        for token, tf in weighted.items():
+            self.postings.setdefault(token, {})[doc_id] = tf
+
+        length = sum(weighted.values())
+        self.docs[doc_id] = {
+            "hash": content_hash,
+            "length": length,
+            "terms": list(weighted),
+            "title": fields["title"],
+            "product": fields["product"],
+        }
+        self._total_length += length
+
+    def _remove(self, doc_id: str):
+        """ドキュメントを削除"""
+        doc = self.docs.pop(doc_id)
+        for token in doc["terms"]:
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[token]
+        self._total_length -= doc["length"]
+
+    # ------------------------------------------------------------------
+    # 検索
+    # ------------------------------------------------------------------
+
+    def search(self, query: str, limit: int = 20, product: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        BM25 でランク付けして検索
+
+        Args:
+            query: 検索文字列
+            limit: 最大件数
+            product: 製品名で絞り込む場合に指定
+
+        Returns:
+            workItemId / title / product / score のリスト（スコア降順）
+        """
+        tokens = set(tokenize(query))
+        if not tokens or not self.docs:
+            return []
+
+        doc_count = len(self.docs)
+        avg_length = self._total_length / doc_count if doc_count else 0.0
+        scores: Dict[str, float] = {}
+
+        for token in tokens:
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for doc_id, tf in posting.items():
+                length = self.docs[doc_id]["length"]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length) if avg_length else BM25_K1
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        if product:
+            scores = {d: s for d, s in scores.items() if self.docs[d]["product"] == product}
+
+        ranked: List[Tuple[str, float]] = sorted(scores.items(), key=lambda x: -x[1])[:limit]
+        return [
+            {
+                "workItemId": doc_id,
+                "title": self.docs[doc_id]["title"],
+                "product": self.docs[doc_id]["product"],
+                "score": round(score, 4),
+            }
+            for doc_id, score in ranked
+        ]
+
+    # ------------------------------------------------------------------
+    # 永続化
+    # ------------------------------------------------------------------
+
+    def save(self, path: Path):
+        """
+        gzip 圧縮した JSON として保存
+
+        ドキュメントIDは整数に置き換え、ポスティングは
+        [doc番号, tf, doc番号, tf, ...] のフラットな配列で保持します。
+        """
+        doc_ids = list(self.docs)
+        doc_numbers = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+
+        data = {
+            "version": INDEX_VERSION,
+            "docs": [
+                [doc_id, self.docs[doc_id]["hash"], self.docs[doc_id]["title"], self.docs[doc_id]["product"]]
+                for doc_id in doc_ids
+            ],
+            "postings": {
+                token: [v for doc_id, tf in posting.items() for v in (doc_numbers[doc_id], tf)]
+                for token, posting in self.postings.items()
+            },
+        }
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "SearchIndex":
+        """保存済みインデックスを読み込む（なければ空のインデックス）"""
+        index = cls()
+        path = Path(path)
+        if not path.exists():
+            return index
+
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Failed to load search index, rebuilding: {e}")
+            return index
+
+        if data.get("version") != INDEX_VERSION:
+            logging.info("Search index version changed, rebuilding")
+            return index
+
+        doc_ids = []
+        for doc_id, content_hash, title, product in data["docs"]:
+            doc_ids.append(doc_id)
+            index.docs[doc_id] = {
+                "hash": content_hash,
+                "length": 0.0,
+                "terms": [],
+                "title": title,
+                "product": product,
+            }
+
+        for token, flat in data["postings"].items():
+            posting = {}
+            for i in range(0, len(flat), 2):
+                doc_id = doc_ids[flat[i]]
+                tf = flat[i + 1]
+                posting[doc_id] = tf
+                doc = index.docs[doc_id]
+                doc["length"] += tf
+                doc["terms"].append(token)
+            index.postings[token] = posting
+
+        index._total_length = sum(doc["length"] for doc in index.docs.values())
+        return index
+
+
+def update_index_file(items: Iterable[Dict[str, Any]], path: Path) -> Tuple["SearchIndex", Dict[str, int]]:
+    """
+    インデックスファイルを読み込み、スナップショットで更新して保存
+
+    Returns:
+        (更新後のインデックス, 追加・更新・削除の件数)
+    """
+    index = SearchIndex.load(path)
+    stats = index.update(items)
+    if stats["added"] or stats["updated"] or stats["removed"] or not Path(path).exists():
+        index.save(path)
+    logging.info(f"Search index updated: {stats}")
+    return index, stats
@@ -0,0 +1,267 @@
+"""
+Key Vault シークレットのプロセス内キャッシュ
+
+リフレッシュトークンは実行のたびにローテーションされるため、毎回
+get_secret / set_secret すると Key Vault の往復がクリティカルパスに乗り、
+シークレットのバージョンも増え続けます。
+
+- 読み込み: 値とバージョンをキャッシュし、TTL 内は Key Vault に問い合わせない
+- 書き込み: キャッシュを即座に更新し、Key Vault への保存はバックグラウンドで
+  まとめて（デバウンスして）行う
+- Key Vault の値が SECRET_MIN_WRITE_INTERVAL 秒以内に保存されたものなら、ローテーションした
+  値は保存せずプロセス内だけで使う（古いリフレッシュトークンも失効までは使えるため。
+  実行をまたいだ書き込みの間引き。flush(force=True) で保存する）
+- バージョンを TTL 内に確認済みならそのまま保存し、不明な場合だけ保存前に現在の
+  バージョンを確認する（他のインスタンスが先に更新していれば上書きせずそちらの値を採用）
+- 保存に失敗した値は保留のまま残し、間隔を空けて再試行する（flush() は False を返す）
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+from . import deadline
+from . import metrics
+
+
+# Key Vault 読み込みのタイムアウト（秒、締め切りが近ければ残り時間まで）
+KEYVAULT_TIMEOUT = 30
+
+# 保存に失敗した場合の再試行間隔の上限（秒）
+RETRY_MAX_DELAY = 60.0
+
+
+def get_cache_ttl() -> float:
+    """キャッシュした値を Key Vault に再確認するまでの秒数"""
+    return float(os.environ.get("SECRET_CACHE_TTL", "3600"))
+
+
+def get_write_delay() -> float:
+    """書き込みをまとめるために待つ秒数"""
+    return float(os.environ.get("SECRET_WRITE_DELAY", "5"))
+
+
+def get_min_write_interval() -> float:
+    """Key Vault の値がこの秒数より新しければ、ローテーションした値を保存しない"""
+    return float(os.environ.get("SECRET_MIN_WRITE_INTERVAL", "3600"))
+
+
+class SecretCache:
+    """1つのシークレットのキャッシュとバックグラウンド書き込み"""
+
+    def __init__(self, secret_client, secret_name: str):
+        self.secret_client = secret_client
+        self.secret_name = secret_name
+
+        self._lock = threading.Condition()
+        self._value: Optional[str] = None
+        self._version: Optional[str] = None
+        self._tags: Optional[Dict[str, str]] = None
+        self._fetched_at = 0.0
+        # Key Vault と最後にバージョンを確認した時刻（monotonic）と、Key Vault の値の保存日時（UNIX 秒）
+        self._verified_at = 0.0
+        self._stored_at: Optional[float] = None
+
+        self._pending: Optional[Tuple[str, Optional[Dict[str, str]]]] = None
+        self._deferred: Optional[Tuple[str, Optional[Dict[str, str]]]] = None
+        self._writing = False
+        self._writer_running = False
+        self._failures = 0
+
+    # ------------------------------------------------------------------
+    # 読み込み
+    # ------------------------------------------------------------------
+
+    def get(self) -> str:
+        """シークレットの値を取得（TTL 内ならキャッシュから）"""
+        with self._lock:
+            if self._value is not None and (
+                self._pending is not None
+                or self._deferred is not None
+                or self._writing
+                or time.monotonic() - self._fetched_at < get_cache_ttl()
+            ):
+                return self._value
+
+        logging.info("Retrieving secret from Key Vault...")
+        secret = self._get_secret()
+        with self._lock:
+            self._value = secret.value
+            self._tags = dict(secret.properties.tags or {})
+            self._fetched_at = time.monotonic()
+            self._remember(secret)
+            return self._value
+
+    @property
+    def tags(self) -> Dict[str, str]:
+        """キャッシュしているシークレットのタグ"""
+        with self._lock:
+            return dict(self._tags or {})
+
+    # ------------------------------------------------------------------
+    # 書き込み
+    # ------------------------------------------------------------------
+
+    def set(self, value: str, tags: Optional[Dict[str, str]] = None):
+        """
+        シークレットの値を更新
+
+        キャッシュは即座に更新し、Key Vault への保存はバックグラウンドで行います。
+        短時間に複数回呼ばれた場合は最後の値だけを保存します。
+        Key Vault の値が SECRET_MIN_WRITE_INTERVAL 秒以内に保存されたものなら保存を見送ります。
+        """
+        with self._lock:
+            self._value = value
+            if tags is not None:
+                self._tags = dict(tags)
+            self._fetched_at = time.monotonic()
+            entry = (value, tags if tags is not None else self._tags)
+
+            if (
+                self._pending is None
+                and not self._writing
+                and self._stored_at is not None
+                and time.time() - self._stored_at < get_min_write_interval()
+            ):
+                self._deferred = entry
+                logging.info("Key Vault copy is recent. Keeping the rotated secret in memory.")
+                return
+
+            self._deferred = None
+            self._pending = entry
+            self._start_writer()
+
+    def flush(self, timeout: float = 30.0, force: bool = False) -> bool:
+        """
+        保留中の書き込みが完了するまで待つ
+
+        Args:
+            force: 保存を見送った値（SECRET_MIN_WRITE_INTERVAL）も保存する
+
+        Returns:
+            すべて保存済みなら True（失敗して再試行待ちの値があれば False）
+        """
+        until = time.monotonic() + timeout
+        with self._lock:
+            if force and self._deferred is not None:
+                self._pending, self._deferred = self._deferred, None
+                self._start_writer()
+
+            while self._pending is not None or self._writing:
+                remaining = until - time.monotonic()
+                if remaining <= 0:
+                    if self._failures:
+                        logging.warning(f"Key Vault update still pending after {self._failures} failed attempts.")
+                    return False
+                self._lock.wait(remaining)
+            return True
+
+    def _start_writer(self):
+        """書き込みスレッドを起動（self._lock を保持した状態で呼ぶ）"""
+        if not self._writer_running:
+            self._writer_running = True
+            threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def _write_loop(self):
+        """保留中の値を Key Vault に保存する（バックグラウンドスレッド）"""
+        while True:
+            with self._lock:
+                delay = min(get_write_delay() * (2 ** self._failures), RETRY_MAX_DELAY)
+            time.sleep(delay)
+
+            with self._lock:
+                if self._pending is None:
+                    self._writer_running = False
+                    self._lock.notify_all()
+                    return
+                value, tags = self._pending
+                expected_version = self._version
+                self._pending = None
+                self._writing = True
+
+            try:
+                self._write(value, tags, expected_version)
+                with self._lock:
+                    self._failures = 0
+            except Exception as e:
+                with self._lock:
+                    self._failures += 1
+                    # より新しい値が保留されていなければ、失敗した値を再試行する
+                    if self._pending is None:
+                        self._pending = (value, tags)
+                    failures = self._failures
+                logging.warning(f"Failed to update Key Vault (attempt {failures}), will retry: {e}")
+            finally:
+                with self._lock:
+                    self._writing = False
+                    self._lock.notify_all()
+
+    def _write(self, value: str, tags: Optional[Dict[str, str]], expected_version: Optional[str]):
+        """保存（TTL 内に確認したバージョンがなければ、先に現在のバージョンを確認）"""
+        with self._lock:
+            verified = expected_version is not None and time.monotonic() - self._verified_at < get_cache_ttl()
+
+        if not verified:
+            current = self._get_secret()
+            if expected_version and current.properties.version != expected_version:
+                # 他のインスタンスが先に更新した: 上書きせずそちらを採用
+                logging.warning(
+                    f"Secret was updated elsewhere (expected version {expected_version}, "
+                    f"found {current.properties.version}). Adopting the newer value."
+                )
+                with self._lock:
+                    if self._pending is None:
+                        self._value = current.value
+                        self._tags = dict(current.properties.tags or {})
+                    self._fetched_at = time.monotonic()
+                    self._remember(current)
+                return
+
+            if current.value == value:
+                with self._lock:
+                    self._remember(current)
+                return
+
+        timeout = deadline.timeout(KEYVAULT_TIMEOUT, "Key Vault write")
+        with metrics.timed("keyvault_seconds", "keyvault_requests_total", op="set"):
+            updated = self.secret_client.set_secret(
+                self.secret_name, value, tags=tags or None,
+                connection_timeout=timeout, read_timeout=timeout
+            )
+        with self._lock:
+            self._remember(updated)
+        logging.info("Key Vault updated successfully.")
+
+    def _get_secret(self):
+        """Key Vault からシークレットを取得"""
+        timeout = deadline.timeout(KEYVAULT_TIMEOUT, "Key Vault read")
+        with metrics.timed("keyvault_seconds", "keyvault_requests_total", op="get"):
+            return self.secret_client.get_secret(
+                self.secret_name, connection_timeout=timeout, read_timeout=timeout
+            )
+
+    def _remember(self, secret):
+        """Key Vault のバージョン・保存日時を記録（self._lock を保持した状態で呼ぶ）"""
+        self._version = secret.properties.version
+        self._verified_at = time.monotonic()
+        updated_on = getattr(secret.properties, "updated_on", None)
+        self._stored_at = updated_on.timestamp() if updated_on else None
+
+
+_caches: Dict[Tuple[str, str], SecretCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_secret_cache(secret_client, vault_url: str, secret_name: str) -> SecretCache:
+    """
+    プロセス内で共有するキャッシュを取得
+
+    AuthManager は実行ごとに作られるため、キャッシュはモジュールで保持します。
+    """
+    key = (vault_url, secret_name)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = SecretCache(secret_client, secret_name)
+            _caches[key] = cache
+        return cache
@@ -50,6 +50,22 @@ def load_outputs_config() -> Dict[str, Any]:
         return json.load(f)
 
 
+def load_subscriptions_config() -> Dict[str, Any]:
+    """subscriptions.json を読み込む（存在しない場合は購読者なし）"""
+    config_file = CONFIG_DIR / "subscriptions.json"
+    if not config_file.exists():
+        return {"subscribers": []}
+
+    with open(config_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_subscriptions_mtime() -> Optional[float]:
+    """subscriptions.json の更新日時（存在しない場合は None）"""
+    config_file = CONFIG_DIR / "subscriptions.json"
+    return config_file.stat().st_mtime if config_file.exists() else None
+
+
 def get_enabled_product_ids() -> List[str]:
     """有効な製品IDのリストを取得"""
     config = load_products_config()
@@ -69,6 +85,22 @@ def get_issue_settings() -> Dict[str, Any]:
     })
 
 
+def get_sweep_settings() -> Dict[str, Any]:
+    """
+    複数ロケール・複数状態の取得設定を取得
+
+    settings に locales / issueStatuses がなければ、単一の
+    locale / issueStatus を要素1つのリストとして返す
+    """
+    settings = get_issue_settings()
+    return {
+        "locales": settings.get("locales") or [settings.get("locale", "ja-JP")],
+        "issueStatuses": settings.get("issueStatuses") or [settings.get("issueStatus", "Active")],
+        "productGroupSize": settings.get("productGroupSize", 0),
+        "maxConcurrency": settings.get("maxConcurrency", 4),
+    }
+
+
 def get_storage_config() -> Optional[Dict[str, Any]]:
     """ストレージ設定を取得（無効なら None）"""
     config = load_outputs_config()
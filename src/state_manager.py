@@ -1,23 +1,47 @@
 """
-前回実行日時を Azure Blob Storage で管理するモジュール
+前回実行日時と最新スナップショットを Azure Blob Storage で管理するモジュール
 """
 import os
+import json
 import logging
+import threading
 from datetime import datetime, timezone, timedelta
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
 from azure.storage.blob import BlobServiceClient
+from . import codec
+from . import deadline
+from . import metrics
 
 
 # 定数
 CONTAINER_NAME = "function-state"
 BLOB_NAME = "last-run-time.txt"
+SNAPSHOT_BLOB_NAME = "known-issues-snapshot.json"
+LOCK_BLOB_NAME = "run-job.lock"
+LEASE_DURATION = 60  # 秒（15〜60）
+BLOB_TIMEOUT = 30  # 秒（締め切りが近ければ残り時間まで）
 
+# 状態 Blob のプロセス内キャッシュ（内容と ETag。次回の読み込みは If-None-Match で確認するだけ）
+STATE_CACHE_ENTRIES = 64
+STATE_CACHE_MAX_BYTES = 1024 * 1024
 
-def get_blob_client():
-    """Blob クライアントを取得"""
-    connection_string = os.environ.get("AzureWebJobsStorage")
-    if not connection_string:
-        raise ValueError("AzureWebJobsStorage is not set")
-    
+# If-Match の書き込みが競合したときにやり直す回数
+STATE_WRITE_RETRIES = 5
+
+
+@lru_cache(maxsize=4)
+def _get_container_client(connection_string: str):
+    """コンテナクライアント（コンテナの作成確認はプロセスで1回だけ）"""
     blob_service = BlobServiceClient.from_connection_string(connection_string)
     container_client = blob_service.get_container_client(CONTAINER_NAME)
     
@@ -29,8 +53,158 @@ def get_blob_client():
         # 既に存在する場合は無視
         pass
     
-    return container_client.get_blob_client(BLOB_NAME)
+    return container_client
+
+
+def get_blob_client(blob_name: str = BLOB_NAME):
+    """Blob クライアントを取得"""
+    connection_string = os.environ.get("AzureWebJobsStorage")
+    if not connection_string:
+        raise ValueError("AzureWebJobsStorage is not set")
+    
+    return _get_container_client(connection_string).get_blob_client(blob_name)
+
+
+def blob_timeout(operation: str) -> int:
+    """Blob 操作のタイムアウト（秒、締め切りを過ぎていれば DeadlineExceeded）"""
+    return max(1, int(deadline.timeout(BLOB_TIMEOUT, operation)))
+
+
+# ----------------------------------------------------------------------
+# 条件付きの読み書き
+# ----------------------------------------------------------------------
+
+class StateConflictError(RuntimeError):
+    """他の書き込みと競合し続けて保存できなかった"""
+
+
+_cache: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_get(blob_name: str) -> Optional[Tuple[bytes, str]]:
+    with _cache_lock:
+        entry = _cache.get(blob_name)
+        if entry is not None:
+            _cache.move_to_end(blob_name)
+        return entry
+
+
+def _cache_put(blob_name: str, data: bytes, etag: str):
+    """内容と ETag を保持（大きな Blob は保持しない）"""
+    with _cache_lock:
+        if len(data) > STATE_CACHE_MAX_BYTES:
+            _cache.pop(blob_name, None)
+            return
+        _cache[blob_name] = (data, etag)
+        _cache.move_to_end(blob_name)
+        while len(_cache) > STATE_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def _cache_drop(blob_name: str):
+    with _cache_lock:
+        _cache.pop(blob_name, None)
+
+
+def read_blob(blob_name: str) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Blob を読み込む
+
+    以前に読み書きした内容を保持していれば If-None-Match で確認し、
+    変更がなければ（304）ダウンロードせずに保持している内容を返します。
+
+    Returns:
+        (内容, ETag)。存在しなければ (None, None)
+    """
+    timeout = blob_timeout(f"reading {blob_name}")
+    cached = _cache_get(blob_name)
+    conditions = {"etag": cached[1], "match_condition": MatchConditions.IfModified} if cached else {}
+
+    blob_client = get_blob_client(blob_name)
+    with metrics.timed("blob_seconds", "blob_requests_total", op="read"):
+        try:
+            downloader = blob_client.download_blob(timeout=timeout, **conditions)
+            data = downloader.readall()
+        except ResourceNotModifiedError:
+            metrics.inc("blob_not_modified_total")
+            return cached
+        except ResourceNotFoundError:
+            _cache_drop(blob_name)
+            return None, None
+
+    etag = downloader.properties.etag
+    _cache_put(blob_name, data, etag)
+    return data, etag
+
+
+def write_blob(blob_name: str, data: bytes, etag: Optional[str] = None, create_only: bool = False) -> str:
+    """
+    Blob を書き込む
+
+    Args:
+        blob_name: Blob 名
+        data: 内容
+        etag: 指定すると If-Match（その後に他の書き込みがあれば ResourceModifiedError）
+        create_only: True なら存在しない場合のみ作成（あれば ResourceExistsError）
+
+    Returns:
+        書き込んだ Blob の ETag
+    """
+    conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+    overwrite = not (create_only and not etag)
+
+    blob_client = get_blob_client(blob_name)
+    try:
+        with metrics.timed("blob_seconds", "blob_requests_total", op="write"):
+            result = blob_client.upload_blob(
+                data, overwrite=overwrite, timeout=blob_timeout(f"saving {blob_name}"), **conditions
+            )
+    except (ResourceModifiedError, ResourceExistsError):
+        _cache_drop(blob_name)
+        metrics.inc("blob_write_conflicts_total")
+        raise
+
+    _cache_put(blob_name, data, result["etag"])
+    return result["etag"]
+
+
+def update_blob(blob_name: str, update: Callable[[Optional[bytes]], Optional[bytes]],
+                retries: int = STATE_WRITE_RETRIES) -> Optional[bytes]:
+    """
+    読み込み → 更新 → 条件付き書き込みを、他の書き込みと競合しなくなるまで繰り返す
+
+    保持している内容があれば最初はそれを元に書き込み（読み込みなし）、
+    If-Match が失敗したら最新を読み直して update をやり直します。
 
+    Args:
+        blob_name: Blob 名
+        update: 現在の内容（なければ None）から新しい内容を返す（None なら書き込まない）
+        retries: 競合時にやり直す回数
+
+    Returns:
+        保存した内容（書き込まなかった場合は現在の内容）
+
+    Raises:
+        StateConflictError: retries 回やり直しても競合した
+    """
+    for attempt in range(retries + 1):
+        current, etag = _cache_get(blob_name) or read_blob(blob_name)
+        data = update(current)
+        if data is None:
+            return current
+        try:
+            write_blob(blob_name, data, etag=etag, create_only=etag is None)
+            return data
+        except (ResourceModifiedError, ResourceExistsError):
+            logging.info(f"{blob_name} was updated by another writer. Retrying ({attempt + 1}/{retries})...")
+
+    raise StateConflictError(f"Failed to update {blob_name}: conflicted {retries + 1} times")
+
+
+# ----------------------------------------------------------------------
+# 前回実行日時・スナップショット・状態ファイル
+# ----------------------------------------------------------------------
 
 def get_last_run_time() -> datetime:
     """
@@ -40,11 +214,14 @@ def get_last_run_time() -> datetime:
         前回実行日時（なければ24時間前）
     """
     try:
-        blob_client = get_blob_client()
-        data = blob_client.download_blob().readall().decode('utf-8')
-        last_run = datetime.fromisoformat(data.strip())
+        data, _ = read_blob(BLOB_NAME)
+        if data is None:
+            raise ValueError(f"{BLOB_NAME} does not exist")
+        last_run = datetime.fromisoformat(data.decode('utf-8').strip())
         logging.info(f"Last run time: {last_run}")
         return last_run
+    except deadline.DeadlineExceeded:
+        raise
     except Exception as e:
         # Blob が存在しない場合は24時間前を返す
         logging.info(f"No previous run time found, using 24h ago: {e}")
@@ -54,25 +231,229 @@ def get_last_run_time() -> datetime:
 def save_last_run_time(run_time: datetime = None):
     """
     実行日時を保存
+
+    他の実行がより新しい日時を保存していた場合は上書きしません
+    （If-Match で書き込み、競合したら読み直して比較します）。
     
     Args:
         run_time: 保存する日時（省略時は現在時刻）
     """
     if run_time is None:
         run_time = datetime.now(timezone.utc)
+
+    def _later(current: Optional[bytes]) -> Optional[bytes]:
+        if current is not None:
+            try:
+                saved = datetime.fromisoformat(current.decode('utf-8').strip())
+                if _to_epoch(saved) >= _to_epoch(run_time):
+                    logging.info(f"A newer run time is already saved: {saved}")
+                    return None
+            except ValueError:
+                pass
+        return run_time.isoformat().encode('utf-8')
     
     try:
-        blob_client = get_blob_client()
-        blob_client.upload_blob(
-            run_time.isoformat(),
-            overwrite=True
-        )
+        update_blob(BLOB_NAME, _later)
         logging.info(f"Saved run time: {run_time}")
     except Exception as e:
         logging.error(f"Failed to save run time: {e}")
         raise
 
 
+def save_snapshot(items: Iterable, retrieved_at: datetime = None, localized: dict = None,
+                  blob_name: str = SNAPSHOT_BLOB_NAME):
+    """
+    取得した全件をスナップショットとして保存
+
+    JSON は1件ずつエンコードしてアップロードするため、
+    items にはジェネレータも渡せます（全件の dict を同時に保持しない）。
+    STORAGE_CODEC が設定されていれば圧縮しながらアップロードします。
+
+    Args:
+        items: APIから取得したアイテム（dict または Issue）
+        retrieved_at: 取得日時（省略時は現在時刻）
+        localized: ロケールごとのテキスト {workItemId: {locale: {title, description}}}
+        blob_name: 保存先の Blob 名（省略時は最新スナップショット）
+
+    Returns:
+        保存した件数
+    """
+    if retrieved_at is None:
+        retrieved_at = datetime.now(timezone.utc)
+
+    counter = {"count": 0}
+
+    def _encode():
+        yield f'{{"retrieved_at": {json.dumps(retrieved_at.isoformat())}, "issues": ['.encode('utf-8')
+        for i, item in enumerate(items):
+            if hasattr(item, "to_dict"):
+                item = item.to_dict()
+            yield ((", " if i else "") + json.dumps(item, ensure_ascii=False)).encode('utf-8')
+            counter["count"] += 1
+        if localized:
+            yield f'], "localized": {json.dumps(localized, ensure_ascii=False)}'.encode('utf-8')
+            yield f', "count": {counter["count"]}}}'.encode('utf-8')
+        else:
+            yield f'], "count": {counter["count"]}}}'.encode('utf-8')
+
+    try:
+        blob_client = get_blob_client(blob_name)
+        with metrics.timed("blob_seconds", "blob_requests_total", op="write"):
+            blob_client.upload_blob(
+                codec.encode_stream(_encode()),
+                overwrite=True,
+                timeout=blob_timeout("saving snapshot")
+            )
+        _cache_drop(blob_name)
+        logging.info(f"Saved snapshot: {counter['count']} issues")
+        return counter["count"]
+    except Exception as e:
+        logging.error(f"Failed to save snapshot: {e}")
+        raise
+
+
+def get_snapshot_etag() -> str:
+    """
+    スナップショットの ETag を取得（本体はダウンロードしない）
+
+    Returns:
+        ETag（スナップショットがなければ None）
+    """
+    try:
+        blob_client = get_blob_client(SNAPSHOT_BLOB_NAME)
+        return blob_client.get_blob_properties().etag
+    except Exception as e:
+        logging.info(f"No snapshot found: {e}")
+        return None
+
+
+def load_snapshot(blob_name: str = SNAPSHOT_BLOB_NAME) -> tuple:
+    """
+    スナップショットを取得
+
+    Args:
+        blob_name: Blob 名（省略時は最新スナップショット）
+
+    Returns:
+        (スナップショット, ETag)。なければ (None, None)
+    """
+    try:
+        raw, etag = read_blob(blob_name)
+        if raw is None:
+            raise ValueError(f"{blob_name} does not exist")
+        data = json.loads(codec.decode(raw).decode('utf-8'))
+        return data, etag
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        logging.info(f"No snapshot found: {e}")
+        return None, None
+
+
+def _decode_json(raw: Optional[bytes]) -> dict:
+    return json.loads(codec.decode(raw).decode('utf-8')) if raw else {}
+
+
+def _encode_json(data: dict) -> bytes:
+    return codec.encode(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+def load_json_state(blob_name: str) -> dict:
+    """
+    JSON の状態ファイルを取得
+
+    Args:
+        blob_name: Blob 名
+
+    Returns:
+        保存されている内容（なければ空の dict）
+    """
+    try:
+        raw, _ = read_blob(blob_name)
+        if raw is None:
+            raise ValueError(f"{blob_name} does not exist")
+        return _decode_json(raw)
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        logging.info(f"No state found for {blob_name}: {e}")
+        return {}
+
+
+def save_json_state(blob_name: str, data: dict):
+    """
+    JSON の状態ファイルを保存（無条件に上書き）
+
+    他の書き込みと競合しうる場合は update_json_state を使うこと
+
+    Args:
+        blob_name: Blob 名
+        data: 保存する内容
+    """
+    try:
+        write_blob(blob_name, _encode_json(data))
+        logging.info(f"Saved state: {blob_name}")
+    except Exception as e:
+        logging.error(f"Failed to save state {blob_name}: {e}")
+        raise
+
+
+def update_json_state(blob_name: str, update: Callable[[dict], Optional[dict]]) -> dict:
+    """
+    JSON の状態ファイルを楽観的排他で更新
+
+    Args:
+        blob_name: Blob 名
+        update: 現在の内容（なければ空の dict）から新しい内容を返す（None なら保存しない）
+
+    Returns:
+        保存した内容（保存しなかった場合は現在の内容）
+    """
+    def _apply(current: Optional[bytes]) -> Optional[bytes]:
+        data = update(_decode_json(current))
+        return None if data is None else _encode_json(data)
+
+    try:
+        result = update_blob(blob_name, _apply)
+        logging.info(f"Updated state: {blob_name}")
+        return _decode_json(result)
+    except Exception as e:
+        logging.error(f"Failed to update state {blob_name}: {e}")
+        raise
+
+
+def try_acquire_lock(blob_name: str = LOCK_BLOB_NAME, lease_duration: int = LEASE_DURATION):
+    """
+    ロック用 Blob のリースを取得（取得できなければ None）
+
+    Args:
+        blob_name: ロック用 Blob 名
+        lease_duration: リース期間（秒）。保持中は renew() で延長すること
+
+    Returns:
+        BlobLeaseClient（他の実行がリースを保持していれば None）
+    """
+    blob_client = get_blob_client(blob_name)
+    timeout = blob_timeout("acquiring lock")
+
+    # ロック用 Blob がなければ作成
+    try:
+        blob_client.upload_blob(b"", overwrite=False, timeout=timeout)
+    except ResourceExistsError:
+        pass
+    except HttpResponseError as e:
+        # リース中の Blob への書き込みは 412 になるが、存在はしているので無視
+        if e.status_code != 412:
+            raise
+
+    try:
+        return blob_client.acquire_lease(lease_duration=lease_duration, timeout=timeout)
+    except HttpResponseError as e:
+        if e.status_code == 409:
+            return None
+        raise
+
+
 def filter_by_changed_date(items: list, since: datetime) -> list:
     """
     changedDate でフィルタリング
@@ -84,12 +465,15 @@ def filter_by_changed_date(items: list, since: datetime) -> list:
     Returns:
         フィルタされたアイテムリスト
     """
+    # 基準日時が1つなら1件ずつパースして比較するのが最も速い（changedDate はほぼ一意のため）
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
     filtered = []
     for item in items:
         changed_date_str = item.get('changedDate')
         if not changed_date_str:
             continue
-        
+
         # ISO形式の日付をパース（末尾のZをUTCに変換）
         try:
             changed_date = datetime.fromisoformat(
@@ -99,5 +483,127 @@ def filter_by_changed_date(items: list, since: datetime) -> list:
                 filtered.append(item)
         except ValueError as e:
             logging.warning(f"Failed to parse date {changed_date_str}: {e}")
-    
+
     return filtered
+
+
+def filter_by_changed_dates(items: list, cutoffs: Dict[str, datetime]) -> Dict[str, list]:
+    """
+    複数の基準日時でまとめてフィルタリング
+
+    Args:
+        items: APIから取得したアイテムリスト
+        cutoffs: 名前 -> 基準日時（例: {"last_run": ..., "7d": ..., "30d": ...}）
+
+    Returns:
+        名前 -> 基準日時より後に変更されたアイテムリスト
+    """
+    masks = changed_date_masks(items, cutoffs)
+    return {
+        name: [item for item, hit in zip(items, mask) if hit]
+        for name, mask in masks.items()
+    }
+
+
+def iter_changed_since(items: Iterable, since: datetime) -> Iterator:
+    """
+    changedDate が since より後のアイテムを順次返す（ストリーミング用）
+
+    Args:
+        items: アイテムのイテラブル（ジェネレータ可）
+        since: この日時より後に変更されたものを抽出
+    """
+    threshold = _to_epoch(since)
+    for item in items:
+        stamp = _parse_timestamp(item.get('changedDate'))
+        if stamp is not None and stamp > threshold:
+            yield item
+
+
+def tap_changed_since(items: Iterable, since: datetime, changed: list) -> Iterator:
+    """
+    すべてのアイテムを順次返しつつ、changedDate が since より後のものを changed に追加
+
+    スナップショットの保存（全件）と変更分の抽出を1回の走査で行うためのもの
+    （ストリーミング用。全件はリストに保持しない）
+
+    Args:
+        items: アイテムのイテラブル（ジェネレータ可）
+        since: この日時より後に変更されたものを抽出
+        changed: 変更アイテムの追加先
+    """
+    threshold = _to_epoch(since)
+    for item in items:
+        stamp = _parse_timestamp(item.get('changedDate'))
+        if stamp is not None and stamp > threshold:
+            changed.append(item)
+        yield item
+
+
+def changed_date_masks(items: list, cutoffs: Dict[str, datetime]) -> Dict[str, List[bool]]:
+    """
+    changedDate を1件ずつ一度だけパースし、基準日時ごとのマスクを返す
+
+    パースした datetime のリストを基準日時の数だけ比較するため、基準日時が
+    複数ある場合に1件ずつのループを繰り返すより速くなります。
+    changedDate がない・パースできないアイテムはすべてのマスクで False になります。
+
+    Args:
+        items: APIから取得したアイテムリスト
+        cutoffs: 名前 -> 基準日時
+
+    Returns:
+        名前 -> アイテムと同じ長さの bool リスト
+    """
+    # ない・パースできない値は最小の日時にして、どの基準日時とも比較結果が False になるようにする
+    missing = datetime.min.replace(tzinfo=timezone.utc)
+    parse = datetime.fromisoformat
+    stamps = []
+    for item in items:
+        value = item.get('changedDate')
+        if not value:
+            stamps.append(missing)
+            continue
+        try:
+            stamp = parse(value.replace('Z', '+00:00'))
+        except ValueError as e:
+            logging.warning(f"Failed to parse date {value}: {e}")
+            stamps.append(missing)
+            continue
+        stamps.append(stamp if stamp.tzinfo is not None else stamp.replace(tzinfo=timezone.utc))
+
+    masks = {}
+    for name, since in cutoffs.items():
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        masks[name] = [stamp > since for stamp in stamps]
+    return masks
+
+
+def changed_timestamp(item) -> Optional[float]:
+    """アイテムの changedDate を UNIX 秒で返す（ない・不正なら None）"""
+    return _parse_timestamp(item.get('changedDate'))
+
+
+def _to_epoch(value: datetime) -> float:
+    """datetime を UNIX 秒に変換（タイムゾーンなしは UTC とみなす）"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """
+    ISO形式の日時を UNIX 秒に変換
+
+    Returns:
+        UNIX 秒（空・不正な値は None）
+    """
+    if not value:
+        return None
+    try:
+        # 末尾のZをUTCに変換
+        return _to_epoch(datetime.fromisoformat(value.replace('Z', '+00:00')))
+    except (ValueError, AttributeError) as e:
+        logging.warning(f"Failed to parse date {value}: {e}")
+        return None
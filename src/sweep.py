@@ -0,0 +1,153 @@
+"""
+複数ロケール・複数状態・製品グループをまとめて取得するモジュール
+
+config/products.json の settings から (ロケール × 状態 × 製品グループ) の
+組み合わせを展開し、検索APIを並列に呼び出します。
+
+ロケールに依存しないフィールド（状態・日時・製品IDなど）は1件の正規化した
+アイテムにまとめ、ロケールごとのテキスト（title / description）は
+別テーブルとして保持します。
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional
+from . import api_client
+from . import deadline
+from .settings import get_enabled_product_ids, get_sweep_settings
+
+
+# ロケールごとに異なるフィールド
+LOCALIZED_FIELDS = ("title", "description")
+
+
+def is_sweep_configured() -> bool:
+    """複数のロケール・状態・製品グループを取得する設定か"""
+    settings = get_sweep_settings()
+    return (
+        len(settings["locales"]) > 1
+        or len(settings["issueStatuses"]) > 1
+        or settings["productGroupSize"] > 0
+    )
+
+
+def _chunk(items: List[str], size: int) -> List[List[str]]:
+    """リストを size 件ずつに分割（size <= 0 なら分割しない）"""
+    if size <= 0 or len(items) <= size:
+        return [items]
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def plan_sweep(product_ids: Optional[List[str]] = None, group_size: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    取得タスクの一覧を作成
+
+    Args:
+        product_ids: 対象製品ID（省略時は設定ファイルの有効な製品）
+        group_size: 製品グループの大きさ（省略時は設定の productGroupSize）
+
+    Returns:
+        {"locale", "issueStatus", "productIds"} のリスト
+    """
+    settings = get_sweep_settings()
+    if product_ids is None:
+        product_ids = get_enabled_product_ids()
+
+    if group_size is None:
+        group_size = settings["productGroupSize"]
+
+    groups = _chunk(product_ids, group_size) if product_ids else [None]
+    return [
+        {"locale": locale, "issueStatus": status, "productIds": group}
+        for locale in settings["locales"]
+        for status in settings["issueStatuses"]
+        for group in groups
+    ]
+
+
+def run_task(access_token, task: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """1タスク分の検索を実行"""
+    payload = api_client.build_payload(
+        product_ids=task["productIds"],
+        issue_status=task["issueStatus"],
+        locale=task["locale"],
+    )
+    data = api_client.get_known_issues(access_token, payload)
+    return data if isinstance(data, list) else []
+
+
+def merge_results(results: List[tuple], primary_locale: str) -> Dict[str, Any]:
+    """
+    タスクごとの結果を workItemId で統合
+
+    Args:
+        results: (タスク, アイテムリスト) のリスト
+        primary_locale: 正規化アイテムのテキストに使うロケール
+
+    Returns:
+        {"issues": 正規化アイテムのリスト, "localized": {workItemId: {locale: {title, description}}},
+         "complete": どのタスクも maxIssueCount で打ち切られていないか}
+    """
+    canonical: Dict[str, Dict[str, Any]] = {}
+    localized: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    complete = True
+
+    for task, items in results:
+        locale = task["locale"]
+        complete = complete and api_client.is_complete(len(items))
+        for item in items:
+            work_item_id = str(item.get("workItemId") or "")
+            if not work_item_id:
+                continue
+
+            texts = localized.setdefault(work_item_id, {})
+            texts[locale] = {field: item.get(field) for field in LOCALIZED_FIELDS}
+
+            existing = canonical.get(work_item_id)
+            if existing is None or (item.get("changedDate") or "") > (existing.get("changedDate") or ""):
+                canonical[work_item_id] = {
+                    key: value for key, value in item.items()
+                    if key not in LOCALIZED_FIELDS
+                }
+
+    issues = []
+    for work_item_id, item in canonical.items():
+        texts = localized[work_item_id]
+        text = texts.get(primary_locale) or next(iter(texts.values()))
+        issues.append({**item, **text})
+
+    return {"issues": issues, "localized": localized, "complete": complete}
+
+
+def run_sweep(access_token, plan: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    取得タスクを並列に実行して統合
+
+    Args:
+        access_token: アクセストークン
+        plan: plan_sweep() の結果（省略時は設定から作成）
+
+    Returns:
+        merge_results() の結果
+    """
+    settings = get_sweep_settings()
+    if plan is None:
+        plan = plan_sweep()
+
+    max_workers = max(1, min(settings["maxConcurrency"], len(plan)))
+    logging.info(f"Running sweep: {len(plan)} tasks, concurrency={max_workers}")
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(deadline.bind(run_task), access_token, task): task for task in plan}
+        for future in as_completed(futures):
+            task = futures[future]
+            items = future.result()
+            logging.info(
+                f"Sweep task done: locale={task['locale']}, status={task['issueStatus']}, "
+                f"products={len(task['productIds'] or [])}, issues={len(items)}"
+            )
+            results.append((task, items))
+
+    merged = merge_results(results, primary_locale=settings["locales"][0])
+    logging.info(f"Sweep merged: {len(merged['issues'])} unique issues")
+    return merged
@@ -0,0 +1,216 @@
+"""
+アクセストークンを先回りしてリフレッシュするモジュール
+
+アクセストークンの exp を追跡し、失効の少し前（ジッター付き）にバックグラウンドで
+リフレッシュしておくことで、リクエスト処理ではトークンエンドポイントを待たずに
+準備済みのトークンを使えるようにします。
+
+SPA のリフレッシュトークンはセッション開始から24時間で失効し（AADSTS700084）、
+リフレッシュしても延長されません。トークンレスポンスの refresh_token_expires_in から
+この「ハードな失効」までの残り時間を記録し、ログ・状態として出力します
+（メトリクス refresh_token_expiry_seconds は AuthManager が記録した失効日時から取得時に計算）。
+
+バックグラウンドのリフレッシュでもリフレッシュトークンがローテーションされるため、
+既定では無効です（PROACTIVE_TOKEN_REFRESH=true で有効）。
+"""
+import os
+import json
+import time
+import base64
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from .auth_manager import AuthManager
+
+
+# アクセストークンの失効までこの秒数を切ったら使わずにリフレッシュ
+MIN_REMAINING = 120
+
+# バックグラウンドリフレッシュが失敗した場合の再試行間隔（秒）
+RETRY_INTERVAL = 60
+
+
+def is_enabled() -> bool:
+    """先回りリフレッシュを使うか（環境変数 PROACTIVE_TOKEN_REFRESH）"""
+    return os.environ.get("PROACTIVE_TOKEN_REFRESH", "false").lower() in ("1", "true", "yes")
+
+
+def get_refresh_lead() -> float:
+    """失効の何秒前にリフレッシュするか"""
+    return float(os.environ.get("TOKEN_REFRESH_LEAD_SECONDS", "600"))
+
+
+def get_refresh_jitter() -> float:
+    """リフレッシュ時刻に加えるジッターの最大秒数"""
+    return float(os.environ.get("TOKEN_REFRESH_JITTER_SECONDS", "120"))
+
+
+def decode_jwt_claims(token: str) -> Dict[str, Any]:
+    """JWT のペイロードをデコード（署名は検証しない）"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))
+    except Exception:
+        return {}
+
+
+class TokenRefresher:
+    """準備済みのアクセストークンを保持し、失効前にリフレッシュする"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._auth_manager: Optional[AuthManager] = None
+        self._thread: Optional[threading.Thread] = None
+
+        self.access_token: Optional[str] = None
+        self.access_token_expires_at: Optional[float] = None
+        self.refresh_token_expires_at: Optional[datetime] = None
+        self.last_refresh_at: Optional[float] = None
+        self.last_refresh_seconds: Optional[float] = None
+        self.refresh_count = 0
+
+    @property
+    def auth_manager(self) -> AuthManager:
+        if self._auth_manager is None:
+            self._auth_manager = AuthManager()
+        return self._auth_manager
+
+    # ------------------------------------------------------------------
+    # リクエスト処理から使う
+    # ------------------------------------------------------------------
+
+    def get_access_token(self) -> str:
+        """
+        準備済みのアクセストークンを返す
+
+        まだ取得していない、または失効間近の場合のみその場でリフレッシュします。
+        """
+        with self._lock:
+            if self._is_fresh():
+                token = self.access_token
+            else:
+                token = self._refresh_locked()
+        self._ensure_background()
+        return token
+
+    def refresh_now(self) -> str:
+        """有効期限に関わらずリフレッシュ"""
+        with self._lock:
+            token = self._refresh_locked()
+        self._ensure_background()
+        return token
+
+    def flush(self, timeout: float = 30.0, force: bool = False) -> bool:
+        """保留中の Key Vault 更新の完了を待つ（force: 見送った保存も行う）"""
+        if self._auth_manager is None:
+            return True
+        return self._auth_manager.flush(timeout, force=force)
+
+    def status(self) -> Dict[str, Any]:
+        """トークンの状態（有効期限までの秒数など）"""
+        now = time.time()
+        return {
+            "access_token_expires_in": (
+                round(self.access_token_expires_at - now) if self.access_token_expires_at else None
+            ),
+            "refresh_token_expires_in": (
+                round(self.refresh_token_expires_at.timestamp() - now) if self.refresh_token_expires_at else None
+            ),
+            "last_refresh_at": (
+                datetime.fromtimestamp(self.last_refresh_at, timezone.utc).isoformat() if self.last_refresh_at else None
+            ),
+            "last_refresh_seconds": self.last_refresh_seconds,
+            "refresh_count": self.refresh_count,
+        }
+
+    # ------------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------------
+
+    def _is_fresh(self) -> bool:
+        return (
+            self.access_token is not None
+            and self.access_token_expires_at is not None
+            and self.access_token_expires_at - time.time() > MIN_REMAINING
+        )
+
+    def _refresh_locked(self) -> str:
+        """リフレッシュを実行（self._lock を保持した状態で呼ぶ）"""
+        start = time.monotonic()
+        token = self.auth_manager.get_access_token()
+        elapsed = time.monotonic() - start
+
+        claims = decode_jwt_claims(token)
+        self.access_token = token
+        self.access_token_expires_at = float(claims["exp"]) if "exp" in claims else time.time() + 3600
+        if self.auth_manager.refresh_token_expires_at:
+            self.refresh_token_expires_at = self.auth_manager.refresh_token_expires_at
+        self.last_refresh_at = time.time()
+        self.last_refresh_seconds = round(elapsed, 3)
+        self.refresh_count += 1
+
+        status = self.status()
+        logging.info(
+            f"Access token refreshed in {elapsed:.2f}s. "
+            f"expires_in={status['access_token_expires_in']}s, "
+            f"time_to_hard_expiry={status['refresh_token_expires_in']}s"
+        )
+        self._wakeup.set()
+        return token
+
+    def _next_refresh_delay(self) -> float:
+        """次のバックグラウンドリフレッシュまでの秒数"""
+        if self.access_token_expires_at is None:
+            return RETRY_INTERVAL
+        target = self.access_token_expires_at - get_refresh_lead() - random.uniform(0, get_refresh_jitter())
+        return max(0.0, target - time.time())
+
+    def _ensure_background(self):
+        """バックグラウンドスレッドを起動（未起動の場合）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """失効前にリフレッシュし続ける（バックグラウンドスレッド）"""
+        delay = self._next_refresh_delay()
+        while True:
+            self._wakeup.clear()
+            if self._wakeup.wait(delay):
+                # リクエスト処理側でリフレッシュされた: 予定を立て直す
+                delay = self._next_refresh_delay()
+                continue
+
+            # リフレッシュトークンのハードな失効後は何もしない
+            if self.refresh_token_expires_at and self.refresh_token_expires_at <= datetime.now(timezone.utc):
+                logging.error("Refresh token has expired (24h SPA session limit). Background refresh stopped.")
+                return
+
+            try:
+                with self._lock:
+                    self._refresh_locked()
+                # Key Vault への保存もバックグラウンドスレッド上で済ませる
+                self.flush()
+                delay = self._next_refresh_delay()
+            except Exception as e:
+                logging.warning(f"Background token refresh failed: {e}")
+                delay = RETRY_INTERVAL
+
+
+_refresher: Optional[TokenRefresher] = None
+_refresher_lock = threading.Lock()
+
+
+def get_refresher() -> TokenRefresher:
+    """プロセス内で共有する TokenRefresher を取得"""
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = TokenRefresher()
+        return _refresher
@@ -0,0 +1,65 @@
+"""集計の更新（src/aggregates.py）"""
+import unittest
+from datetime import datetime, timezone, timedelta
+from src import aggregates
+
+# 日別の集計は保持期間（AGGREGATES_DAYS）を過ぎると消えるため、直近の日付を使う
+DAY0 = (datetime.now(timezone.utc) - timedelta(days=10)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _at(days: int) -> datetime:
+    return DAY0 + timedelta(days=days)
+
+
+def _iso(days: int) -> str:
+    return _at(days).isoformat()
+
+
+def _issue(work_item_id, product="Power Apps", state="Active", created=None, changed=None):
+    return {
+        "workItemId": work_item_id,
+        "product": product,
+        "state": state,
+        "createdDate": created or _iso(0),
+        "changedDate": changed or _iso(1),
+    }
+
+
+class ReconcileTest(unittest.TestCase):
+    def test_issue_removed_between_runs_is_resolved(self):
+        state = aggregates.empty_state()
+
+        # 1回目: 2件とも Active
+        aggregates.apply_changes(state, [_issue(1), _issue(2, product="Power Automate")])
+        self.assertEqual(aggregates.reconcile(state, ["1", "2"]), 0)
+        self.assertEqual(aggregates.build_view(state)["open_total"], 2)
+
+        # 2回目: 1件が解決されて検索結果（Active のみ）から消えた
+        closed_at = _at(2)
+        self.assertEqual(aggregates.reconcile(state, ["1"], closed_at), 1)
+
+        view = aggregates.build_view(state)
+        self.assertEqual(view["open_total"], 1)
+        self.assertEqual(view["open_by_product"], {"Power Apps": 1})
+        self.assertEqual(view["by_state"], {"Active": 1, "Resolved": 1})
+        self.assertEqual(view["resolved_count"], 1)
+        self.assertEqual(view["mean_time_to_resolve_hours"], 48.0)
+
+        # 3回目: 変化なし（二重に数えない）
+        self.assertEqual(aggregates.reconcile(state, ["1"], closed_at), 0)
+        self.assertEqual(aggregates.build_view(state)["resolved_count"], 1)
+
+    def test_reappearing_issue_is_reopened(self):
+        state = aggregates.empty_state()
+        aggregates.apply_changes(state, [_issue(1)])
+        aggregates.reconcile(state, [], _at(2))
+
+        aggregates.apply_changes(state, [_issue(1, changed=_iso(3))])
+
+        view = aggregates.build_view(state)
+        self.assertEqual(view["open_total"], 1)
+        self.assertEqual(view["daily"][_at(3).strftime("%Y-%m-%d")], {"reopened": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()